@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import threading
+import orjson
+from collections import OrderedDict
+from fastapi import Request, Response
+from .metrics import record_cache_result
+
+# responses of hot anonymous reads (/users, /chats, public /chats/{id}/messages) kept for a few seconds.
+# keys carry the generation of what they depend on ('users', 'chats', 'chat:<id>'), and writes bump it
+# (crud), so a write makes the old entries unreachable instead of deleting them. a page rendered from a
+# lagging replica may outlive the write that bumped it, for at most the TTL
+
+CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '5'))
+CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2048'))
+# a redis shared by every worker and container; unset, each process caches for itself
+CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL')
+
+
+class MemoryStore:
+    # LRU with a per-entry deadline; generations are plain counters, never evicted
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def counter(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def incr(self, name: str):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+
+class RedisStore:
+    def __init__(self, url: str, prefix: str = 'tears:cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    def counter(self, name: str) -> int:
+        return int(self.client.get(self.prefix + 'gen:' + name) or 0)
+
+    def incr(self, name: str):
+        self.client.incr(self.prefix + 'gen:' + name)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+store = RedisStore(CACHE_REDIS_URL) if CACHE_REDIS_URL else MemoryStore()
+
+
+def invalidate(*scopes: str):
+    for scope in scopes:
+        store.incr(scope)
+
+
+def cache_key(route: str, params: dict, scopes) -> str:
+    # the same page however the query string was written: defaults applied, order and empties dropped
+    query = '&'.join(f'{k}={params[k]}' for k in sorted(params) if params[k] is not None)
+    generations = ','.join(f'{scope}:{store.counter(scope)}' for scope in scopes)
+    return f'{route}?{query}#{generations}'
+
+
+def encode(payload) -> bytes:
+    # payloads are plain dicts of rows (see crud), orjson writes them without a jsonable_encoder pass
+    return orjson.dumps(payload)
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _respond(request: Request, etag: str, body: bytes) -> Response:
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def cached(request: Request, route: str, params: dict, build, scopes=(), cacheable=True):
+    # build() returns the payload dict; errors it raises are not cached
+    if not cacheable:
+        record_cache_result(route, 'bypass')
+        return Response(content=encode(build()), media_type='application/json')
+    key = cache_key(route, params, scopes)
+    value = store.get(key)
+    if value is not None:
+        record_cache_result(route, 'hit')
+        etag, body = value.split(b' ', 1)
+        return _respond(request, etag.decode(), body)
+    record_cache_result(route, 'miss')
+    body = encode(build())
+    etag = _etag(body)
+    store.set(key, etag.encode() + b' ' + body, CACHE_TTL)
+    return _respond(request, etag, body)
@@ -1,11 +1,24 @@
 from sqlalchemy.orm import Session
 from . import models
+from .search import match_clause, chat_name_match, chat_name_index
+from .partitions import date_bounds
+from .cache import invalidate
 from typing import List, Optional
-from sqlalchemy import func
+from sqlalchemy import func, select, tuple_, insert, delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from .security import hash_password
 from .schemas import UserCreate
 
 MAX_PER_PAGE = 250
+# the list endpoints read plain rows in their response's field order (no ORM instances) and encode them
+# straight to JSON; a row's _asdict() is the item
+USER_FIELDS = (models.User.id, models.User.username, models.User.display_name, models.User.email, models.User.is_active, models.User.created_at)
+CHAT_FIELDS = (models.Chat.id, models.Chat.name, models.Chat.is_private, models.Chat.created_at)
+MESSAGE_FIELDS = (
+	models.Message.id, models.Message.chat_id, models.Message.user_id, models.User.username, models.User.display_name,
+	models.Message.content, models.Message.created_at,
+)
 
 def paginate_query(query, page: int = 1, per_page: int = 50):
 	per_page = min(per_page, MAX_PER_PAGE)
@@ -36,11 +49,12 @@ def create_user(db: Session, user: UserCreate):
 	db_user = models.User(email=user.email, password_hash=hashed, username=getattr(user, 'username', None), display_name=getattr(user, 'display_name', None))
 	db.add(db_user)
 	db.commit()
+	invalidate('users')
 	db.refresh(db_user)
 	return db_user
 
 def list_users(db: Session, page: int = 1, per_page: int = 50):
-	q = db.query(models.User).order_by(models.User.id)
+	q = db.query(*USER_FIELDS).order_by(models.User.id)
 	return paginate_query(q, page, per_page)
 
 # chat
@@ -55,6 +69,7 @@ def create_chat(db, chat_create, creator_user=None):
 		participant = models.ChatMember(chat_id=chat.id, user_id=creator_user.id, role="owner")
 		db.add(participant)
 		db.commit()
+	invalidate('chats')
 	return chat
 
 def add_chat_member(db, chat_id: int, user_id: int, role: str = "member"):
@@ -63,7 +78,20 @@ def add_chat_member(db, chat_id: int, user_id: int, role: str = "member"):
 	if exists:
 		return exists
 	member = models.ChatMember(chat_id=chat_id, user_id=user_id, role=role)
-	db.add(member); db.commit(); db.refresh(member)
+	db.add(member)
+	try:
+		db.commit()
+	except IntegrityError:
+		# a concurrent join won the race for the (chat_id, user_id) constraint; with no such row it was
+		# something else (a user or chat that does not exist) and goes to the caller
+		db.rollback()
+		member = db.query(models.ChatMember).filter_by(chat_id=chat_id, user_id=user_id).first()
+		if member is None:
+			raise
+		return member
+	# member counts in the chat list
+	invalidate('chats', f'chat:{chat_id}')
+	db.refresh(member)
 	return member
 
 def find_user_by_username(db: Session, username: str):
@@ -76,39 +104,48 @@ def get_chat(db, chat_id: int):
     return db.query(models.Chat).filter(models.Chat.id == chat_id).first()
 
 def list_chats(db: Session, page: int = 1, per_page: int = 50, search: Optional[str] = None):
-	q = db.query(models.Chat)
-	if search:
-		q = q.filter(models.Chat.name.ilike(f"%{search}%"))
-
-	chats = q.all()
-
-	msg_counts = dict(
-		db.query(models.Message.chat_id, func.count(models.Message.id))
-		.group_by(models.Message.chat_id)
-		.all()
-	)
-	member_counts = dict(
-		db.query(models.ChatMember.chat_id, func.count(models.ChatMember.id))
-		.group_by(models.ChatMember.chat_id)
-		.all()
-	)
-
-	decorated = [
-		{
-			"chat": chat,
-			"message_count": msg_counts.get(chat.id, 0),
-			"member_count": member_counts.get(chat.id, 0),
-		}
-		for chat in chats
-	]
-
-	decorated.sort(key=lambda x: (x["message_count"], x["member_count"], x["chat"].created_at), reverse=True)
-
-	total_items = len(decorated)
 	per_page = min(per_page, MAX_PER_PAGE)
 	page = max(page, 1)
 	start = (page - 1) * per_page
-	items = decorated[start:start + per_page]
+	C = models.Chat
+
+	# counted per listed chat (index on chat_id) instead of aggregating every message
+	message_count = select(func.count(models.Message.id)).where(models.Message.chat_id == C.id).correlate(C).scalar_subquery()
+	member_count = select(func.count(models.ChatMember.id)).where(models.ChatMember.chat_id == C.id).correlate(C).scalar_subquery()
+	activity = (message_count.desc(), member_count.desc(), C.created_at.desc(), C.id.desc())
+
+	match = chat_name_match(db, search) if search else None
+	if search and match is None:
+		# no pg_trgm: match in the process-local trigram index, then order and page only the matches
+		scores = chat_name_index(db).search(search)
+		rows = db.query(*CHAT_FIELDS, message_count, member_count).filter(C.id.in_(scores)).all() if scores else []
+		rows.sort(key=lambda r: (scores[r[0]], r[4] or 0, r[5] or 0, r[3], r[0]), reverse=True)
+		total_items = len(rows)
+		page_rows = rows[start:start + per_page]
+	else:
+		q = db.query(*CHAT_FIELDS, message_count, member_count)
+		total = db.query(func.count(C.id))
+		if match is not None:
+			where, relevance = match
+			q = q.filter(where).order_by(relevance.desc(), *activity)
+			total = total.filter(where)
+		else:
+			q = q.order_by(*activity)
+		total_items = total.scalar()
+		page_rows = q.offset(start).limit(per_page).all()
+
+	# in ChatOut's field order; the endpoint adds the viewer's role
+	items = [
+		{
+			"id": chat_id,
+			"name": name,
+			"is_private": is_private,
+			"created_at": created_at,
+			"member_count": members or 0,
+			"message_count": messages or 0,
+		}
+		for chat_id, name, is_private, created_at, messages, members in page_rows
+	]
 	total_pages = (total_items + per_page - 1) // per_page if total_items else 0
 
 	return {
@@ -121,21 +158,39 @@ def list_chats(db: Session, page: int = 1, per_page: int = 50, search: Optional[
 
 # messages
 def list_messages(db: Session, page: int = 1, per_page: int = 50, user_id: Optional[int]=None, chat_id: Optional[int]=None, q_text: Optional[str]=None, start_date=None, end_date=None):
-	q = db.query(models.Message)
+	# the author's names come along in the same query
+	q = db.query(*MESSAGE_FIELDS).outerjoin(models.User, models.User.id == models.Message.user_id)
 	if user_id:
 		q = q.filter(models.Message.user_id == user_id)
 	if chat_id:
 		q = q.filter(models.Message.chat_id == chat_id)
 	if q_text:
-		q = q.filter(models.Message.content.ilike(f"%{q_text}%"))
-	if start_date:
-		q = q.filter(models.Message.created_at >= start_date)
-	if end_date:
-		q = q.filter(models.Message.created_at <= end_date)
+		# word match through the full-text index instead of a sequential ILIKE scan
+		q = q.filter(match_clause(db, q_text))
+	# typed bounds (not strings) so postgres prunes the monthly partitions at plan time
+	start, end = date_bounds(start_date, end_date)
+	if start:
+		q = q.filter(models.Message.created_at >= start)
+	if end:
+		q = q.filter(models.Message.created_at < end)
 	q = q.order_by(models.Message.created_at.desc())
 	return paginate_query(q, page, per_page)
 
 
+def iter_messages(db: Session, chat_id: Optional[int] = None, user_id: Optional[int] = None, after=None, batch: int = 1000):
+	# oldest first, resumable from an (created_at, id) position; streamed through a server-side cursor
+	# instead of counted and paged
+	M = models.Message
+	q = db.query(*MESSAGE_FIELDS).outerjoin(models.User, models.User.id == M.user_id)
+	if chat_id:
+		q = q.filter(M.chat_id == chat_id)
+	if user_id:
+		q = q.filter(M.user_id == user_id)
+	if after:
+		q = q.filter(tuple_(M.created_at, M.id) > tuple_(*after))
+	return q.order_by(M.created_at, M.id).yield_per(batch)
+
+
 def get_message(db: Session, message_id: int):
 	return db.query(models.Message).filter(models.Message.id == message_id).first()
 
@@ -144,5 +199,108 @@ def create_message(db: Session, user_id: int, chat_id: int, content: str):
 	msg = models.Message(user_id=user_id, chat_id=chat_id, content=content)
 	db.add(msg)
 	db.commit()
+	invalidate(f'chat:{chat_id}')
 	db.refresh(msg)
-	return msg
\ No newline at end of file
+	return msg
+
+def create_messages_bulk(db: Session, user_id: int, items, admit=None):
+	# the checks of POST /messages for a whole batch: every chat and the sender's membership in one query,
+	# the accepted messages in one multi-row INSERT .. RETURNING, one commit.
+	# admit(chat_id, count) -> (admitted, rejection) applies the rate limits to a chat's valid items: the
+	# first `admitted` go in, the rest are rejected with the `rejection` fields.
+	# returns a result per item, in order, and the inserted (id, chat_id, content, created_at) rows
+	C, M = models.Chat, models.ChatMember
+	chats = {
+		row.id: row for row in db.execute(
+			select(C.id, C.is_private, M.id.label('member_id'))
+			.outerjoin(M, (M.chat_id == C.id) & (M.user_id == user_id))
+			.where(C.id.in_({item.chat_id for item in items}))
+		)
+	}
+	results, by_chat = [], {}
+	for index, item in enumerate(items):
+		chat = chats.get(item.chat_id)
+		if not item.content or not item.content.strip():
+			error = 'send only text messages'
+		elif chat is None:
+			error = 'Chat not found'
+		elif chat.is_private and chat.member_id is None:
+			error = 'You are not a member of this chat'
+		else:
+			by_chat.setdefault(item.chat_id, []).append(index)
+			results.append(None)
+			continue
+		results.append({'index': index, 'status': 'rejected', 'detail': error})
+	if admit is not None:
+		for chat_id, indexes in by_chat.items():
+			admitted, rejection = admit(chat_id, len(indexes))
+			for index in indexes[admitted:]:
+				results[index] = {'index': index, 'status': 'rejected', **rejection}
+			del indexes[admitted:]
+	accepted = sorted(index for indexes in by_chat.values() for index in indexes)
+	if not accepted:
+		return results, []
+	rows = [{'chat_id': items[index].chat_id, 'user_id': user_id, 'content': items[index].content} for index in accepted]
+	Msg = models.Message
+	created = db.execute(
+		insert(Msg).returning(Msg.id, Msg.chat_id, Msg.content, Msg.created_at, sort_by_parameter_order=True),
+		rows,
+	).all()
+	db.commit()
+	invalidate(*{f'chat:{row.chat_id}' for row in created})
+	for index, row in zip(accepted, created):
+		results[index] = {'index': index, 'status': 'created', 'id': row.id, 'chat_id': row.chat_id, 'created_at': row.created_at}
+	return results, created
+
+def _resolve_members(db: Session, chat_id: int, user_ids, usernames):
+	# every requested user (by id or username) and their membership of the chat, in one query
+	U, M = models.User, models.ChatMember
+	wanted = []
+	if user_ids:
+		wanted.append(U.id.in_(set(user_ids)))
+	if usernames:
+		wanted.append(U.username.in_(set(usernames)))
+	if not wanted:
+		return [], []
+	rows = db.execute(
+		select(U.id, U.username, M.id.label('member_id'), M.role)
+		.outerjoin(M, (M.chat_id == chat_id) & (M.user_id == U.id))
+		.where(or_(*wanted))
+	).all()
+	ids, names = {row.id for row in rows}, {row.username for row in rows}
+	not_found = [i for i in dict.fromkeys(user_ids) if i not in ids] + [n for n in dict.fromkeys(usernames) if n not in names]
+	return rows, not_found
+
+def add_chat_members(db: Session, chat_id: int, user_ids, usernames, role: str = "member"):
+	# POST /members for a whole list: one query resolves the users, one INSERT .. ON CONFLICT DO NOTHING adds the
+	# new ones (a concurrent join of the same user is skipped, not an error), one commit and one invalidation
+	rows, not_found = _resolve_members(db, chat_id, user_ids, usernames)
+	new = sorted({row.id for row in rows if row.member_id is None})
+	already = sorted({row.id for row in rows if row.member_id is not None})
+	if new:
+		dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+		db.execute(
+			dialect.insert(models.ChatMember).on_conflict_do_nothing(index_elements=['chat_id', 'user_id']),
+			[{'chat_id': chat_id, 'user_id': user_id, 'role': role} for user_id in new],
+		)
+		db.commit()
+		# member counts in the chat list
+		invalidate('chats', f'chat:{chat_id}')
+	return {'added': new, 'already_members': already, 'not_found': not_found}
+
+def remove_chat_members(db: Session, chat_id: int, user_ids, usernames):
+	# the reverse: one DELETE for the memberships found (owners are kept) and their change_log rows in one
+	# INSERT, since a bulk delete skips the ORM after_delete hook the ETL relies on
+	rows, not_found = _resolve_members(db, chat_id, user_ids, usernames)
+	members = {row.member_id: row.id for row in rows if row.member_id is not None and row.role != 'owner'}
+	owners = sorted({row.id for row in rows if row.role == 'owner'})
+	not_members = sorted({row.id for row in rows if row.member_id is None})
+	if members:
+		db.execute(delete(models.ChatMember).where(models.ChatMember.id.in_(members)))
+		db.execute(insert(models.ChangeLog), [
+			{'entity': 'chat_members', 'entity_id': member_id, 'chat_id': chat_id, 'user_id': user_id, 'op': 'delete'}
+			for member_id, user_id in members.items()
+		])
+		db.commit()
+		invalidate('chats', f'chat:{chat_id}')
+	return {'removed': sorted(members.values()), 'owners': owners, 'not_members': not_members, 'not_found': not_found}
\ No newline at end of file
@@ -0,0 +1,47 @@
+import io
+import os
+import csv
+import orjson
+from datetime import datetime
+from .ratelimit import limiter
+
+# bulk history for compliance exports and client re-syncs: rows are streamed from a server-side cursor
+# (crud.iter_messages) and written out in chunks, so memory stays flat whatever the size of the chat
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+CHUNK_ROWS = 500
+# per user: a few export starts, then one every 60 / EXPORTS_PER_MINUTE seconds
+EXPORTS_PER_MINUTE = float(os.getenv('EXPORTS_PER_MINUTE', '6'))
+EXPORT_BURST = int(os.getenv('EXPORT_BURST', '3'))
+export_limiter = limiter('export', EXPORTS_PER_MINUTE / 60, EXPORT_BURST)
+
+
+def _ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(orjson.dumps(row._asdict()))
+        if len(chunk) == CHUNK_ROWS:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = []
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def _csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([v.isoformat() if isinstance(v, datetime) else v for v in row])
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def stream(rows, fmt: str, fields):
+    # bytes chunks; to resume, pass the id of the last row received as after_id
+    return _csv(rows, fields) if fmt == 'csv' else _ndjson(rows)
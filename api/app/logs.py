@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+from .metrics import record_log_dropped
+
+# structured logs without blocking the request path: handlers on the root logger only put the record on a
+# bounded queue, and a writer thread encodes it (orjson) and writes it to stderr for promtail. when the
+# writer falls behind (docker / promtail not reading) records are dropped and counted
+# (log_records_dropped_total) instead of making requests and websocket sends wait on the pipe.
+#
+# events are dicts: log_event(logger, logging.INFO, "websocket_message", chat_id=...). the timestamp comes
+# from the record, formatted once per second. LOG_SAMPLE keeps a fraction of an event,
+# e.g. LOG_SAMPLE="websocket_message=0.1,http_request=0.5"; kept lines carry sample_rate.
+# LOG_ASYNC=0 writes from the calling thread (same format), for debugging
+
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_ASYNC = os.getenv('LOG_ASYNC', '1') == '1'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_sample_rates(spec: str) -> dict:
+    rates = {}
+    for item in spec.split(','):
+        name, sep, rate = item.partition('=')
+        if sep and name.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE', ''))
+
+# (second, text): swapped as one tuple, so readers on other threads never see half of it
+_stamp = (None, '')
+
+
+def timestamp(created: float) -> str:
+    global _stamp
+    second = int(created)
+    cached = _stamp
+    if cached[0] != second:
+        cached = _stamp = (second, time.strftime(TIMESTAMP_FORMAT, time.gmtime(second)))
+    return cached[1]
+
+
+class Event(dict):
+    # the log message of a structured event; encoded lazily, str() gives the JSON line
+    def encode(self, created: float) -> str:
+        return orjson.dumps({"timestamp": timestamp(created), **self}, default=str).decode()
+
+    def __str__(self):
+        return self.encode(time.time())
+
+
+def keep(event: str) -> bool:
+    rate = SAMPLE_RATES.get(event)
+    return rate is None or random.random() < rate
+
+
+def log_event(logger: logging.Logger, level: int, event: str, sampled: bool = False, **fields):
+    # sampled=True when the caller already asked keep(event) (to skip work only the log line needs)
+    if not logger.isEnabledFor(level):
+        return
+    if not sampled and not keep(event):
+        return
+    rate = SAMPLE_RATES.get(event)
+    if rate is not None and rate < 1.0:
+        fields["sample_rate"] = rate
+    logger.log(level, Event(event=event, **fields))
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, Event) and not record.args:
+            line = record.msg.encode(record.created)
+        else:
+            line = record.getMessage()
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the record goes to a thread in this process as is: formatting it here is the work we are moving off
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            record_log_dropped()
+
+
+_lock = threading.Lock()
+_listener = None
+
+
+def setup_logging(level: int = logging.INFO):
+    # like logging.basicConfig: leaves a root logger that is already configured (pytest, a --log-config) alone
+    global _listener
+    with _lock:
+        root = logging.getLogger()
+        if root.handlers:
+            return
+        root.setLevel(level)
+        writer = logging.StreamHandler(sys.stderr)
+        writer.setFormatter(JsonLineFormatter())
+        if not LOG_ASYNC:
+            root.addHandler(writer)
+            return
+        records = queue.Queue(LOG_QUEUE_SIZE)
+        root.addHandler(DroppingQueueHandler(records))
+        _listener = QueueListener(records, writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    # writes out what is still queued
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
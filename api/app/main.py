@@ -1,33 +1,54 @@
-from fastapi import FastAPI, Query, Depends, HTTPException, status, APIRouter, security, WebSocket, Request
+from fastapi import FastAPI, Query, Depends, HTTPException, status, APIRouter, security, WebSocket, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from prometheus_fastapi_instrumentator import Instrumentator
 from .metrics import metrics_middleware, get_metrics
+from .profiling import sql_profiling_middleware, slow_requests, ProfiledRoute
+from .logs import setup_logging, log_event, keep
+from .sampler import profiler, MAX_PROFILE_SECONDS
 from .security import decode_access_token, create_access_token, verify_password
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, IntegrityError
 from sqlalchemy.orm import Session
-from .database import SessionLocal, engine
-from . import models, schemas, crud
+from .database import SessionLocal, ReadSessionLocal, READ_YOUR_WRITES_SECONDS
+from . import database
+from . import models, schemas, crud, search
+from .cache import cached, CACHE_TTL, CACHE_REDIS_URL, MemoryStore, RedisStore
+from .ratelimit import enforce, check, message_user_limiter, message_chat_limiter, auth_ip_limiter, login_user_limiter, bulk_user_limiter, bulk_message_limiter
+from . import export
 from typing import Optional
 from .websocket import websocket_endpoint, manager
+from .partitions import PartitionKeeper
+from contextlib import asynccontextmanager
+import os
+import math
 import logging
-import json
 import time
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/auth/token", auto_error=False)
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], route_class=ProfiledRoute)
 
-app = FastAPI(title='tears API')
+# next months' messages partitions while the api runs (entrypoint.sh makes them at start); one worker at a time
+partition_keeper = PartitionKeeper(database.engine)
 
-logging.basicConfig(
-	level=logging.INFO,
-	format='%(message)s'
-)
+@asynccontextmanager
+async def lifespan(app):
+	partition_keeper.start()
+	yield
+	partition_keeper.stop()
+
+app = FastAPI(title='tears API', lifespan=lifespan)
+# sync endpoints mark their thread for the slow request sampler
+app.router.route_class = ProfiledRoute
+
+setup_logging()
 logger = logging.getLogger("tears-api")
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-	if request.url.path == "/metrics":
+	# a request left out by LOG_SAMPLE skips the token decode too
+	if request.url.path == "/metrics" or not keep("http_request"):
 		return await call_next(request)
 	
 	start_time = time.time()
@@ -49,19 +70,16 @@ async def log_requests(request: Request, call_next):
 	
 	process_time = time.time() - start_time
 	
-	# structured log in JSON for Loki
-	log_data = {
-		"timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
-		"method": request.method,
-		"path": request.url.path,
-		"status_code": response.status_code,
-		"duration_ms": round(process_time * 1000, 2),
-		"user_id": user_id,
-		"query_params": dict(request.query_params) if request.query_params else None,
-		"client_host": request.client.host if request.client else None,
-	}
-	
-	logger.info(json.dumps(log_data))
+	# structured log in JSON for Loki (encoded and written by the log writer thread, app/logs.py)
+	log_event(logger, logging.INFO, "http_request", sampled=True,
+		method=request.method,
+		path=request.url.path,
+		status_code=response.status_code,
+		duration_ms=round(process_time * 1000, 2),
+		user_id=user_id,
+		query_params=dict(request.query_params) if request.query_params else None,
+		client_host=request.client.host if request.client else None,
+	)
 	
 	return response
 
@@ -75,33 +93,97 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-Instrumentator().instrument(app).expose(app)
-
+# /metrics is the route at the bottom; with several workers it adds up all of them (app/metrics.py)
 app.middleware("http")(metrics_middleware)
+# a pass-through unless SQL_PROFILING=1 (or a test is tracking queries)
+app.middleware("http")(sql_profiling_middleware)
 
-# Only create tables if not in test mode
-import sys
-if "pytest" not in sys.modules:
-    models.Base.metadata.create_all(bind=engine)
+# the schema is managed by the migrations (alembic upgrade head, run by the container entrypoint)
 
 app.include_router(router)
 
-def get_db():
+# set on responses to writes while replicas are in use; until it expires the client reads from the primary
+READ_PRIMARY_COOKIE = "tears_read_primary"
+# and the same window by user id, for bearer clients that don't keep cookies; shared like the response cache
+recent_writers = RedisStore(CACHE_REDIS_URL, prefix='tears:wrote:') if CACHE_REDIS_URL else MemoryStore(max_entries=100000)
+
+def get_db(response: Response):
 	db = SessionLocal()
+	db.info["response"] = response
 	try:
 		yield db
 	finally:
 		db.close()
 		db.bind.dispose()
+
+@event.listens_for(Session, "after_commit")
+def pin_reads_to_primary(session):
+	if not database.replicas or READ_YOUR_WRITES_SECONDS <= 0:
+		return
+	# set by get_current_user on the session the write went through
+	user_id = session.info.get("user_id")
+	if user_id is not None:
+		recent_writers.set(f"user:{user_id}", b"1", READ_YOUR_WRITES_SECONDS)
+	response = session.info.get("response")
+	if response is not None:
+		until = time.time() + READ_YOUR_WRITES_SECONDS
+		response.set_cookie(READ_PRIMARY_COOKIE, f"{until:.3f}", max_age=int(READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite="lax")
+
+def wrote_recently(request: Request):
+	# a bearer client's own write in the last READ_YOUR_WRITES_SECONDS; the token is only decoded with replicas in use
+	auth = request.headers.get("authorization", "")
+	if not database.replicas or not auth.startswith("Bearer "):
+		return False
+	try:
+		user_id = int(decode_access_token(auth[7:]).get("sub"))
+	except Exception:
+		return False
+	return recent_writers.get(f"user:{user_id}") is not None
+
+def reads_pinned(request: Request):
+	try:
+		if float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time():
+			return True
+	except ValueError:
+		pass
+	return wrote_recently(request)
+
+def anonymous_read(request: Request):
+	# the same answer for every caller: no token, and no recent write of its own to read back
+	return CACHE_TTL > 0 and "authorization" not in request.headers and not reads_pinned(request)
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+	# read-only endpoints: a replica in round robin, the primary when none is usable or the client just wrote.
+	# the primary session is not connected unless used
+	replica = None if reads_pinned(request) else database.read_replica()
+	if replica is None:
+		yield db
+		return
+	read_db = ReadSessionLocal(bind=replica.engine)
+	try:
+		yield read_db
+	except OperationalError as e:
+		# the next requests go elsewhere until it answers again
+		replica.mark_down(e)
+		raise
+	finally:
+		read_db.close()
 # auth
+def client_ip(request: Request):
+	return request.client.host if request.client else "unknown"
+
 @router.post("/register", response_model=schemas.UserOut)
-def register(payload: schemas.UserCreate, db: Session = Depends(get_db)):
+def register(request: Request, payload: schemas.UserCreate, db: Session = Depends(get_db)):
+	enforce(auth_ip_limiter, client_ip(request), detail="Too many attempts, retry later")
 	if crud.get_user_by_email(db, payload.email):
 		raise HTTPException(status_code=400, detail="Email already registered")
 	return crud.create_user(db, payload)
 
 @router.post("/token", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+	# throttled before the argon2 check: per address, and per account against spread out guessing
+	enforce(auth_ip_limiter, client_ip(request), detail="Too many attempts, retry later")
+	enforce(login_user_limiter, form_data.username.lower(), detail="Too many attempts, retry later")
 	# allow login with email or username
 	identifier = form_data.username
 	user = crud.get_user_by_email(db, identifier) or crud.get_user_by_username(db, identifier)
@@ -120,6 +202,8 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 	user = crud.get_user(db, user_id)
 	if user is None:
 		raise credentials_exception
+	# whatever this request commits pins the user's next reads to the primary
+	db.info["user_id"] = user_id
 	return user
 
 
@@ -132,6 +216,8 @@ def get_current_user_optional(token: Optional[str] = Depends(oauth2_scheme_optio
 	except Exception:
 		return None
 	user = crud.get_user(db, user_id)
+	if user is not None:
+		db.info["user_id"] = user_id
 	return user
 
 @router.get("/me", response_model=schemas.UserOut)
@@ -141,12 +227,14 @@ def get_current_user_info(me = Depends(get_current_user)):
 # user 	
 	
 @app.get('/users', response_model=dict)
-def list_users(page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), db: Session = Depends(get_db)):
-	data = crud.list_users(db, page, per_page)
-	return {
-		'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
-		'items': [schemas.UserOut.from_orm(u).dict() for u in data['items']]
-	}
+def list_users(request: Request, page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), db: Session = Depends(get_read_db)):
+	def build():
+		data = crud.list_users(db, page, per_page)
+		return {
+			'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
+			'items': [u._asdict() for u in data['items']]
+		}
+	return cached(request, 'users', {'page': page, 'per_page': per_page}, build, scopes=('users',), cacheable=anonymous_read(request))
 
 # chat
 def user_is_participant(db, chat_id, user_id):
@@ -172,8 +260,14 @@ def create_chat(payload: schemas.ChatCreate, db: Session = Depends(get_db), me=D
 	})
 	return chat_dict
 
+# the websocket loop applies the same two limits (app/websocket.py)
+def enforce_message_limits(user_id: int, chat_id: int):
+	enforce(message_user_limiter, user_id, detail="Too many messages, slow down")
+	enforce(message_chat_limiter, chat_id, detail="Too many messages in this chat, slow down")
+
 @app.post('/chats/{id}/messages', response_model=schemas.MessageOut)
 def send_message(id: int, payload: schemas.ChatMessageCreate, db: Session = Depends(get_db), me=Depends(get_current_user)):
+	enforce_message_limits(me.id, id)
 	# use the path id as the chat identifier
 	chat = crud.get_chat(db, id)
 	if not chat:
@@ -182,10 +276,7 @@ def send_message(id: int, payload: schemas.ChatMessageCreate, db: Session = Depe
 	if chat.is_private and not crud.user_is_participant(db, id, me.id):
 		raise HTTPException(status_code=403, detail="Not a participant")
 	# create message with authenticated user
-	msg = models.Message(user_id=me.id, chat_id=id, content=payload.content)
-	db.add(msg)
-	db.commit()
-	db.refresh(msg)
+	msg = crud.create_message(db, me.id, id, payload.content)
 	# return with username and display_name
 	msg_dict = schemas.MessageOut.from_orm(msg).dict()
 	msg_dict["username"] = me.username
@@ -225,34 +316,52 @@ def add_member(chat_id: int, payload: schemas.MemberCreate, db: Session = Depend
 	if not user_id:
 		raise HTTPException(status_code=400, detail="user_id or username is required")
 
-	member = crud.add_chat_member(db, chat_id, user_id)
+	try:
+		member = crud.add_chat_member(db, chat_id, user_id)
+	except IntegrityError:
+		# not a duplicate (add_chat_member handles those): the user_id foreign key, no such user
+		raise HTTPException(status_code=404, detail="User not found")
 	return {"id": member.id, "chat_id": member.chat_id, "user_id": member.user_id}
 
+def require_owner(db, chat_id: int, user_id: int, detail: str):
+	if not db.query(models.ChatMember.id).filter_by(chat_id=chat_id, user_id=user_id, role="owner").first():
+		raise HTTPException(status_code=403, detail=detail)
+
+# a team at a time: {"user_ids": [...], "usernames": [...]}, unknown users are reported back instead of failing the batch
+@app.post('/chats/{chat_id}/members/bulk', response_model=dict, response_class=ORJSONResponse)
+def add_members_bulk(chat_id: int, payload: schemas.MemberBatch, db: Session = Depends(get_db), me = Depends(get_current_user)):
+	require_owner(db, chat_id, me.id, "Only owner can add members")
+	return crud.add_chat_members(db, chat_id, payload.user_ids, payload.usernames)
+
+@app.post('/chats/{chat_id}/members/bulk/remove', response_model=dict, response_class=ORJSONResponse)
+def remove_members_bulk(chat_id: int, payload: schemas.MemberBatch, db: Session = Depends(get_db), me = Depends(get_current_user)):
+	require_owner(db, chat_id, me.id, "Only owner can remove members")
+	return crud.remove_chat_members(db, chat_id, payload.user_ids, payload.usernames)
+
 
 @app.get('/chats', response_model=dict)
-def list_chats(page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), search: Optional[str] = Query(None), db: Session = Depends(get_db), me=Depends(get_current_user_optional)):
-	data = crud.list_chats(db, page, per_page, search=search)
-	items = []
-	for entry in data['items']:
-		chat = entry['chat']
-		role = None
-		if me:
-			member = db.query(models.ChatMember).filter_by(chat_id=chat.id, user_id=me.id).first()
-			role = member.role if member else None
-		chat_dict = schemas.ChatOut.from_orm(chat).dict()
-		chat_dict.update({
-			"member_count": entry["member_count"],
-			"message_count": entry["message_count"],
-			"role": role,
-		})
-		items.append(chat_dict)
-	return {
-		'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
-		'items': items
-	}
+def list_chats(request: Request, page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), search: Optional[str] = Query(None), db: Session = Depends(get_read_db), me=Depends(get_current_user_optional)):
+	def build():
+		data = crud.list_chats(db, page, per_page, search=search)
+		items = data['items']
+		roles = {}
+		if me and items:
+			# the viewer's role in every listed chat, in one query
+			roles = dict(db.query(models.ChatMember.chat_id, models.ChatMember.role).filter(
+				models.ChatMember.user_id == me.id, models.ChatMember.chat_id.in_([c['id'] for c in items])
+			).all())
+		for chat in items:
+			chat['role'] = roles.get(chat['id'])
+		return {
+			'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
+			'items': items
+		}
+	# message counts in the list may be up to the cache ttl old; new chats and members invalidate it
+	params = {'page': page, 'per_page': per_page, 'search': search.strip().lower() if search else None}
+	return cached(request, 'chats', params, build, scopes=('chats',), cacheable=me is None and anonymous_read(request))
 
 @app.get('/chats/{chat_id}', response_model=schemas.ChatOut)
-def get_chat(chat_id: int, db: Session = Depends(get_db), me=Depends(get_current_user_optional)):
+def get_chat(chat_id: int, db: Session = Depends(get_read_db), me=Depends(get_current_user_optional)):
 	chat = crud.get_chat(db, chat_id)
 	if not chat:
 		raise HTTPException(status_code=404, detail="Chat not found")
@@ -271,25 +380,57 @@ def get_chat(chat_id: int, db: Session = Depends(get_db), me=Depends(get_current
 	return chat_dict
 
 @app.get('/chats/{chat_id}/messages', response_model=dict)
-def chat_messages(chat_id: int, page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), db: Session = Depends(get_db), me=Depends(get_current_user_optional)):
-	# check if chat exists
-	chat = crud.get_chat(db, chat_id)
-	if not chat:
-		raise HTTPException(status_code=404, detail="Chat not found")
-	
-	# if chat is private, only members can view messages
-	if chat.is_private and me:
-		if not crud.user_is_participant(db, chat_id, me.id):
-			raise HTTPException(status_code=403, detail="Not a participant")
-	elif chat.is_private and not me:
-		raise HTTPException(status_code=401, detail="Authentication required")
-	
-	data = crud.list_messages(db, page, per_page, chat_id=chat_id)
+def chat_messages(request: Request, chat_id: int, page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), db: Session = Depends(get_read_db), me=Depends(get_current_user_optional)):
+	def build():
+		# check if chat exists
+		chat = crud.get_chat(db, chat_id)
+		if not chat:
+			raise HTTPException(status_code=404, detail="Chat not found")
+
+		# if chat is private, only members can view messages
+		if chat.is_private and me:
+			if not crud.user_is_participant(db, chat_id, me.id):
+				raise HTTPException(status_code=403, detail="Not a participant")
+		elif chat.is_private and not me:
+			raise HTTPException(status_code=401, detail="Authentication required")
+
+		# rows already carry username and display_name
+		data = crud.list_messages(db, page, per_page, chat_id=chat_id)
+		return {
+			'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
+			'items': [m._asdict() for m in data['items']]
+		}
+	# only public chats get here anonymously (private ones raise 401 above, which is never cached)
+	params = {'chat_id': chat_id, 'page': page, 'per_page': per_page}
+	return cached(request, 'chat_messages', params, build, scopes=(f'chat:{chat_id}',), cacheable=me is None and anonymous_read(request))
+
+# messages
+
+@app.get('/messages', response_model=dict)
+def messages(page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), user_id: int = None, chat_id: int = None, q: str = None, start_date: str = None, end_date: str = None, db: Session = Depends(get_read_db)):
+	try:
+		data = crud.list_messages(db, page, per_page, user_id=user_id, chat_id=chat_id, q_text=q, start_date=start_date, end_date=end_date)
+	except ValueError:
+		raise HTTPException(status_code=400, detail='Invalid start_date or end_date')
+	return ORJSONResponse({
+		'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
+		'items': [m._asdict() for m in data['items']]
+	})
+
+
+@app.get('/messages/search', response_model=dict)
+def search_messages(q: str = Query(..., min_length=1, max_length=256), chat_id: int = None, user_id: int = None, start_date: str = None, end_date: str = None, order: str = Query('rank', pattern='^(rank|recent)$'), limit: int = Query(50, ge=1, le=250), cursor: Optional[str] = None, db: Session = Depends(get_read_db), me=Depends(get_current_user_optional)):
+	# private chats are only searched for their members
+	try:
+		data = search.search_messages(db, q, viewer_id=me.id if me else None, chat_id=chat_id, user_id=user_id, start_date=start_date, end_date=end_date, order=order, limit=limit, cursor=cursor)
+	except ValueError:
+		raise HTTPException(status_code=400, detail='Invalid cursor or date')
+	user_ids = {m.user_id for m, _ in data['items']}
+	users = {u.id: u for u in db.query(models.User).filter(models.User.id.in_(user_ids))} if user_ids else {}
 	items = []
-	for m in data['items']:
-		user = db.query(models.User).filter_by(id=m.user_id).first()
-		# build dict manually to include username and display_name
-		payload = {
+	for m, rank in data['items']:
+		user = users.get(m.user_id)
+		items.append({
 			"id": m.id,
 			"chat_id": m.chat_id,
 			"user_id": m.user_id,
@@ -297,26 +438,43 @@ def chat_messages(chat_id: int, page: int = Query(1, ge=1), per_page: int = Quer
 			"display_name": user.display_name if user else None,
 			"content": m.content,
 			"created_at": m.created_at,
-		}
-		items.append(payload)
-	return {
-		'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
-		'items': items
-	}
-
-# messages
-
-@app.get('/messages', response_model=dict)
-def messages(page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=250), user_id: int = None, chat_id: int = None, q: str = None, start_date: str = None, end_date: str = None, db: Session = Depends(get_db)):
-	data = crud.list_messages(db, page, per_page, user_id=user_id, chat_id=chat_id, q_text=q, start_date=start_date, end_date=end_date)
-	return {
-		'meta': {k: data[k] for k in ('page','per_page','total_items','total_pages')},
-		'items': [schemas.MessageOut.from_orm(m).dict() for m in data['items']]
-	}
+			"rank": rank,
+		})
+	return {'items': items, 'next_cursor': data['next_cursor']}
+
+
+@app.get('/messages/export')
+def export_messages(chat_id: int = None, user_id: int = None, format: str = Query('ndjson', pattern='^(ndjson|csv)$'), after_id: Optional[int] = Query(None, ge=1), db: Session = Depends(get_read_db), me=Depends(get_current_user)):
+	# one chat's history, or the caller's own messages, oldest first
+	if (chat_id is None) == (user_id is None):
+		raise HTTPException(status_code=400, detail='Pass either chat_id or user_id')
+	if user_id is not None and user_id != me.id:
+		raise HTTPException(status_code=403, detail='You can only export your own messages')
+	if chat_id is not None:
+		chat = crud.get_chat(db, chat_id)
+		if not chat:
+			raise HTTPException(status_code=404, detail='Chat not found')
+		if chat.is_private and not crud.user_is_participant(db, chat_id, me.id):
+			raise HTTPException(status_code=403, detail='Not a participant')
+	after = None
+	if after_id:
+		created_at = db.query(models.Message.created_at).filter(models.Message.id == after_id).scalar()
+		if created_at is None:
+			raise HTTPException(status_code=400, detail='Unknown after_id')
+		after = (created_at, after_id)
+	enforce(export.export_limiter, me.id, detail='Too many exports, retry later')
+	rows = crud.iter_messages(db, chat_id=chat_id, user_id=user_id, after=after)
+	fields = [c.key for c in crud.MESSAGE_FIELDS]
+	name = f"chat-{chat_id}" if chat_id is not None else f"user-{user_id}"
+	return StreamingResponse(
+		export.stream(rows, format, fields),
+		media_type=export.EXPORT_FORMATS[format],
+		headers={'Content-Disposition': f'attachment; filename="{name}-messages.{format}"'},
+	)
 
 
 @app.get('/messages/{message_id}', response_model=schemas.MessageOut)
-def get_message(message_id: int, db: Session = Depends(get_db)):
+def get_message(message_id: int, db: Session = Depends(get_read_db)):
 	msg = crud.get_message(db, message_id)
 	if not msg:
 		raise HTTPException(status_code=404, detail='Message not found')
@@ -328,6 +486,7 @@ def create_message(payload: schemas.MessageCreate, db: Session = Depends(get_db)
 	# using authenticated user
 	if not payload.content or not payload.content.strip():
 		raise HTTPException(status_code=400, detail='send only text messages')
+	enforce_message_limits(me.id, payload.chat_id)
 	chat = crud.get_chat(db, payload.chat_id)
 	if not chat:
 		raise HTTPException(status_code=404, detail='Chat not found')
@@ -336,15 +495,67 @@ def create_message(payload: schemas.MessageCreate, db: Session = Depends(get_db)
 	msg = crud.create_message(db, me.id, payload.chat_id, payload.content)
 	return msg
 
+def bulk_message_quota(user_id: int):
+	# a bulk request's items are charged per user to the bulk_message bucket (message_user is sized for typing, not
+	# relaying), and per chat to the same bucket as one message at a time. a chat's items are charged with one take
+	# each; when that does not fit they are let in one by one until a bucket runs dry. user tokens spent on items the
+	# chat then refuses are not given back
+	def admit(chat_id: int, count: int):
+		limits = [
+			(bulk_message_limiter, user_id, "Too many messages, slow down"),
+			(message_chat_limiter, chat_id, "Too many messages in this chat, slow down"),
+		]
+		# the all-at-once probe failing is not a rejection yet
+		while limits and not check(limits[0][0], limits[0][1], cost=count, record=False):
+			limits.pop(0)
+		if not limits:
+			return count, {}
+		for admitted in range(count):
+			for bucket, key, detail in limits:
+				wait = check(bucket, key)
+				if wait:
+					return admitted, {"detail": detail, "retry_after": math.ceil(wait)}
+		return count, {}
+	return admit
+
+# messages per websocket event when a bulk insert is relayed to a room
+BULK_BROADCAST_CHUNK = 500
+
+async def broadcast_bulk(rows, user_id: int, username: str):
+	# one "messages" event per chat (per chunk) instead of one per message; rooms nobody is in are skipped
+	by_chat = {}
+	for row in rows:
+		if row.chat_id in manager.active_connections:
+			by_chat.setdefault(row.chat_id, []).append({
+				"message_id": row.id,
+				"content": row.content,
+				"user_id": user_id,
+				"username": username,
+				"chat_id": row.chat_id,
+				"timestamp": row.created_at.isoformat(),
+			})
+	for chat_id, messages in by_chat.items():
+		for start in range(0, len(messages), BULK_BROADCAST_CHUNK):
+			await manager.broadcast_to_chat({"type": "messages", "chat_id": chat_id, "messages": messages[start:start + BULK_BROADCAST_CHUNK]}, chat_id)
+
+@app.post('/messages/bulk', response_model=dict, response_class=ORJSONResponse)
+def create_messages_bulk(payload: schemas.BulkMessageCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db), me=Depends(get_current_user)):
+	# for integrations relaying other systems: items are checked like POST /messages, one by one in the results,
+	# and the accepted ones are written together; live rooms get them after the response
+	enforce(bulk_user_limiter, me.id, detail="Too many bulk requests, retry later")
+	# read before the commit expires `me`
+	user_id, username = me.id, me.username
+	results, created = crud.create_messages_bulk(db, user_id, payload.messages, admit=bulk_message_quota(user_id))
+	if created:
+		background_tasks.add_task(broadcast_bulk, created, user_id, username)
+	# a dict, not a response of its own: the read-your-writes cookie set on commit has to reach the client
+	return {"created": len(created), "rejected": len(results) - len(created), "results": results}
+
 # websocket
 
 @app.websocket("/ws/chats/{chat_id}")
-async def websocket_chat(websocket: WebSocket, chat_id: int, token: str = Query(...)):
-	db = SessionLocal()
-	try:
-		await websocket_endpoint(websocket, chat_id, token, db)
-	finally:
-		db.close()
+async def websocket_chat(websocket: WebSocket, chat_id: int, token: str = Query(...), db: Session = Depends(get_db)):
+	await websocket_endpoint(websocket, chat_id, token, db)
 
 @app.get("/ws/status")
 async def websocket_status():
@@ -356,6 +567,41 @@ async def websocket_status():
 			for chat_id, users in manager.active_connections.items()
 		}
 	}
+# admin -- usernames in ADMIN_USERNAMES (comma separated); nobody when unset
+
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+def get_admin_user(me = Depends(get_current_user)):
+	if me.username not in ADMIN_USERNAMES:
+		raise HTTPException(status_code=403, detail="Admin only")
+	return me
+
+@app.get('/admin/profiler', response_model=dict)
+def profiler_status(me = Depends(get_admin_user)):
+	return profiler.status()
+
+@app.post('/admin/profiler/start', response_model=dict)
+def start_profiler(interval_ms: int = Query(10, ge=1, le=1000), seconds: int = Query(30, ge=1, le=MAX_PROFILE_SECONDS), idle: bool = False, me = Depends(get_admin_user)):
+	if not profiler.start(interval_ms / 1000, seconds, idle):
+		raise HTTPException(status_code=409, detail="Profiler already running")
+	log_event(logger, logging.INFO, "profiler_started", user_id=me.id, interval_ms=interval_ms, seconds=seconds)
+	return profiler.status()
+
+@app.post('/admin/profiler/stop', response_model=dict)
+def stop_profiler(me = Depends(get_admin_user)):
+	profiler.stop()
+	return profiler.status()
+
+# folded stacks of the current or last session: flamegraph.pl profile.folded > profile.svg, or open in speedscope
+@app.get('/admin/profiler/folded', response_class=PlainTextResponse)
+def profiler_folded(me = Depends(get_admin_user)):
+	return PlainTextResponse(profiler.folded())
+
+@app.post('/admin/slow-requests', response_model=dict)
+def set_slow_requests(threshold_ms: int = Query(..., ge=0), me = Depends(get_admin_user)):
+	slow_requests.set_threshold(threshold_ms)
+	return {"threshold_ms": threshold_ms}
+
 # metrics 
 
 @app.get("/metrics")
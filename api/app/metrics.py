@@ -1,6 +1,20 @@
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, REGISTRY
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily
 from fastapi import Request, Response
+from collections import Counter as Tally
+from .topk import SpaceSaving
+import os
+import glob
+import json
 import time
+import atexit
+
+# vários workers (uvicorn --workers, gunicorn): com PROMETHEUS_MULTIPROC_DIR (definido antes de importar
+# prometheus_client, ver entrypoint.sh) cada processo grava seus valores em arquivos nesse diretório e o
+# /metrics de qualquer worker soma todos. METRICS_WORKER_LABEL=1 mantém uma série por worker (label worker=pid)
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_WORKER_LABEL = os.getenv('METRICS_WORKER_LABEL', '0') == '1'
 
 # painel 3
 http_requests_total = Counter(
@@ -20,13 +34,134 @@ http_request_duration_seconds = Histogram(
 # ws
 websocket_connections = Gauge(
     'websocket_connections_active',
-    'Número de conexões WebSocket ativas'
+    'Número de conexões WebSocket ativas',
+    # multiprocesso: soma dos workers vivos
+    multiprocess_mode='livesum'
 )
 
+# sem label por chat: uma série por chat crescia sem limite. os chats mais ativos saem de
+# websocket_hot_chat_messages_total (no máximo WS_HOT_CHATS séries)
 websocket_messages_total = Counter(
     'websocket_messages_total',
-    'Total de mensagens WebSocket enviadas',
-    ['chat_id']
+    'Total de mensagens WebSocket enviadas'
+)
+
+websocket_room_size = Histogram(
+    'websocket_room_size',
+    'Conexões na sala a cada broadcast',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+
+websocket_broadcast_duration_seconds = Histogram(
+    'websocket_broadcast_duration_seconds',
+    'Duração do fan-out de uma mensagem para a sala, em segundos',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+websocket_send_queue_depth = Histogram(
+    'websocket_send_queue_depth',
+    'Envios pendentes na conexão (incluindo este) a cada envio',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+WS_HOT_CHATS = int(os.getenv('WS_HOT_CHATS', '10'))
+hot_chats = SpaceSaving(int(os.getenv('WS_HOT_CHATS_TRACKED', str(WS_HOT_CHATS * 10))))
+
+
+# multiprocesso: cada worker grava o seu sketch em hot_chats_<pid>.json a cada HOT_CHATS_DUMP_SECONDS e no scrape
+# os arquivos são somados
+HOT_CHATS_DUMP_SECONDS = 5
+_next_hot_chats_dump = 0.0
+
+
+def dump_hot_chats():
+    global _next_hot_chats_dump
+    _next_hot_chats_dump = time.monotonic() + HOT_CHATS_DUMP_SECONDS
+    path = os.path.join(MULTIPROC_DIR, f'hot_chats_{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump([[chat_id, count] for chat_id, count, error in hot_chats.top(hot_chats.capacity)], f)
+    os.replace(f'{path}.tmp', path)
+
+
+def top_hot_chats():
+    if not MULTIPROC_DIR:
+        return [(chat_id, count) for chat_id, count, error in hot_chats.top(WS_HOT_CHATS)]
+    dump_hot_chats()
+    merged = Tally()
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, 'hot_chats_*.json')):
+        try:
+            with open(path) as f:
+                for chat_id, count in json.load(f):
+                    merged[chat_id] += count
+        except (OSError, ValueError):
+            continue
+    return merged.most_common(WS_HOT_CHATS)
+
+
+class HotChatsCollector:
+    # só os WS_HOT_CHATS primeiros do sketch a cada scrape; a estimativa pode superestimar em até `error`
+    def collect(self):
+        family = CounterMetricFamily(
+            'websocket_hot_chat_messages',
+            'Mensagens WebSocket dos chats mais ativos (estimativa space-saving)',
+            labels=['chat_id']
+        )
+        for chat_id, count in top_hot_chats():
+            family.add_metric([str(chat_id)], count)
+        yield family
+
+    def describe(self):
+        return []
+
+
+REGISTRY.register(HotChatsCollector())
+
+# sql por requisição (app/profiling.py, com SQL_PROFILING=1); handler = rota declarada, não o path
+db_queries_per_request = Histogram(
+    'db_queries_per_request',
+    'Consultas SQL por requisição HTTP',
+    ['method', 'handler'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+
+db_time_per_request_seconds = Histogram(
+    'db_time_per_request_seconds',
+    'Tempo em consultas SQL por requisição HTTP, em segundos',
+    ['method', 'handler'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+db_repeated_statements_total = Counter(
+    'db_repeated_statements_total',
+    'Requisições que repetiram a mesma consulta além do limite (N+1)',
+    ['method', 'handler']
+)
+
+# cache de respostas (app/cache.py); hit rate = hit / (hit + miss)
+response_cache_requests_total = Counter(
+    'response_cache_requests_total',
+    'Consultas ao cache de respostas',
+    ['route', 'result']
+)
+
+# rate limits (app/ratelimit.py); limit = nome do limitador, não a chave
+rate_limited_requests_total = Counter(
+    'rate_limited_requests_total',
+    'Requisições e mensagens recusadas por limite de taxa',
+    ['limit']
+)
+
+# partições de messages (app/partitions.py): linhas caídas em messages_default, deveria ficar em 0
+messages_default_partition_rows = Gauge(
+    'messages_default_partition_rows',
+    'Linhas em messages_default (nenhuma partição mensal as cobria) na última manutenção',
+    multiprocess_mode='mostrecent'
+)
+
+# logs (app/logs.py): linhas descartadas com a fila do escritor cheia
+log_records_dropped_total = Counter(
+    'log_records_dropped_total',
+    'Linhas de log descartadas porque a fila de escrita estava cheia'
 )
 
 
@@ -56,10 +191,50 @@ async def metrics_middleware(request: Request, call_next):
     return response
 
 
+class PerWorkerCollector:
+    # como MultiProcessCollector, mas sem somar os workers: os arquivos de cada pid viram séries com worker=pid
+    def __init__(self, path: str):
+        self.path = path
+
+    def collect(self):
+        by_pid = {}
+        for path in glob.glob(os.path.join(self.path, '*.db')):
+            pid = os.path.basename(path)[:-3].rsplit('_', 1)[-1]
+            by_pid.setdefault(pid, []).append(path)
+        families = {}
+        for pid, files in sorted(by_pid.items()):
+            for metric in multiprocess.MultiProcessCollector.merge(files, accumulate=True):
+                family = families.setdefault(metric.name, metric)
+                samples = [s._replace(labels={**s.labels, 'worker': pid}) for s in metric.samples]
+                if family is metric:
+                    metric.samples = samples
+                else:
+                    family.samples.extend(samples)
+        return families.values()
+
+
+def scrape_registry():
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    # um registry por scrape, como pede o modo multiprocesso do prometheus_client
+    registry = CollectorRegistry()
+    if METRICS_WORKER_LABEL:
+        registry.register(PerWorkerCollector(MULTIPROC_DIR))
+    else:
+        multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+    registry.register(HotChatsCollector())
+    return registry
+
+
+if MULTIPROC_DIR:
+    # os gauges "live" deste processo deixam de contar quando ele sai
+    atexit.register(lambda: multiprocess.mark_process_dead(os.getpid(), MULTIPROC_DIR))
+
+
 def get_metrics():
     return Response(
-        content=generate_latest(REGISTRY),
-        media_type="text/plain"
+        content=generate_latest(scrape_registry()),
+        media_type=CONTENT_TYPE_LATEST
     )
 
 
@@ -72,4 +247,39 @@ def decrement_websocket_connections():
 
 
 def record_websocket_message(chat_id: int):
-    websocket_messages_total.labels(chat_id=str(chat_id)).inc()
\ No newline at end of file
+    websocket_messages_total.inc()
+    hot_chats.offer(chat_id)
+    if MULTIPROC_DIR and time.monotonic() >= _next_hot_chats_dump:
+        dump_hot_chats()
+
+
+def record_websocket_broadcast(room_size: int, seconds: float):
+    websocket_room_size.observe(room_size)
+    websocket_broadcast_duration_seconds.observe(seconds)
+
+
+def record_websocket_send_depth(depth: int):
+    websocket_send_queue_depth.observe(depth)
+
+
+def record_cache_result(route: str, result: str):
+    response_cache_requests_total.labels(route=route, result=result).inc()
+
+
+def record_db_usage(method: str, handler: str, queries: int, seconds: float, repeated: bool):
+    db_queries_per_request.labels(method=method, handler=handler).observe(queries)
+    db_time_per_request_seconds.labels(method=method, handler=handler).observe(seconds)
+    if repeated:
+        db_repeated_statements_total.labels(method=method, handler=handler).inc()
+
+
+def record_rate_limited(limit: str):
+    rate_limited_requests_total.labels(limit=limit).inc()
+
+
+def record_default_partition_rows(rows: int):
+    messages_default_partition_rows.set(rows)
+
+
+def record_log_dropped():
+    log_records_dropped_total.inc()
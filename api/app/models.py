@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func, Boolean, event, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -13,6 +13,7 @@ class User(Base):
 	password_hash = Column(String, nullable=False)
 	is_active = Column(Boolean, default=True)
 	created_at = Column(DateTime(timezone=True), server_default=func.now())
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
 
 # chat
 
@@ -22,14 +23,19 @@ class Chat(Base):
 	name = Column(String(128), index=True, nullable=False)
 	is_private = Column(Boolean, default=False)
 	created_at = Column(DateTime(timezone=True), server_default=func.now())
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
 
 class ChatMember(Base):
 	__tablename__ = 'chat_members'
 	id = Column(Integer, primary_key=True, index=True)
-	chat_id = Column(Integer, ForeignKey('chats.id'), index=True, nullable=False)
+	chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
 	user_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
 	role = Column(String(20), default="member", nullable=False)
 	joined_at = Column(DateTime(timezone=True), server_default=func.now())
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+	# membership lookups by (chat_id, user_id); also serves chat_id alone
+	__table_args__ = (UniqueConstraint('chat_id', 'user_id', name='uq_chat_members_chat_user'),)
 
 	user = relationship('User')
 	chat = relationship('Chat')	
@@ -39,10 +45,43 @@ class ChatMember(Base):
 class Message(Base):
 	__tablename__ = 'messages'
 	id = Column(Integer, primary_key=True, index=True)
-	chat_id = Column(Integer, ForeignKey('chats.id'), index=True, nullable=False)
-	user_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
+	chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
+	user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
 	content = Column(Text, nullable=False)
-	created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+	# on postgres the table is partitioned by month of created_at (0005) and its key is (id, created_at)
+	created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+	updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+	# created by the migrations (0004); a chat's timeline newest first, and a user's messages by date
+	__table_args__ = (
+		Index('ix_messages_chat_created', chat_id, created_at.desc(), id.desc()),
+		Index('ix_messages_user_created', user_id, created_at, postgresql_include=['chat_id']),
+	)
 
 	user = relationship('User')
-	chat = relationship('Chat')
\ No newline at end of file
+	chat = relationship('Chat')
+
+# change log
+# inserts and edits are tracked through updated_at, deletes leave a row here so the ETL can see them
+
+class ChangeLog(Base):
+	__tablename__ = 'change_log'
+	id = Column(Integer, primary_key=True, index=True)
+	entity = Column(String(32), nullable=False)
+	entity_id = Column(Integer, nullable=False)
+	chat_id = Column(Integer)
+	user_id = Column(Integer)
+	op = Column(String(8), nullable=False, default='delete')
+	changed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+def _log_delete(mapper, connection, target):
+	connection.execute(ChangeLog.__table__.insert().values(
+		entity=target.__tablename__,
+		entity_id=target.id,
+		chat_id=getattr(target, 'chat_id', target.id if isinstance(target, Chat) else None),
+		user_id=getattr(target, 'user_id', target.id if isinstance(target, User) else None),
+		op='delete',
+	))
+
+for _model in (User, Chat, ChatMember, Message):
+	event.listen(_model, 'after_delete', _log_delete)
@@ -0,0 +1,259 @@
+import os
+import re
+import gzip
+import json
+import logging
+import argparse
+import threading
+import time as time_module
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from .metrics import record_default_partition_rows
+
+# messages is range partitioned by created_at on postgres (migration 0005): one partition per UTC month,
+# messages_legacy for everything before the migration, and messages_default catching rows no partition
+# covers yet. this module keeps partitions created ahead of time and detaches the expired ones: at container
+# start (entrypoint.sh) and then every MESSAGES_PARTITIONS_EVERY seconds from the api (PartitionKeeper)
+
+logger = logging.getLogger("tears-api")
+
+PREMAKE_MONTHS = int(os.getenv('MESSAGES_PREMAKE_MONTHS', '3'))
+# 0 keeps every partition attached
+RETENTION_MONTHS = int(os.getenv('MESSAGES_RETENTION_MONTHS', '0'))
+# detached partitions are written here as gzipped csv and dropped; unset, they move to ARCHIVE_SCHEMA instead
+ARCHIVE_DIR = os.getenv('MESSAGES_ARCHIVE_DIR')
+ARCHIVE_SCHEMA = 'archive'
+DEFAULT_PARTITION = 'messages_default'
+DETACH_ATTEMPTS = 5
+# seconds between runs in a running api, 0 = only at start
+MAINTAIN_EVERY = int(os.getenv('MESSAGES_PARTITIONS_EVERY', '21600'))
+# pg_try_advisory_lock key: every worker and container runs maintain(), one at a time does the work
+MAINTAIN_LOCK = 0x7465617273
+
+_BOUND = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_{month:%Y_%m}"
+
+
+def _utc(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def _parse(value, end: bool):
+    if isinstance(value, str) and len(value.strip()) == 10:
+        value = date.fromisoformat(value.strip())
+    if isinstance(value, date) and not isinstance(value, datetime):
+        # a bare date: start of that day, or for the end bound the whole day included
+        return _utc(value) + (timedelta(days=1) if end else timedelta(0))
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).strip())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed + (timedelta(microseconds=1) if end else timedelta(0))
+
+
+def date_bounds(start=None, end=None):
+    # (lower, upper) for created_at >= lower AND created_at < upper, as aware datetimes. bound
+    # parameters of the column's type let the planner prune partitions; raises ValueError on bad input
+    return (_parse(start, False) if start else None, _parse(end, True) if end else None)
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')")).scalar() == 'p'
+
+
+def partitions(conn) -> list:
+    # [(name, lower, upper)] in bound order; None for MINVALUE / MAXVALUE, the default partition is left out
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass"
+    )).all()
+    out = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or '')
+        if not match:
+            continue
+        lo, hi = (None if v.endswith('VALUE') else datetime.fromisoformat(v.strip("'")) for v in match.groups())
+        out.append((name, lo, hi))
+    return sorted(out, key=lambda p: p[1] or datetime.min.replace(tzinfo=timezone.utc))
+
+
+def create_partition(conn, month: date) -> bool:
+    # one month; rows that already landed in the default partition for that month are moved into it
+    name = partition_name(month)
+    lo, hi = _utc(month), _utc(add_months(month, 1))
+    for _, p_lo, p_hi in partitions(conn):
+        if (p_lo is None or p_lo < hi) and (p_hi is None or lo < p_hi):
+            return False
+    stray = conn.execute(
+        text(f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi LIMIT 1"), {"lo": lo, "hi": hi}
+    ).first()
+    if stray is None:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"))
+    else:
+        conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), {"lo": lo, "hi": hi})
+        conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"))
+    logger.info(json.dumps({"event": "partition_created", "partition": name, "moved_from_default": stray is not None}))
+    return True
+
+
+def ensure_partitions(engine, ahead: int = PREMAKE_MONTHS, today: date = None) -> list:
+    # this month and the next `ahead`, each in its own short transaction
+    today = today or datetime.now(timezone.utc).date()
+    created = []
+    for n in range(ahead + 1):
+        month = add_months(month_start(today), n)
+        with engine.begin() as conn:
+            # don't queue behind a long query holding the parent; the next run will try again
+            conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            if create_partition(conn, month):
+                created.append(partition_name(month))
+    return created
+
+
+def _archive(engine, name: str, archive_dir: str):
+    if not archive_dir:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        return f"{ARCHIVE_SCHEMA}.{name}"
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp = path + '.tmp'
+    raw = engine.raw_connection()
+    try:
+        with gzip.open(tmp, 'wb') as out, raw.cursor() as cur:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", out)
+        raw.commit()
+    finally:
+        raw.close()
+    os.replace(tmp, path)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {name}"))
+    return path
+
+
+def detach_expired(engine, keep_months: int = RETENTION_MONTHS, archive_dir: str = ARCHIVE_DIR, today: date = None) -> list:
+    # partitions ending before the first kept month are detached and archived. DETACH ... CONCURRENTLY is
+    # not allowed next to a default partition, so it is a plain (catalog only) detach under a short
+    # lock_timeout, retried rather than left queued in front of every query on messages
+    if keep_months <= 0:
+        return []
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = _utc(add_months(month_start(today), -keep_months))
+    with engine.connect() as conn:
+        expired = [name for name, _, hi in partitions(conn) if hi is not None and hi <= cutoff]
+    done = []
+    for name in expired:
+        for attempt in range(DETACH_ATTEMPTS):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+                    conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+                break
+            except OperationalError:
+                if attempt == DETACH_ATTEMPTS - 1:
+                    raise
+                time_module.sleep(1 + attempt)
+        target = _archive(engine, name, archive_dir)
+        logger.info(json.dumps({"event": "partition_detached", "partition": name, "archive": target}))
+        done.append((name, target))
+    return done
+
+
+def default_rows(conn) -> int:
+    # rows no partition covered when they were written; anything but 0 means the months ahead ran out
+    return conn.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+
+
+def maintain(engine, ahead: int = PREMAKE_MONTHS, keep_months: int = RETENTION_MONTHS, archive_dir: str = ARCHIVE_DIR) -> dict:
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return {'partitioned': False}
+        # a session lock, held on this connection (outside any transaction) while the work runs on others
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTAIN_LOCK}).scalar()
+        conn.commit()
+        if not locked:
+            return {'partitioned': True, 'skipped': 'locked'}
+        try:
+            result = {
+                'partitioned': True,
+                'created': ensure_partitions(engine, ahead),
+                'detached': detach_expired(engine, keep_months, archive_dir),
+                'default_rows': default_rows(conn),
+            }
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTAIN_LOCK})
+            conn.commit()
+    record_default_partition_rows(result['default_rows'])
+    if result['default_rows']:
+        logger.warning(json.dumps({"event": "default_partition_not_empty", "partition": DEFAULT_PARTITION, "rows": result['default_rows']}))
+    return result
+
+
+class PartitionKeeper:
+    # maintain() in a daemon thread every `every` seconds, so an api up for longer than the months made ahead
+    # at start keeps writing into real partitions instead of messages_default
+    def __init__(self, engine, every: float = MAINTAIN_EVERY):
+        self.engine = engine
+        self.every = every
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        if self.every <= 0 or self.engine.dialect.name != 'postgresql' or self._thread is not None:
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='tears-partitions', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(5)
+
+    def _loop(self):
+        # entrypoint.sh has just run it: the first run is one interval in
+        while not self._stop.wait(self.every):
+            self.run_once()
+
+    def run_once(self):
+        try:
+            return maintain(self.engine)
+        except Exception as e:
+            # a lock timeout or a database restart; the next interval tries again
+            logger.warning(json.dumps({"event": "partition_maintenance_failed", "error": str(e)}))
+            return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create upcoming messages partitions and detach expired ones')
+    parser.add_argument('--ahead', type=int, default=PREMAKE_MONTHS, help='Months to create past the current one')
+    parser.add_argument('--keep-months', type=int, default=RETENTION_MONTHS, help='Months of messages to keep attached (0 = all)')
+    parser.add_argument('--archive-dir', type=str, default=ARCHIVE_DIR, help=f'Write detached partitions here as csv.gz (default: move to the {ARCHIVE_SCHEMA} schema)')
+    args = parser.parse_args()
+    from .database import engine
+    print(json.dumps(maintain(engine, args.ahead, args.keep_months, args.archive_dir), default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import os
+import re
+import asyncio
+import sys
+import time
+import logging
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import record_db_usage
+from .sampler import fold, is_idle
+from .logs import log_event
+
+# opt-in SQL accounting: with SQL_PROFILING=1 every statement on any engine (primary, replicas) is counted and
+# timed against the request that issued it, exported per route next to http_request_duration_seconds, and a
+# request that runs the same statement shape more than SQL_REPEAT_WARN times is logged as a likely N+1.
+# tests use track_queries() to assert query budgets without turning it on globally.
+# a streamed body (the export) queries after the response starts; those statements are not attributed
+#
+# slow request capture (SLOW_REQUEST_MS, or POST /admin/slow-requests at runtime): a watchdog thread samples
+# the stacks of requests still running past the threshold, and when such a request finishes it is logged as a
+# slow_request event with those stacks and its SQL timings. a sync handler runs in a threadpool thread, which
+# ProfiledRoute marks for the request while the endpoint runs, SQL or not
+
+SQL_PROFILING = os.getenv('SQL_PROFILING', '0') == '1'
+SQL_REPEAT_WARN = int(os.getenv('SQL_REPEAT_WARN', '10'))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '0'))
+SLOW_REQUEST_SAMPLES = int(os.getenv('SLOW_REQUEST_SAMPLES', '20'))
+
+logger = logging.getLogger("tears-api")
+
+# placeholder lists of expanded IN (...) parameters, in every paramstyle, fold into one shape
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    return _IN_LIST.sub("(?)", _SPACES.sub(" ", statement).strip())
+
+
+class QueryStats:
+    def __init__(self, handler: str = None):
+        self.handler = handler
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.shape_seconds = Counter()
+        # idents of the threads working on the request: a sync endpoint's while it runs, and any that ran statements
+        self.threads = set()
+
+    def record(self, statement: str, seconds: float):
+        shape = statement_shape(statement)
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape] += 1
+        self.shape_seconds[shape] += seconds
+        self.threads.add(threading.get_ident())
+
+    def repeated(self, threshold: int = SQL_REPEAT_WARN):
+        # [(shape, times)] run more than `threshold` times, most repeated first
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+_current: ContextVar = ContextVar("query_stats", default=None)
+_installed = False
+_install_lock = threading.Lock()
+# QueryTrackers of running track_queries() blocks; requests are handed to them when they finish
+_trackers = []
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    started = conn.info.get("query_started")
+    if started:
+        stats.record(statement, time.perf_counter() - started.pop())
+
+
+def install():
+    # listeners on the Engine class, so engines created later (replicas, tests) are covered too
+    global _installed
+    with _install_lock:
+        if not _installed:
+            event.listen(Engine, "before_cursor_execute", _before)
+            event.listen(Engine, "after_cursor_execute", _after)
+            _installed = True
+
+
+if SQL_PROFILING:
+    install()
+
+
+class InFlight:
+    def __init__(self, stats: QueryStats):
+        self.stats = stats
+        # the event loop's thread: async handlers run there
+        self.loop_thread = threading.get_ident()
+        self.started = time.monotonic()
+        self.stacks = Counter()
+        self.samples = 0
+
+
+class SlowRequestWatch:
+    def __init__(self, threshold_ms: int = 0, max_samples: int = SLOW_REQUEST_SAMPLES):
+        self.threshold = 0.0
+        self.max_samples = max_samples
+        self.inflight = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.set_threshold(threshold_ms)
+
+    def set_threshold(self, threshold_ms: int):
+        # 0 turns capture off
+        self.threshold = max(0, threshold_ms) / 1000
+        if not self.threshold:
+            return
+        install()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='tears-slow-requests', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def begin(self, stats: QueryStats) -> InFlight:
+        entry = InFlight(stats)
+        self.inflight[id(entry)] = entry
+        return entry
+
+    def end(self, entry: InFlight):
+        self.inflight.pop(id(entry), None)
+
+    def _loop(self):
+        while True:
+            if not self.threshold:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            # a few samples within the first threshold past it, at most every 250 ms after that
+            time.sleep(min(max(self.threshold / 4, 0.005), 0.25))
+            self.sample()
+
+    def sample(self):
+        now = time.monotonic()
+        late = [e for e in list(self.inflight.values()) if now - e.started >= self.threshold and e.samples < self.max_samples]
+        if not late:
+            return
+        frames = sys._current_frames()
+        for entry in late:
+            for ident in set(entry.stats.threads) | {entry.loop_thread}:
+                frame = frames.get(ident)
+                if frame is not None and not is_idle(frame):
+                    entry.stacks[fold(frame)] += 1
+            entry.samples += 1
+
+
+slow_requests = SlowRequestWatch(SLOW_REQUEST_MS)
+
+
+def _marks_thread(endpoint):
+    # the sampler finds a sync endpoint through the thread it runs on, from its first line (a CPU-bound
+    # handler like the password check in /auth/token may never run SQL)
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return endpoint(*args, **kwargs)
+        ident = threading.get_ident()
+        stats.threads.add(ident)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            # the pool thread goes on to other requests
+            stats.threads.discard(ident)
+    return run
+
+
+class ProfiledRoute(APIRoute):
+    # route_class for the app's routers; async endpoints run on the event loop, which is always sampled
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _marks_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def log_slow_request(request: Request, status_code: int, stats: QueryStats, entry: InFlight, seconds: float):
+    log_event(logger, logging.WARNING, "slow_request",
+        method=request.method,
+        path=request.url.path,
+        handler=stats.handler,
+        status_code=status_code,
+        duration_ms=round(seconds * 1000, 2),
+        threshold_ms=round(slow_requests.threshold * 1000),
+        queries=stats.count,
+        sql_ms=round(stats.seconds * 1000, 2),
+        statements=[
+            {"statement": shape[:500], "count": stats.shapes[shape], "ms": round(spent * 1000, 2)}
+            for shape, spent in stats.shape_seconds.most_common(5)
+        ],
+        samples=entry.samples,
+        stacks=[{"stack": stack, "samples": n} for stack, n in entry.stacks.most_common(5)],
+    )
+
+
+async def sql_profiling_middleware(request: Request, call_next):
+    if not (SQL_PROFILING or _trackers or slow_requests.threshold) or request.url.path == "/metrics":
+        return await call_next(request)
+    stats = QueryStats()
+    token = _current.set(stats)
+    entry = slow_requests.begin(stats) if slow_requests.threshold else None
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+        if entry is not None:
+            slow_requests.end(entry)
+    route = request.scope.get("route")
+    stats.handler = getattr(route, "path", request.url.path)
+    repeated = stats.repeated()
+    if SQL_PROFILING:
+        record_db_usage(request.method, stats.handler, stats.count, stats.seconds, bool(repeated))
+    for shape, times in repeated[:3]:
+        log_event(logger, logging.WARNING, "repeated_statement",
+            method=request.method,
+            handler=stats.handler,
+            times=times,
+            queries=stats.count,
+            statement=shape[:500],
+        )
+    if entry is not None:
+        elapsed = time.monotonic() - entry.started
+        if slow_requests.threshold and elapsed >= slow_requests.threshold:
+            log_slow_request(request, response.status_code, stats, entry, elapsed)
+    for tracker in list(_trackers):
+        tracker.requests.append(stats)
+    return response
+
+
+class QueryTracker:
+    def __init__(self):
+        # statements run directly in the block (crud calls), and one QueryStats per request served during it
+        self.direct = QueryStats("direct")
+        self.requests = []
+
+    @property
+    def last(self) -> QueryStats:
+        return self.requests[-1]
+
+
+@contextmanager
+def track_queries():
+    # with track_queries() as t: client.get("/chats"); assert t.last.count <= 3
+    install()
+    tracker = QueryTracker()
+    token = _current.set(tracker.direct)
+    _trackers.append(tracker)
+    try:
+        yield tracker
+    finally:
+        _trackers.remove(tracker)
+        _current.reset(token)
+
+
+def assert_query_budget(stats: QueryStats, budget: int):
+    if stats.count > budget:
+        shapes = "\n".join(f"  {n}x {shape[:200]}" for shape, n in stats.shapes.most_common(5))
+        raise AssertionError(f"{stats.handler} ran {stats.count} queries, budget {budget}:\n{shapes}")
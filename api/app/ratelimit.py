@@ -0,0 +1,158 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from fastapi import HTTPException
+from .metrics import record_rate_limited
+from .logs import log_event
+
+# token buckets: `rate` tokens per second up to `burst`, one bucket per key (user id, client ip, chat id).
+# a bucket is two numbers, buckets are kept least recently used first so idle ones (full again, nothing worth
+# keeping) are evicted from the front as keys are touched, and max_keys caps the rest.
+# with RATE_LIMIT_REDIS_URL the buckets live in redis, shared by every worker and container; if redis is
+# unreachable the limit falls back to this process' buckets (logged when it starts and stops, per limit).
+# RATE_LIMITS=0 turns every limit off (load tests)
+
+RATE_LIMITS = os.getenv('RATE_LIMITS', '1') == '1'
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+
+logger = logging.getLogger("tears-api")
+
+# every limiter made here, so tests can reset them all
+limiters = []
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000, name: str = 'default'):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.name = name
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, cost: float = 1) -> float:
+        # 0 when allowed, else the seconds until `cost` tokens are there
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            self._evict(now)
+            return 0.0 if allowed else (cost - tokens) / self.rate
+
+    def _evict(self, now):
+        # the front is the longest untouched; stop at the first bucket that still has state
+        buckets = self.buckets
+        while buckets:
+            key, (tokens, last) = next(iter(buckets.items()))
+            if tokens + (now - last) * self.rate < self.burst and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+# KEYS[1] bucket, ARGV rate, burst, cost; the clock is redis' so every instance agrees on it
+_REDIS_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens, last = tonumber(state[1]) or burst, tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - last) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    # same buckets in redis; a key expires once it would be full again, which is the idle eviction
+    def __init__(self, url: str, rate: float, burst: int, name: str, prefix: str = 'tears:ratelimit:'):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.script = self.client.register_script(_REDIS_TAKE)
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.prefix = f'{prefix}{name}:'
+        self.fallback = TokenBucket(rate, burst, name=name)
+        # on the fallback: every instance limits on its own, N instances let N times as much through
+        self.degraded = False
+
+    def take(self, key, cost: float = 1) -> float:
+        try:
+            wait = float(self.script(keys=[f'{self.prefix}{key}'], args=[self.rate, self.burst, cost]))
+        except Exception as e:
+            if not self.degraded:
+                self.degraded = True
+                log_event(logger, logging.ERROR, "rate_limit_redis_unavailable", limit=self.name, error=str(e))
+            return self.fallback.take(key, cost)
+        if self.degraded:
+            self.degraded = False
+            log_event(logger, logging.WARNING, "rate_limit_redis_recovered", limit=self.name)
+        return wait
+
+    def reset(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+        self.fallback.reset()
+
+
+def limiter(name: str, rate: float, burst: int):
+    bucket = RedisTokenBucket(RATE_LIMIT_REDIS_URL, rate, burst, name) if RATE_LIMIT_REDIS_URL else TokenBucket(rate, burst, name=name)
+    limiters.append(bucket)
+    return bucket
+
+
+def check(bucket, key, cost: float = 1, record: bool = True) -> float:
+    # seconds to wait, 0 when allowed; counts the throttled ones by limit name (record=False for a probe
+    # whose refusal is not a rejection)
+    if not RATE_LIMITS:
+        return 0.0
+    wait = bucket.take(key, cost)
+    if wait and record:
+        record_rate_limited(bucket.name)
+    return wait
+
+
+def enforce(bucket, key, detail: str = 'Too many requests'):
+    wait = check(bucket, key)
+    if wait:
+        raise HTTPException(status_code=429, detail=detail, headers={'Retry-After': str(math.ceil(wait))})
+
+
+def reset_all():
+    for bucket in limiters:
+        bucket.reset()
+
+
+# limits are configured per minute, buckets refill per second
+def per_minute(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default))) / 60
+
+
+# writes: a user's messages (REST and websocket alike), and all messages into one chat
+message_user_limiter = limiter('message_user', per_minute('MESSAGES_PER_MINUTE', 60), int(os.getenv('MESSAGES_BURST', '20')))
+message_chat_limiter = limiter('message_chat', per_minute('CHAT_MESSAGES_PER_MINUTE', 1200), int(os.getenv('CHAT_MESSAGES_BURST', '200')))
+# bulk ingestion: requests per integration user, each up to BULK_MAX_MESSAGES messages
+bulk_user_limiter = limiter('bulk_user', per_minute('BULK_REQUESTS_PER_MINUTE', 30), int(os.getenv('BULK_BURST', '5')))
+# and the messages in them per user, in place of message_user: sized for a couple of full requests at once
+bulk_message_limiter = limiter('bulk_message', per_minute('BULK_MESSAGES_PER_MINUTE', 60000), int(os.getenv('BULK_MESSAGES_BURST', '10000')))
+# auth: every register / token attempt from one address, and token attempts against one username (argon2 each)
+auth_ip_limiter = limiter('auth_ip', per_minute('AUTH_PER_MINUTE', 20), int(os.getenv('AUTH_BURST', '20')))
+login_user_limiter = limiter('login_user', per_minute('LOGINS_PER_MINUTE', 10), int(os.getenv('LOGIN_BURST', '10')))
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# statistical profiler for production: while running, a daemon thread snapshots the stack of every other
+# thread each `interval` seconds and counts them as folded stacks ("thread;outer;inner;leaf count" lines, the
+# input of flamegraph.pl, inferno and speedscope). nothing runs until it is started (POST /admin/profiler/start)
+# and it stops itself after `duration`, so a forgotten session costs nothing.
+# threads parked in a wait (idle pool workers, the event loop in select) are left out unless idle=True
+
+MAX_PROFILE_SECONDS = int(os.getenv('MAX_PROFILE_SECONDS', '300'))
+MAX_STACK_DEPTH = 128
+
+# (file, function) leaves of a thread that is waiting, not working
+IDLE_LEAVES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('socket.py', 'accept'),
+}
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_LEAVES
+
+
+def fold(frame, depth: int = MAX_STACK_DEPTH) -> str:
+    # root first, ';' separated; ';' cannot appear in a qualname or a file name
+    names = []
+    while frame is not None and len(names) < depth:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def thread_names() -> dict:
+    return {t.ident: t.name for t in threading.enumerate()}
+
+
+class Sampler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = None
+        self.idle = False
+        self.started_at = None
+        self.stopped_at = None
+        self.until = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, duration: float = 30, idle: bool = False) -> bool:
+        # False when a session is already running; starting again clears the previous one
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.idle = idle
+            self.started_at = time.time()
+            self.stopped_at = None
+            self.until = time.monotonic() + min(duration, MAX_PROFILE_SECONDS)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='tears-sampler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(5)
+
+    def _loop(self):
+        me = threading.get_ident()
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < self.until:
+                self.sample(me)
+        finally:
+            self.stopped_at = time.time()
+
+    def sample(self, skip=None):
+        names = thread_names()
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, frame in frames.items():
+                if ident == skip or (not self.idle and is_idle(frame)):
+                    continue
+                self.stacks[f"{names.get(ident, ident)};{fold(frame)}"] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        with self.lock:
+            return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'running': self.running,
+                'interval_ms': self.interval * 1000 if self.interval else None,
+                'idle': self.idle,
+                'started_at': self.started_at,
+                'stopped_at': self.stopped_at,
+                'samples': self.samples,
+                'stacks': len(self.stacks),
+            }
+
+
+profiler = Sampler()
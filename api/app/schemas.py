@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr
+from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 
 # --- user ---
@@ -46,6 +46,13 @@ class MemberCreate(BaseModel):
     user_id: Optional[int] = None
     username: Optional[str] = None
 
+# POST /chats/{id}/members/bulk and /members/bulk/remove: ids and usernames together, up to BULK_MAX_MEMBERS each
+BULK_MAX_MEMBERS = 10000
+
+class MemberBatch(BaseModel):
+    user_ids: List[int] = Field(default_factory=list, max_length=BULK_MAX_MEMBERS)
+    usernames: List[str] = Field(default_factory=list, max_length=BULK_MAX_MEMBERS)
+
 # for messages created from /chats/{id}/messages
 class ChatMessageCreate(BaseModel):
     content: str
@@ -56,12 +63,18 @@ class MessageCreate(BaseModel):
     # user_id: int
     content: str
 
+# POST /messages/bulk: up to BULK_MAX_MESSAGES, any mix of chats
+BULK_MAX_MESSAGES = 5000
+
+class BulkMessageCreate(BaseModel):
+    messages: List[MessageCreate] = Field(..., min_length=1, max_length=BULK_MAX_MESSAGES)
+
 class MessageOut(BaseModel):
     id: int
     chat_id: int
     user_id: int
-    username: Optional[str]
-    display_name: Optional[str]
+    username: Optional[str] = None
+    display_name: Optional[str] = None
     content: str
     created_at: datetime
     class Config:
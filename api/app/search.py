@@ -0,0 +1,327 @@
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import event, func, literal_column, text, select, or_, table, column, case
+from . import models
+from .partitions import date_bounds
+
+# full-text index over messages.content
+# postgres: a GIN expression index over to_tsvector(content); queries spell the same expression
+# sqlite: an FTS5 external-content table kept in sync by triggers (used by the test suite)
+# existing databases get these from the migrations (0003_search); the hooks below cover create_all
+# anything else falls back to ILIKE
+# chat names: pg_trgm similarity over a trigram GIN index when the extension is available, otherwise
+# an in-process trigram index (ChatNameIndex) with the same similarity measure
+
+logger = logging.getLogger("tears-api")
+
+TS_CONFIG = os.getenv('SEARCH_TS_CONFIG', 'simple')
+# rank ordering scores at most this many of the newest matches, so a very common word costs a
+# bounded amount of work instead of ranking the whole history
+MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '5000'))
+
+# must match the indexed expression exactly, or postgres will not use the index
+TSVECTOR = f"to_tsvector('{TS_CONFIG}'::regconfig, coalesce(content, ''))"
+PG_DDL = (
+    f"CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING gin (({TSVECTOR}))",
+)
+
+CHAT_TRGM_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_chats_name_trgm ON chats USING gin (name gin_trgm_ops)",
+)
+# same default as pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = float(os.getenv('CHAT_SEARCH_THRESHOLD', '0.3'))
+# a prefix of the whole name ranks above any fuzzy match, a substring above plain similarity
+PREFIX_BONUS = 1.0
+CONTAINS_BONUS = 0.5
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+SQLITE_DROP = (
+    "DROP TRIGGER IF EXISTS messages_fts_ai",
+    "DROP TRIGGER IF EXISTS messages_fts_ad",
+    "DROP TRIGGER IF EXISTS messages_fts_au",
+    "DROP TABLE IF EXISTS messages_fts",
+)
+
+search_vector = func.to_tsvector(literal_column(f"'{TS_CONFIG}'::regconfig"), func.coalesce(models.Message.content, literal_column("''")))
+messages_fts = table('messages_fts', column('rowid'))
+
+
+def _create_index(target, connection, **kw):
+    if connection.dialect.name == 'postgresql':
+        for stmt in PG_DDL:
+            connection.execute(text(stmt))
+    elif connection.dialect.name == 'sqlite':
+        try:
+            for stmt in SQLITE_DDL:
+                connection.execute(text(stmt))
+        except Exception as exc:
+            # sqlite built without FTS5: search falls back to ILIKE
+            logger.info(json.dumps({"event": "search_index_unavailable", "error": str(exc)}))
+
+
+def _drop_index(target, connection, **kw):
+    # the FTS table is not part of the metadata, drop_all would leave it pointing at a dropped table
+    if connection.dialect.name == 'sqlite':
+        for stmt in SQLITE_DROP:
+            connection.execute(text(stmt))
+
+
+def _create_chat_index(target, connection, **kw):
+    if connection.dialect.name != 'postgresql':
+        return
+    try:
+        # the extension needs CREATE privilege on the database; without it chat search stays in process
+        with connection.begin_nested():
+            for stmt in CHAT_TRGM_DDL:
+                connection.execute(text(stmt))
+    except Exception as exc:
+        logger.info(json.dumps({"event": "chat_trigram_unavailable", "error": str(exc).splitlines()[0]}))
+    _trigram.pop(connection.engine, None)
+
+
+def _reset_chat_index(target, connection, **kw):
+    # tables recreated under the same engine (tests): ids restart, the in-process index is stale
+    _chat_indexes.pop(connection.engine, None)
+    _trigram.pop(connection.engine, None)
+
+
+event.listen(models.Message.__table__, 'after_create', _create_index)
+event.listen(models.Message.__table__, 'before_drop', _drop_index)
+event.listen(models.Chat.__table__, 'after_create', _create_chat_index)
+event.listen(models.Chat.__table__, 'after_create', _reset_chat_index)
+event.listen(models.Chat.__table__, 'after_drop', _reset_chat_index)
+
+
+def _has_fts(conn) -> bool:
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first() is not None
+
+
+def _backend(db) -> str:
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return 'postgresql'
+    if dialect == 'sqlite' and _has_fts(db):
+        return 'sqlite'
+    return 'like'
+
+
+def _fts5_query(q: str) -> str:
+    # every word must match; words are quoted so FTS5 operators in user input are taken literally
+    terms = [t.replace('"', '""') for t in q.split() if t.strip('"')]
+    return ' '.join(f'"{t}"' for t in terms)
+
+
+def _fts5_match(q: str):
+    return literal_column('messages_fts').op('MATCH')(_fts5_query(q))
+
+
+def match_clause(db, q: str):
+    # WHERE clause for "messages matching q", served by whichever index the database has
+    backend = _backend(db)
+    if backend == 'postgresql':
+        return search_vector.op('@@')(func.websearch_to_tsquery(TS_CONFIG, q))
+    if backend == 'sqlite':
+        return models.Message.id.in_(select(messages_fts.c.rowid).where(_fts5_match(q)))
+    return models.Message.content.ilike(f"%{q}%")
+
+
+def encode_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, message_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def search_messages(db, q: str, viewer_id=None, chat_id=None, user_id=None, start_date=None, end_date=None, order: str = 'rank', limit: int = 50, cursor=None):
+    # ranked (or newest-first) matches visible to viewer_id, keyset-paginated on (rank, id)
+    M = models.Message
+    backend = _backend(db)
+    filters = [match_clause(db, q)]
+    if chat_id:
+        filters.append(M.chat_id == chat_id)
+    if user_id:
+        filters.append(M.user_id == user_id)
+    start, end = date_bounds(start_date, end_date)
+    if start:
+        filters.append(M.created_at >= start)
+    if end:
+        filters.append(M.created_at < end)
+    # private chats only for their members
+    visible = select(models.Chat.id).where(models.Chat.is_private == False)
+    if viewer_id:
+        visible = visible.union(select(models.ChatMember.chat_id).where(models.ChatMember.user_id == viewer_id))
+    filters.append(M.chat_id.in_(visible))
+
+    if order == 'rank' and backend != 'like':
+        # newest MAX_CANDIDATES matches first (bounded work), then score only those
+        candidates = select(M.id).where(*filters).order_by(M.id.desc()).limit(MAX_CANDIDATES).subquery()
+        if backend == 'postgresql':
+            score = func.ts_rank_cd(search_vector, func.websearch_to_tsquery(TS_CONFIG, q))
+            scored = select(M.id.label('id'), score.label('rank')).where(M.id.in_(select(candidates.c.id)))
+        else:
+            # bm25() is lower-is-better, flip it so both backends sort rank descending
+            score = -func.bm25(literal_column('messages_fts'))
+            scored = select(messages_fts.c.rowid.label('id'), score.label('rank')).where(_fts5_match(q), messages_fts.c.rowid.in_(select(candidates.c.id)))
+        scored = scored.subquery()
+        rank = scored.c.rank
+        query = select(M, rank).join(scored, scored.c.id == M.id)
+    else:
+        rank = literal_column('0.0')
+        query = select(M, rank).where(*filters)
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor)
+        if order == 'rank' and backend != 'like':
+            query = query.where(or_(rank < last_rank, (rank == last_rank) & (M.id < last_id)))
+        else:
+            query = query.where(M.id < last_id)
+    query = query.order_by(rank.desc(), M.id.desc()).limit(limit + 1)
+    rows = db.execute(query).all()
+    items = [(m, float(r or 0.0)) for m, r in rows[:limit]]
+    next_cursor = encode_cursor(items[-1][1], items[-1][0].id) if len(rows) > limit and items else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+# chat names
+
+_trigram = weakref.WeakKeyDictionary()
+_chat_indexes = weakref.WeakKeyDictionary()
+_chat_indexes_lock = threading.Lock()
+
+
+def trigrams(name: str) -> set:
+    # pg_trgm's trigrams: lowercased words padded with two spaces in front and one behind
+    grams = set()
+    for word in re.findall(r'\w+', name.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _has_trigram(db) -> bool:
+    engine = db.get_bind()
+    if engine not in _trigram:
+        _trigram[engine] = engine.dialect.name == 'postgresql' and db.execute(
+            text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_chats_name_trgm'")
+        ).first() is not None
+    return _trigram[engine]
+
+
+def chat_name_match(db, q: str):
+    # (WHERE clause, relevance) served by the trigram index, or None when postgres has no pg_trgm
+    if not _has_trigram(db):
+        return None
+    name = models.Chat.name
+    lowered, needle = func.lower(name), q.lower()
+    # % is pg_trgm's similarity operator (threshold pg_trgm.similarity_threshold); ILIKE is served by the same index
+    where = or_(name.op('%')(q), name.icontains(q, autoescape=True))
+    relevance = (
+        func.similarity(name, q)
+        + case((lowered.startswith(needle, autoescape=True), PREFIX_BONUS), else_=0.0)
+        + case((lowered.contains(needle, autoescape=True), CONTAINS_BONUS), else_=0.0)
+    )
+    return where, relevance
+
+
+class ChatNameIndex:
+    # trigram postings for every chat name, kept in step with the table by polling updated_at
+    # (indexed) for new or renamed chats and change_log for deletes
+    LAG = timedelta(minutes=1)
+
+    def __init__(self):
+        self.names = {}
+        self.grams = {}
+        self.postings = {}
+        self.seen_at = None
+        self.seen_log = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, chat_id: int, name: str):
+        self.remove(chat_id)
+        grams = trigrams(name or '')
+        self.names[chat_id] = (name or '').lower()
+        self.grams[chat_id] = grams
+        for g in grams:
+            self.postings.setdefault(g, set()).add(chat_id)
+
+    def remove(self, chat_id: int):
+        for g in self.grams.pop(chat_id, ()):
+            ids = self.postings.get(g)
+            ids.discard(chat_id)
+            if not ids:
+                del self.postings[g]
+        self.names.pop(chat_id, None)
+
+    def refresh(self, db):
+        C, log = models.Chat, models.ChangeLog
+        with self.lock:
+            q = db.query(C.id, C.name, C.updated_at)
+            if self.seen_at is not None:
+                # rows committed by transactions that started before the last poll carry an older
+                # now(), so look back a little; re-adding a chat is idempotent
+                q = q.filter(C.updated_at >= self.seen_at - self.LAG)
+            for chat_id, name, updated_at in q:
+                self.add(chat_id, name)
+                if updated_at is not None and (self.seen_at is None or updated_at > self.seen_at):
+                    self.seen_at = updated_at
+            deletes = db.query(log.id, log.entity_id).filter(log.entity == 'chats', log.id > self.seen_log)
+            for log_id, chat_id in deletes:
+                self.remove(chat_id)
+                self.seen_log = max(self.seen_log, log_id)
+        return self
+
+    def search(self, q: str, threshold: float = SIMILARITY_THRESHOLD) -> dict:
+        # {chat_id: relevance} for names similar to q or containing it, scored like chat_name_match
+        needle = q.lower()
+        query = trigrams(q)
+        with self.lock:
+            shared = Counter()
+            for g in query:
+                shared.update(self.postings.get(g, ()))
+            if not any(len(w) >= 3 for w in re.findall(r'\w+', needle)):
+                # no word long enough for an inner trigram: substrings could hide anywhere, scan the names
+                shared.update({chat_id: 0 for chat_id, name in self.names.items() if needle in name})
+            scores = {}
+            for chat_id, n in shared.items():
+                name = self.names[chat_id]
+                union = len(query) + len(self.grams[chat_id]) - n
+                similarity = n / union if union else 0.0
+                contains = needle in name
+                if similarity < threshold and not contains:
+                    continue
+                scores[chat_id] = similarity + (PREFIX_BONUS if name.startswith(needle) else 0.0) + (CONTAINS_BONUS if contains else 0.0)
+        return scores
+
+
+def chat_name_index(db) -> ChatNameIndex:
+    engine = db.get_bind()
+    with _chat_indexes_lock:
+        index = _chat_indexes.get(engine)
+        if index is None:
+            index = _chat_indexes[engine] = ChatNameIndex()
+    return index.refresh(db)
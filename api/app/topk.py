@@ -0,0 +1,39 @@
+import threading
+
+# heavy hitters in bounded memory (space-saving, Metwally et al. 2005): `capacity` counters, and when a new key
+# arrives with all of them taken it replaces the smallest one and inherits its count (kept as `error`, the most
+# the estimate can be over). any key seen more than total / capacity times is guaranteed to be tracked, and a
+# tracked key's estimate never goes down, so it can be exported as a counter
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def offer(self, key, n: int = 1):
+        with self.lock:
+            self.total += n
+            entry = self.counters.get(key)
+            if entry is not None:
+                entry[0] += n
+            elif len(self.counters) < self.capacity:
+                self.counters[key] = [n, 0]
+            else:
+                smallest = min(self.counters, key=lambda k: self.counters[k][0])
+                floor = self.counters.pop(smallest)[0]
+                self.counters[key] = [floor + n, floor]
+
+    def top(self, k: int):
+        # [(key, count, error)], largest first
+        with self.lock:
+            ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:k]
+            return [(key, count, error) for key, (count, error) in ranked]
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.total = 0
@@ -2,18 +2,19 @@ from fastapi import WebSocket, WebSocketDisconnect, Depends, Query, status
 from sqlalchemy.orm import Session
 from typing import Dict, Set
 import json
+import math
+import time
 import logging
 from datetime import datetime
 from .database import SessionLocal
 from .security import decode_access_token
 from . import models, crud
-from .metrics import increment_websocket_connections, decrement_websocket_connections, record_websocket_message
+from .logs import setup_logging, log_event
+from .ratelimit import check, message_user_limiter, message_chat_limiter
+from .metrics import increment_websocket_connections, decrement_websocket_connections, record_websocket_message, record_websocket_broadcast, record_websocket_send_depth
 
-# logging for ws events
-logging.basicConfig(
-	level=logging.INFO,
-	format='%(message)s'
-)
+# logging for ws events (app/logs.py); LOG_SAMPLE=websocket_message=0.1 keeps one message line in ten
+setup_logging()
 logger = logging.getLogger("tears-websocket")
 
 
@@ -23,6 +24,8 @@ class ConnectionManager:
         # {chat_id: {user_id: WebSocket}}
         self.active_connections: Dict[int, Dict[int, WebSocket]] = {}
         self.all_connections: Set[WebSocket] = set()
+        # {WebSocket: sends awaiting it}; concurrent broadcasts into a slow client pile up here
+        self.pending_sends: Dict[WebSocket, int] = {}
     
     async def connect(self, websocket: WebSocket, chat_id: int, user_id: int):
         await websocket.accept()
@@ -34,15 +37,12 @@ class ConnectionManager:
         self.all_connections.add(websocket)
         increment_websocket_connections()
         
-        log_data = {
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "event": "websocket_connected",
-            "user_id": str(user_id),
-            "chat_id": str(chat_id),
-            "total_connections": len(self.all_connections),
-            "chat_connections": len(self.active_connections.get(chat_id, {}))
-        }
-        logger.info(json.dumps(log_data))
+        log_event(logger, logging.INFO, "websocket_connected",
+            user_id=str(user_id),
+            chat_id=str(chat_id),
+            total_connections=len(self.all_connections),
+            chat_connections=len(self.active_connections.get(chat_id, {})),
+        )
     
     def disconnect(self, chat_id: int, user_id: int):
         if chat_id in self.active_connections:
@@ -50,14 +50,11 @@ class ConnectionManager:
             if websocket:
                 self.all_connections.discard(websocket)
                 decrement_websocket_connections()
-                log_data = {
-                    "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                    "event": "websocket_disconnected",
-                    "user_id": str(user_id),
-                    "chat_id": str(chat_id),
-                    "total_connections": len(self.all_connections)
-                }
-                logger.info(json.dumps(log_data))
+                log_event(logger, logging.INFO, "websocket_disconnected",
+                    user_id=str(user_id),
+                    chat_id=str(chat_id),
+                    total_connections=len(self.all_connections),
+                )
             
             if not self.active_connections[chat_id]:
                 del self.active_connections[chat_id]
@@ -67,17 +64,14 @@ class ConnectionManager:
             websocket = self.active_connections[chat_id].get(user_id)
             if websocket:
                 try:
-                    await websocket.send_json(message)
+                    await self.send(websocket, message)
                 except Exception as e:
-                    log_data = {
-                        "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                        "event": "websocket_error",
-                        "error_type": "send_personal_message",
-                        "user_id": str(user_id),
-                        "chat_id": str(chat_id),
-                        "error": str(e)
-                    }
-                    logger.error(json.dumps(log_data))
+                    log_event(logger, logging.ERROR, "websocket_error",
+                        error_type="send_personal_message",
+                        user_id=str(user_id),
+                        chat_id=str(chat_id),
+                        error=str(e),
+                    )
                     self.disconnect(chat_id, user_id)
     
     async def broadcast_to_chat(self, message: dict, chat_id: int, exclude_user: int = None):
@@ -86,27 +80,41 @@ class ConnectionManager:
         
         record_websocket_message(chat_id)
         disconnected_users = []
+        started = time.perf_counter()
         
-        for user_id, websocket in self.active_connections[chat_id].items():
+        # a snapshot: members join and leave while the sends below are awaited
+        members = list(self.active_connections[chat_id].items())
+        for user_id, websocket in members:
             if exclude_user and user_id == exclude_user:
                 continue
             
             try:
-                await websocket.send_json(message)
+                await self.send(websocket, message)
             except Exception as e:
-                log_data = {
-                    "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                    "event": "websocket_error",
-                    "error_type": "broadcast_message",
-                    "user_id": str(user_id),
-                    "chat_id": str(chat_id),
-                    "error": str(e)
-                }
-                logger.error(json.dumps(log_data))
+                log_event(logger, logging.ERROR, "websocket_error",
+                    error_type="broadcast_message",
+                    user_id=str(user_id),
+                    chat_id=str(chat_id),
+                    error=str(e),
+                )
                 disconnected_users.append(user_id)
         
         for user_id in disconnected_users:
             self.disconnect(chat_id, user_id)
+        record_websocket_broadcast(len(members), time.perf_counter() - started)
+    
+    async def send(self, websocket: WebSocket, message: dict):
+        depth = self.pending_sends.get(websocket, 0) + 1
+        self.pending_sends[websocket] = depth
+        record_websocket_send_depth(depth)
+        try:
+            await websocket.send_json(message)
+        finally:
+            left = self.pending_sends.get(websocket, 1) - 1
+            if left:
+                self.pending_sends[websocket] = left
+            else:
+                self.pending_sends.pop(websocket, None)
     
     def get_chat_users(self, chat_id: int):
         if chat_id in self.active_connections:
@@ -157,13 +165,10 @@ async def websocket_endpoint(
     try:
         user = await get_current_user_ws(token, db)
     except Exception as e:
-        log_data = {
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "event": "websocket_auth_failed",
-            "chat_id": str(chat_id),
-            "error": str(e)
-        }
-        logger.error(json.dumps(log_data))
+        log_event(logger, logging.ERROR, "websocket_auth_failed",
+            chat_id=str(chat_id),
+            error=str(e),
+        )
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
@@ -173,17 +178,18 @@ async def websocket_endpoint(
         return
     
     if chat.is_private and not crud.user_is_participant(db, chat_id, user.id):
-        log_data = {
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "event": "websocket_access_denied",
-            "user_id": str(user.id),
-            "chat_id": str(chat_id),
-            "reason": "not_chat_member"
-        }
-        logger.warning(json.dumps(log_data))
+        log_event(logger, logging.WARNING, "websocket_access_denied",
+            user_id=str(user.id),
+            chat_id=str(chat_id),
+            reason="not_chat_member",
+        )
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
+    # a connection can stay open for hours: don't keep a pooled db connection (and an idle transaction) with it.
+    # the loaded user and chat stay usable after close
+    db.close()
+
     await manager.connect(websocket, chat_id, user.id)
     
     await manager.send_personal_message({
@@ -214,9 +220,20 @@ async def websocket_endpoint(
                     }, chat_id, user.id)
                     continue
                 
+                # same limits as the REST writes; the message is refused, the connection stays
+                wait = check(message_user_limiter, user.id) or check(message_chat_limiter, chat_id)
+                if wait:
+                    await manager.send_personal_message({
+                        "type": "error",
+                        "message": "Rate limit exceeded",
+                        "retry_after": math.ceil(wait)
+                    }, chat_id, user.id)
+                    continue
+                
                 new_message = crud.create_message(
                     db, user.id, chat_id, message_data["content"]
                 )
+                db.close()
 
                 await manager.broadcast_to_chat({
                     "type": "message",
@@ -228,15 +245,12 @@ async def websocket_endpoint(
                     "timestamp": new_message.created_at.isoformat()
                 }, chat_id)
                 
-                log_data = {
-                    "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                    "event": "websocket_message",
-                    "user_id": str(user.id),
-                    "chat_id": str(chat_id),
-                    "message_id": str(new_message.id),
-                    "content_length": len(new_message.content)
-                }
-                logger.info(json.dumps(log_data))
+                log_event(logger, logging.INFO, "websocket_message",
+                    user_id=str(user.id),
+                    chat_id=str(chat_id),
+                    message_id=str(new_message.id),
+                    content_length=len(new_message.content),
+                )
                 
             except json.JSONDecodeError:
                 await manager.send_personal_message({
@@ -244,15 +258,12 @@ async def websocket_endpoint(
                     "message": "Invalid JSON format"
                 }, chat_id, user.id)
             except Exception as e:
-                log_data = {
-                    "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                    "event": "websocket_error",
-                    "error_type": "message_processing",
-                    "user_id": str(user.id),
-                    "chat_id": str(chat_id),
-                    "error": str(e)
-                }
-                logger.error(json.dumps(log_data))
+                log_event(logger, logging.ERROR, "websocket_error",
+                    error_type="message_processing",
+                    user_id=str(user.id),
+                    chat_id=str(chat_id),
+                    error=str(e),
+                )
                 await manager.send_personal_message({
                     "type": "error",
                     "message": "Error processing message"
@@ -266,23 +277,17 @@ async def websocket_endpoint(
             "username": user.username,
             "timestamp": datetime.utcnow().isoformat()
         }, chat_id)
-        log_data = {
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "event": "websocket_disconnect",
-            "user_id": str(user.id),
-            "chat_id": str(chat_id),
-            "reason": "client_disconnect"
-        }
-        logger.info(json.dumps(log_data))
+        log_event(logger, logging.INFO, "websocket_disconnect",
+            user_id=str(user.id),
+            chat_id=str(chat_id),
+            reason="client_disconnect",
+        )
     
     except Exception as e:
-        log_data = {
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "event": "websocket_error",
-            "error_type": "unexpected",
-            "user_id": str(user.id),
-            "chat_id": str(chat_id),
-            "error": str(e)
-        }
-        logger.error(json.dumps(log_data))
+        log_event(logger, logging.ERROR, "websocket_error",
+            error_type="unexpected",
+            user_id=str(user.id),
+            chat_id=str(chat_id),
+            error=str(e),
+        )
         manager.disconnect(chat_id, user.id)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app import models, schemas, crud
+
+# per-row cost of turning a /messages page into JSON bytes: the old path (ORM instances, from_orm().dict(),
+# then FastAPI's jsonable_encoder and json) against rows encoded straight by orjson.
+# run from api/: python -m benchmarks.bench_serialization --rows 250 --repeat 200
+
+
+def seed(rows: int):
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(models.User(id=1, username="bench", display_name="Bench", email="bench@example.com", password_hash="x"))
+    db.add(models.Chat(id=1, name="bench"))
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db.add_all(models.Message(chat_id=1, user_id=1, content=f"message {i} " * 4, created_at=start + timedelta(seconds=i)) for i in range(rows))
+    db.commit()
+    return db
+
+
+def before(db, rows: int) -> bytes:
+    items = db.query(models.Message).order_by(models.Message.created_at.desc()).limit(rows).all()
+    payload = {'items': [schemas.MessageOut.from_orm(m).dict() for m in items]}
+    return json.dumps(jsonable_encoder(payload)).encode()
+
+
+def after(db, rows: int) -> bytes:
+    items = db.query(*crud.MESSAGE_FIELDS).outerjoin(models.User, models.User.id == models.Message.user_id).order_by(models.Message.created_at.desc()).limit(rows).all()
+    return orjson.dumps({'items': [m._asdict() for m in items]})
+
+
+def encode_only(items, fast: bool) -> bytes:
+    # the serialization alone, on rows already fetched
+    if fast:
+        return orjson.dumps({'items': [m._asdict() for m in items]})
+    return json.dumps(jsonable_encoder({'items': [schemas.MessageOut.from_orm(m).dict() for m in items]})).encode()
+
+
+def timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(rows: int = 250, repeat: int = 200) -> dict:
+    db = seed(rows)
+    orm_rows = db.query(models.Message).limit(rows).all()
+    plain_rows = db.query(*crud.MESSAGE_FIELDS).outerjoin(models.User, models.User.id == models.Message.user_id).limit(rows).all()
+    results = {
+        'query+encode before': timed(lambda: before(db, rows), repeat),
+        'query+encode after': timed(lambda: after(db, rows), repeat),
+        'encode before': timed(lambda: encode_only(orm_rows, False), repeat),
+        'encode after': timed(lambda: encode_only(plain_rows, True), repeat),
+    }
+    db.close()
+    # microseconds per row, best of `repeat`
+    return {name: round(seconds / rows * 1e6, 2) for name, seconds in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-row JSON serialization cost of list endpoints, before and after')
+    parser.add_argument('--rows', type=int, default=250)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    results = run(args.rows, args.repeat)
+    for name, us in results.items():
+        print(f"{name:22} {us:8.2f} us/row")
+    print(f"encode speedup: {results['encode before'] / results['encode after']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import logging
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta, timezone
+import sqlalchemy
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from fastapi.testclient import TestClient
+from app.database import Base
+from app import models, crud, cache, schemas
+from app.main import app, get_db, get_current_user
+from app.security import create_access_token, hash_password
+from .bench_serialization import encode_only
+
+# the api's hot paths, timed in process against a freshly seeded database at several sizes. results go to
+# a JSON file and are compared against a saved baseline; a case slower than the baseline by more than
+# --threshold fails the run (exit 1).
+#
+# run from api/:
+#   python -m benchmarks.run --save-baseline          (on the reference commit)
+#   python -m benchmarks.run                          (on the change, compared to the baseline)
+# sqlite in a temp dir by default; --database-url points it at an empty scratch postgres instead
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+PER_PAGE = 50
+CASES = {}
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def seed(url: str, messages: int, rng_seed: int = 42):
+    # users, chats and members scale with the message count; one chat gets a fifth of the traffic
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(rng_seed)
+    users, chats = max(20, messages // 50), max(5, messages // 200)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    password = hash_password('bench')
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {'id': i, 'username': f'user{i}', 'display_name': f'User {i}', 'email': f'user{i}@example.com', 'password_hash': password}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(models.Chat), [{'id': i, 'name': f'chat {i} room', 'is_private': i % 10 == 0} for i in range(1, chats + 1)])
+        members = {(c, rng.randint(1, users)) for c in range(1, chats + 1) for _ in range(5)}
+        conn.execute(insert(models.ChatMember), [{'chat_id': c, 'user_id': u, 'role': 'member'} for c, u in sorted(members)])
+        rows = []
+        for i in range(messages):
+            rows.append({
+                'chat_id': 1 if rng.random() < 0.2 else rng.randint(1, chats),
+                'user_id': rng.randint(1, users),
+                'content': f'message {i} about lunch and plans',
+                'created_at': start + timedelta(seconds=i * 7),
+            })
+            if len(rows) == 5000:
+                conn.execute(insert(models.Message), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(models.Message), rows)
+    return engine, {'hot_chat': 1, 'user_id': 1, 'messages': messages, 'token': create_access_token(subject=1)}
+
+
+@case('list_chats')
+def _list_chats(db, ctx):
+    crud.list_chats(db, 1, PER_PAGE)
+
+
+@case('list_chats_search')
+def _list_chats_search(db, ctx):
+    crud.list_chats(db, 1, PER_PAGE, search='room 1')
+
+
+@case('list_messages_chat')
+def _list_messages_chat(db, ctx):
+    crud.list_messages(db, 1, PER_PAGE, chat_id=ctx['hot_chat'])
+
+
+@case('list_messages_deep_page')
+def _list_messages_deep_page(db, ctx):
+    crud.list_messages(db, max(1, ctx['messages'] // PER_PAGE - 1), PER_PAGE)
+
+
+@case('paginate_users')
+def _paginate_users(db, ctx):
+    crud.paginate_query(db.query(models.User).order_by(models.User.id), 2, PER_PAGE)
+
+
+@case('auth_current_user')
+def _auth_current_user(db, ctx):
+    get_current_user(ctx['token'], db)
+
+
+@case('create_message')
+def _create_message(db, ctx):
+    crud.create_message(db, ctx['user_id'], ctx['hot_chat'], 'benchmark message')
+
+
+@case('create_messages_bulk_100')
+def _create_messages_bulk(db, ctx):
+    crud.create_messages_bulk(db, ctx['user_id'], [schemas.MessageCreate(chat_id=1 + i % 5, content='benchmark message') for i in range(100)])
+
+
+@case('serialize_messages_page')
+def _serialize(db, ctx):
+    encode_only(ctx['page_rows'], True)
+
+
+@case('endpoint_chat_messages')
+def _endpoint(db, ctx):
+    cache.store.clear()
+    assert ctx['client'].get(f"/chats/{ctx['hot_chat']}/messages").status_code == 200
+
+
+@case('endpoint_chat_messages_cached')
+def _endpoint_cached(db, ctx):
+    assert ctx['client'].get(f"/chats/{ctx['hot_chat']}/messages").status_code == 200
+
+
+def measure(fn, repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - started) * 1000)
+    runs.sort()
+    return {
+        'median_ms': round(statistics.median(runs), 4),
+        'p95_ms': round(runs[min(len(runs) - 1, int(len(runs) * 0.95))], 4),
+        'min_ms': round(runs[0], 4),
+        'runs': repeat,
+    }
+
+
+def run(sizes=DEFAULT_SIZES, repeat: int = 30, url: str = None, only=None) -> dict:
+    # the request log line per call would dominate the endpoint cases
+    loggers = [logging.getLogger(name) for name in ('tears-api', 'httpx')]
+    levels = [logger.level for logger in loggers]
+    for logger in loggers:
+        logger.setLevel(logging.WARNING)
+    try:
+        return _run(sizes, repeat, url, only)
+    finally:
+        for logger, level in zip(loggers, levels):
+            logger.setLevel(level)
+
+
+def _run(sizes, repeat, url, only) -> dict:
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine, ctx = seed(url or f"sqlite:///{os.path.join(tmp, 'bench.db')}", size)
+            Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+            def override_get_db():
+                db = Session()
+                try:
+                    yield db
+                finally:
+                    db.close()
+
+            app.dependency_overrides[get_db] = override_get_db
+            ctx['client'] = TestClient(app)
+            try:
+                with Session() as db:
+                    ctx['page_rows'] = crud.list_messages(db, 1, 250, chat_id=ctx['hot_chat'])['items']
+                    for name, fn in CASES.items():
+                        if only and name not in only:
+                            continue
+                        results[f'{name}@{size}'] = measure(lambda: fn(db, ctx), repeat)
+                        db.rollback()
+            finally:
+                app.dependency_overrides.pop(get_db, None)
+                cache.store.clear()
+                engine.dispose()
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list:
+    # (key, baseline ms, current ms, ratio) for every case in both; medians, the least noisy of the three
+    rows = []
+    for key, current in results.items():
+        before = baseline.get(key)
+        if before:
+            rows.append((key, before['median_ms'], current['median_ms'], current['median_ms'] / max(before['median_ms'], 1e-9)))
+    return rows
+
+
+def _meta(url: str) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'database': (url or 'sqlite').split(':', 1)[0],
+        'machine': platform.machine(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API hot paths and compare against a baseline')
+    parser.add_argument('--sizes', type=str, default=','.join(map(str, DEFAULT_SIZES)), help='Seeded message counts, comma separated')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--cases', type=str, default=None, help=f"Comma separated subset of: {', '.join(CASES)}")
+    parser.add_argument('--database-url', type=str, default=None, help='Empty scratch database (tables are dropped); default sqlite in a temp dir')
+    parser.add_argument('--output', type=str, default=os.path.join(RESULTS_DIR, 'latest.json'))
+    parser.add_argument('--baseline', type=str, default=os.path.join(RESULTS_DIR, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown of a median before it counts as a regression')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    only = set(args.cases.split(',')) if args.cases else None
+    report = {'meta': _meta(args.database_url), 'results': run(sizes, args.repeat, args.database_url, only)}
+    target = args.baseline if args.save_baseline else args.output
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    with open(target, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline is None:
+        for key, r in report['results'].items():
+            print(f"{key:42} {r['median_ms']:10.3f} ms  p95 {r['p95_ms']:10.3f} ms")
+        print(f'written to {target}')
+        return
+    regressions = 0
+    print(f"baseline {baseline['meta'].get('commit')} -> {report['meta']['commit']}")
+    for key, before, now, ratio in compare(report['results'], baseline['results']):
+        flag = 'REGRESSION' if ratio > 1 + args.threshold else ''
+        regressions += bool(flag)
+        print(f"{key:42} {before:10.3f} -> {now:10.3f} ms  {(ratio - 1) * 100:+7.1f}%  {flag}")
+    print(f'written to {target}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
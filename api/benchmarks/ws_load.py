@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from urllib.request import urlopen
+import websockets
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app import models
+from app.security import create_access_token
+
+# load harness for /ws/chats/{chat_id}, all on localhost: a seeded sqlite database, the api under uvicorn in a
+# child process and thousands of websocket clients in this one. per room size it reports connect throughput
+# and latency, end to end delivery latency (send -> every member receives the broadcast), server memory per
+# connection and the time spent in ConnectionManager.broadcast_to_chat.
+#
+# run from api/:
+#   python -m benchmarks.ws_load --rooms 20 --room-size 50 --senders 2 --rate 2 --duration 10
+#   python -m benchmarks.ws_load --sweep 10,50,100,250,500 --rooms 4     (find where broadcast falls over)
+
+STATS_PATH = '/__harness/stats'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentiles(values, points=(50, 90, 99)) -> dict:
+    if not values:
+        return {f'p{p}': None for p in points}
+    values = sorted(values)
+    return {f'p{p}': round(values[min(len(values) - 1, int(len(values) * p / 100))], 3) for p in points}
+
+
+def seed(path: str, rooms: int, room_size: int):
+    # one user per connection: the manager keys sockets by (chat, user)
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(bind=engine)
+    users = rooms * room_size
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {'id': i, 'username': f'ws{i}', 'email': f'ws{i}@example.com', 'password_hash': 'x'} for i in range(1, users + 1)
+        ])
+        conn.execute(insert(models.Chat), [{'id': i, 'name': f'room {i}', 'is_private': False} for i in range(1, rooms + 1)])
+    engine.dispose()
+    # (chat_id, user_id, token) per client, rooms filled in order
+    return [(1 + n // room_size, n + 1, create_access_token(subject=n + 1)) for n in range(users)]
+
+
+def serve(port: int, db_path: str, keep_logs: bool):
+    # child process: the real app on a seeded database, plus a stats route for the harness
+    from fastapi import Response
+    import uvicorn
+    from app.main import app, get_db
+    from app.websocket import manager
+    from app import ratelimit
+
+    # the senders are meant to go as fast as asked
+    ratelimit.RATE_LIMITS = False
+    if not keep_logs:
+        for name in ('tears-api', 'tears-websocket'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    engine = create_engine(f'sqlite:///{db_path}', connect_args={'check_same_thread': False})
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def harness_get_db(response: Response):
+        db = Session()
+        db.info['response'] = response
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = harness_get_db
+
+    broadcasts = []
+    original = manager.broadcast_to_chat
+
+    async def timed_broadcast(message, chat_id, exclude_user=None):
+        started = time.perf_counter()
+        try:
+            await original(message, chat_id, exclude_user)
+        finally:
+            broadcasts.append((time.perf_counter() - started) * 1000)
+
+    manager.broadcast_to_chat = timed_broadcast
+
+    @app.get(STATS_PATH)
+    def harness_stats(reset: bool = False):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        with open('/proc/self/statm') as f:
+            rss_kb = int(f.read().split()[1]) * resource.getpagesize() // 1024
+        stats = {
+            'rss_kb': rss_kb,
+            'cpu_s': usage.ru_utime + usage.ru_stime,
+            'connections': manager.get_total_connections(),
+            'broadcasts': len(broadcasts),
+            'broadcast_ms_total': round(sum(broadcasts), 3),
+            'broadcast_ms': _percentiles(broadcasts),
+        }
+        if reset:
+            broadcasts.clear()
+        return stats
+
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning', ws_max_queue=1024)
+
+
+def _stats(base: str, reset: bool = False) -> dict:
+    with urlopen(f"{base}{STATS_PATH}?reset={'true' if reset else 'false'}") as r:
+        return json.load(r)
+
+
+class Client:
+    def __init__(self, chat_id: int, user_id: int, token: str):
+        self.chat_id, self.user_id, self.token = chat_id, user_id, token
+        self.ws = None
+        self.latencies = []
+        self.received = 0
+
+    async def connect(self, url: str) -> float:
+        started = time.perf_counter()
+        self.ws = await websockets.connect(f'{url}/ws/chats/{self.chat_id}?token={self.token}', max_queue=None, open_timeout=60)
+        # the "connected" system message means the server finished auth and registered the socket
+        await self.ws.recv()
+        return (time.perf_counter() - started) * 1000
+
+    async def listen(self):
+        try:
+            async for raw in self.ws:
+                event = json.loads(raw)
+                if event.get('type') != 'message':
+                    continue
+                self.received += 1
+                sent = event['content'].split('|', 1)[0]
+                if sent.isdigit():
+                    self.latencies.append((time.perf_counter_ns() - int(sent)) / 1e6)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send_loop(self, rate: float, until: float):
+        sent = 0
+        while time.perf_counter() < until:
+            await self.ws.send(json.dumps({'content': f'{time.perf_counter_ns()}|load'}))
+            sent += 1
+            await asyncio.sleep(1 / rate)
+        return sent
+
+
+async def _run_round(url: str, base: str, clients, senders: int, rate: float, duration: float, concurrency: int) -> dict:
+    before = _stats(base, reset=True)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def connect(client):
+        async with gate:
+            return await client.connect(url)
+
+    started = time.perf_counter()
+    connect_ms = await asyncio.gather(*(connect(c) for c in clients))
+    connect_s = time.perf_counter() - started
+    connected = _stats(base, reset=True)
+    listeners = [asyncio.create_task(c.listen()) for c in clients]
+
+    by_room = {}
+    for c in clients:
+        by_room.setdefault(c.chat_id, []).append(c)
+    talkers = [c for members in by_room.values() for c in members[:senders]]
+    until = time.perf_counter() + duration
+    sent = sum(await asyncio.gather(*(c.send_loop(rate, until) for c in talkers)))
+    # let the last broadcasts land
+    await asyncio.sleep(min(5.0, max(1.0, duration / 5)))
+    after = _stats(base)
+    for c in clients:
+        await c.ws.close()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    room_size = len(clients) // max(1, len(by_room))
+    latencies = [ms for c in clients for ms in c.latencies]
+    expected = sent * room_size
+    received = sum(c.received for c in clients)
+    cpu = after['cpu_s'] - connected['cpu_s']
+    return {
+        'connections': len(clients),
+        'room_size': room_size,
+        'connect_per_s': round(len(clients) / connect_s, 1),
+        'connect_ms': _percentiles(connect_ms),
+        'server_kb_per_connection': round((connected['rss_kb'] - before['rss_kb']) / max(1, len(clients)), 2),
+        'messages_sent': sent,
+        'deliveries_expected': expected,
+        'deliveries': received,
+        'delivery_ratio': round(received / expected, 4) if expected else None,
+        'delivery_ms': _percentiles(latencies),
+        'server_cpu_s': round(cpu, 3),
+        'server_cpu_share': round(cpu / duration, 3),
+        'broadcasts': after['broadcasts'],
+        'broadcast_ms': after['broadcast_ms'],
+        'broadcast_share_of_cpu': round(after['broadcast_ms_total'] / 1000 / cpu, 3) if cpu else None,
+    }
+
+
+def run(rooms: int, room_size: int, senders: int, rate: float, duration: float, concurrency: int = 200, keep_logs: bool = False) -> dict:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'ws.db')
+        specs = seed(db_path, rooms, room_size)
+        port = _free_port()
+        server = multiprocessing.get_context('fork').Process(target=serve, args=(port, db_path, keep_logs), daemon=True)
+        server.start()
+        base, url = f'http://127.0.0.1:{port}', f'ws://127.0.0.1:{port}'
+        try:
+            for _ in range(100):
+                try:
+                    _stats(base)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            clients = [Client(*spec) for spec in specs]
+            return asyncio.run(_run_round(url, base, clients, senders, rate, duration, concurrency))
+        finally:
+            server.terminate()
+            server.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket fan-out load test against a local api')
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--room-size', type=int, default=50, help='Connections per chat')
+    parser.add_argument('--sweep', type=str, default=None, help='Comma separated room sizes to run one after the other (overrides --room-size)')
+    parser.add_argument('--senders', type=int, default=2, help='Clients sending in every room')
+    parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per sender')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of sending')
+    parser.add_argument('--concurrency', type=int, default=200, help='Connections opened at once')
+    parser.add_argument('--keep-logs', action='store_true', help="Keep the server's per-event JSON logs (off by default)")
+    parser.add_argument('--output', type=str, default=None, help='Write the reports as JSON here')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sweep.split(',')] if args.sweep else [args.room_size]
+    reports = []
+    for size in sizes:
+        report = run(args.rooms, size, args.senders, args.rate, args.duration, args.concurrency, args.keep_logs)
+        reports.append(report)
+        print(
+            f"room {size:5}  conns {report['connections']:6}  connect {report['connect_per_s']:8.1f}/s  "
+            f"delivery p50 {report['delivery_ms']['p50']} p99 {report['delivery_ms']['p99']} ms  "
+            f"delivered {report['delivery_ratio']}  broadcast p99 {report['broadcast_ms']['p99']} ms  "
+            f"server cpu {report['server_cpu_share']}  {report['server_kb_per_connection']} KB/conn"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import heapq
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+# workload shapes for the generator. everything takes an explicit rng (random.Random or the random
+# module itself) so the fast mode can give each chunk its own seeded stream
+
+# relative activity by local hour (0-23) and weekday (mon-sun): quiet nights, a lunch bump,
+# an evening peak and slower weekends
+HOURLY = (0.25, 0.12, 0.06, 0.04, 0.04, 0.08, 0.25, 0.55, 0.85, 1.0, 1.0, 1.1,
+          1.35, 1.25, 1.0, 0.95, 1.05, 1.25, 1.55, 1.85, 2.0, 1.8, 1.2, 0.6)
+WEEKLY = (1.0, 1.05, 1.05, 1.1, 1.15, 0.8, 0.7)
+FLAT_HOURLY = (1.0,) * 24
+FLAT_WEEKLY = (1.0,) * 7
+
+
+class Weighted:
+    # items with fixed weights; draws are a bisect over the cumulative weights, O(log n)
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.weights = list(weights)
+        self.cum = list(accumulate(self.weights))
+        self.total = self.cum[-1] if self.cum else 0.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, rng):
+        return self.items[bisect_right(self.cum, rng.random() * self.total, 0, len(self.cum) - 1)]
+
+    def distinct(self, rng, k: int):
+        # k distinct items, weighted. the only set is the k picked so far, never every pair generated
+        n = len(self.items)
+        if k >= n:
+            return list(self.items)
+        if k * 2 > n:
+            # dense picks: rejection would spin, take the k largest u^(1/w) keys instead (Efraimidis-Spirakis)
+            keyed = ((rng.random() ** (1.0 / w) if w > 0 else 0.0, i) for i, w in enumerate(self.weights))
+            return [self.items[i] for _, i in heapq.nlargest(k, keyed)]
+        picked = {}
+        while len(picked) < k:
+            picked[self.draw(rng)] = None
+        return list(picked)
+
+
+class Clock:
+    # seasonal timestamps between start and end (aware datetimes), returned as epoch seconds.
+    # a day is drawn by weekday weight, then an hour of that local day by hourly weight
+    def __init__(self, start: datetime, end: datetime, hourly=FLAT_HOURLY, weekly=FLAT_WEEKLY):
+        self.start, self.end = start.timestamp(), end.timestamp()
+        first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        days = []
+        day = first
+        while day.timestamp() < self.end:
+            days.append(day)
+            day += timedelta(days=1)
+        days = days or [first]
+        self.days = Weighted([d.timestamp() for d in days], [weekly[d.weekday()] for d in days])
+        self.hours = Weighted(range(24), hourly)
+
+    def draw(self, rng) -> float:
+        # draws outside [start, end) (the partial first and last day) are simply redrawn
+        for _ in range(100):
+            ts = self.days.draw(rng) + (self.hours.draw(rng) + rng.random()) * 3600
+            if self.start <= ts < self.end:
+                return ts
+        return self.start + rng.random() * (self.end - self.start)
+
+
+# uniform reproduces the original generator: even chat sizes, every member equally active, flat
+# timestamps. skewed gives zipf-sized chats (a few hot ones), lognormal per-user activity, daily/weekly
+# seasonality and bursty threads
+class Workload:
+    def __init__(self, kind: str = 'uniform', zipf_s: float = 1.1, user_sigma: float = 1.5,
+                 burst_p: float = 0.15, burst_mean: float = 8.0, burst_gap: float = 40.0):
+        self.kind = kind
+        self.zipf_s = zipf_s
+        self.user_sigma = user_sigma
+        self.burst_p = burst_p if kind == 'skewed' else 0.0
+        self.burst_mean = burst_mean
+        self.burst_gap = burst_gap
+
+    @property
+    def skewed(self) -> bool:
+        return self.kind == 'skewed'
+
+    def clock(self, start: datetime, end: datetime) -> Clock:
+        if self.skewed:
+            return Clock(start, end, HOURLY, WEEKLY)
+        return Clock(start, end)
+
+    def user_weights(self, rng, count: int):
+        # lognormal tail: sigma 1.5 puts ~20% of the messages on the top 1% of users, 2.0 about 37%.
+        # (a pareto with alpha near 1 lets two or three users write most of the dataset.) the weight
+        # is used twice, to join chats and to post in them, so each use gets half the spread
+        if not self.skewed:
+            return [1.0] * count
+        return [rng.lognormvariate(0.0, self.user_sigma / 2) for _ in range(count)]
+
+    def chat_sizes(self, rng, chats: int, total: int, users: int):
+        # member count per chat, summing to total (less if chats fill up at `users` members)
+        if chats <= 0:
+            return []
+        if not self.skewed:
+            base, extra = divmod(total, chats)
+            return [min(base + (1 if i < extra else 0), users) for i in range(chats)]
+        # popularity rank is shuffled so the hot chats are not simply the oldest ids
+        ranks = list(range(1, chats + 1))
+        rng.shuffle(ranks)
+        weights = [1.0 / r ** self.zipf_s for r in ranks]
+        scale = total / sum(weights)
+        sizes = [min(max(int(w * scale), 1), users) for w in weights]
+        # hand out what rounding and caps left over, biggest chats first
+        short = total - sum(sizes)
+        order = sorted(range(chats), key=lambda i: -weights[i])
+        while short > 0:
+            grew = False
+            for i in order:
+                if short <= 0:
+                    break
+                if sizes[i] < users:
+                    sizes[i] += 1
+                    short -= 1
+                    grew = True
+            if not grew:
+                break
+        return sizes
+
+    def threads(self, rng, chats: Weighted, members: dict, clock: Clock, count: int):
+        # yields (chat_id, user_id, epoch seconds). chats is weighted by message volume, members maps
+        # chat_id -> Weighted of its users. a burst is a run of quick replies among a few members
+        produced = 0
+        while produced < count:
+            chat_id = chats.draw(rng)
+            people = members[chat_id]
+            ts = clock.draw(rng)
+            if self.burst_p and len(people) > 1 and rng.random() < self.burst_p:
+                speakers = people.distinct(rng, min(rng.randint(2, 4), len(people)))
+                length = 2 + int(rng.expovariate(1.0 / self.burst_mean))
+                for _ in range(min(length, count - produced)):
+                    yield chat_id, speakers[int(rng.random() * len(speakers))], ts
+                    produced += 1
+                    ts += rng.expovariate(1.0 / self.burst_gap)
+                    if ts >= clock.end:
+                        break
+                continue
+            yield chat_id, people.draw(rng), ts
+            produced += 1
+
+
+def message_pool(pairs, user_weight):
+    # (chat_id, user_id) rows -> (chats weighted by total member activity, {chat_id: Weighted members})
+    by_chat = {}
+    for chat_id, user_id in pairs:
+        by_chat.setdefault(chat_id, []).append(user_id)
+    members = {chat_id: Weighted(users, [user_weight(u) for u in users]) for chat_id, users in by_chat.items()}
+    chats = Weighted(list(members), [m.total for m in members.values()])
+    return chats, members
@@ -1,13 +1,25 @@
+import io
 import os
 import sys
+import json
+import uuid
 import pathlib
 sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Boolean, DateTime, Text, Float
-from datetime import datetime, timedelta
-from sqlalchemy import select, func, distinct, and_
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Boolean, DateTime, Text, Float, inspect
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, distinct, and_, case, tuple_
 from sqlalchemy.orm import Session, sessionmaker
 from app import models
 import argparse
+import re
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # transform falls back to plain python below
+    pa = pc = None
 
 SRC_DB = os.getenv('SRC_DATABASE_URL', os.getenv('DATABASE_URL'))
 ANALYTICS_DB = os.getenv('ANALYTICS_DATABASE_URL', os.getenv('ANALYTICS_DB_URL', 'sqlite:///./analytics.db'))
@@ -47,7 +59,12 @@ def ensure_target_schema(engine):
                      Column('content', Text),
                      Column('content_length', Integer),
                      Column('word_count', Integer),
-                     Column('created_at', DateTime),
+                     # the parquet export reads it a day at a time
+                     Column('created_at', DateTime, index=True),
+                     Column('url_count', Integer),
+                     Column('mention_count', Integer),
+                     Column('emoji_count', Integer),
+                     Column('lang_bucket', String(16)),
                      )
 
     chat_daily = Table('chat_daily', meta,
@@ -57,26 +74,61 @@ def ensure_target_schema(engine):
                        Column('active_users', Integer),
                        )
 
+    # exact distinct users per (date, chat): one row per user with its message count that day
+    chat_daily_users = Table('chat_daily_users', meta,
+                             Column('date', DateTime, primary_key=True),
+                             Column('chat_id', Integer, primary_key=True),
+                             Column('user_id', Integer, primary_key=True),
+                             Column('messages', Integer),
+                             )
+
     etl_state = Table('etl_state', meta,
                       Column('key', String(64), primary_key=True),
                       Column('value', String(256)),
                       )
+
+    # one row per run: what the extract found, consumed by every later stage
+    etl_runs = Table('etl_runs', meta,
+                     Column('run_id', String(64), primary_key=True),
+                     Column('status', String(16)),
+                     Column('created_at', DateTime),
+                     Column('completed_at', DateTime),
+                     Column('manifest', Text),
+                     )
     meta.create_all(engine)
+    _add_missing_columns(engine, messages)
+    _add_missing_indexes(engine, messages)
     return {
         'chats': chats,
         'messages': messages,
         'users': users,
         'chat_daily': chat_daily,
+        'chat_daily_users': chat_daily_users,
         'etl_state': etl_state,
+        'runs': etl_runs,
     }
 
+def _add_missing_columns(engine, table):
+    # create_all never alters existing tables; new nullable columns are added in place
+    existing = {c['name'] for c in inspect(engine).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    if missing:
+        with engine.begin() as conn:
+            for col in missing:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}')
+
+def _add_missing_indexes(engine, table):
+    # same for indexes declared after the table was first created
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+
 def run_etl(dry_run: bool = False, batch_size: int = 500, incremental: bool = False, since: str = None, reset: bool = False):
     print('ETL: source=', SRC_DB, 'target=', ANALYTICS_DB, 'dry_run=', dry_run, 'batch_size=', batch_size, 'incremental=', incremental, 'since=', since, 'reset=', reset)
 
     prep = prepare_etl(dry_run=dry_run, batch_size=batch_size, incremental=incremental, since=since, reset=reset)
     total_messages = int(prep.get('total_messages', 0))
-    if total_messages == 0:
-        print('No new messages to process')
+    if dry_run or not prep.get('run_id'):
+        print(f'dry run: {total_messages} messages would be processed' if dry_run else 'No changes to process')
         return {
             'messages': 0,
             'chats': 0,
@@ -84,31 +136,24 @@ def run_etl(dry_run: bool = False, batch_size: int = 500, incremental: bool = Fa
             'daily_rows': 0,
         }
 
-    message_ids = prep.get('message_ids', [])
-    affected_chat_ids = prep.get('affected_chat_ids', [])
-    affected_user_ids = prep.get('affected_user_ids', [])
-    min_dt = prep.get('min_dt')
-    max_dt = prep.get('max_dt')
-    new_max_id = prep.get('new_max_id')
-
-    messages_written = 0
-    if not dry_run:
-        for i in range(0, len(message_ids), batch_size):
-            batch = message_ids[i:i+batch_size]
-            res = process_message_batch(batch, batch_size)
-            messages_written += int(res.get('messages_written', 0))
-
-    meta_res = finalize_metadata(affected_chat_ids, affected_user_ids, new_max_id)
+    run_id = prep['run_id']
+    # every stage reads the manifest written by prepare_etl, so the branches are independent
+    # daily rollups are maintained by process_messages, in the same transactions as the messages
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        msg_fut = pool.submit(process_messages, run_id, batch_size)
+        chats_fut = pool.submit(finalize_chats, run_id, batch_size)
+        users_fut = pool.submit(finalize_users, run_id, batch_size)
+        msg_res, chats_res, users_res = msg_fut.result(), chats_fut.result(), users_fut.result()
 
-    daily_res = finalize_daily_rollups(affected_chat_ids, min_dt, max_dt, batch_size)
+    complete_run(run_id)
 
     summary = {
-        'messages': messages_written,
-        'chats': int(meta_res.get('chats_written', 0)),
-        'users': int(meta_res.get('users_written', 0)),
-        'daily_rows': int(daily_res.get('daily_rows_written', 0)),
-        'min_dt': min_dt,
-        'max_dt': max_dt,
+        'messages': int(msg_res.get('messages_written', 0)),
+        'chats': int(chats_res.get('chats_written', 0)),
+        'users': int(users_res.get('users_written', 0)),
+        'daily_rows': int(msg_res.get('daily_rows_written', 0)),
+        'min_dt': prep.get('min_dt'),
+        'max_dt': prep.get('max_dt'),
     }
     print('ETL finished')
     return summary
@@ -117,216 +162,567 @@ def main():
     parser = argparse.ArgumentParser(description='ETL to analytics DB')
     parser.add_argument('--dry-run', action='store_true', help='Compute and print actions without writing to target')
     parser.add_argument('--batch-size', type=int, default=500, help='Batch size for message inserts')
-    parser.add_argument('--incremental', action='store_true', help='Only process new messages since last ETL run')
+    parser.add_argument('--incremental', action='store_true', help='Only process rows changed (inserted, edited or deleted) since the last ETL run')
     parser.add_argument('--since', type=str, default=None, help='ISO datetime lower bound for messages (e.g. 2025-01-01T00:00:00)')
-    parser.add_argument('--reset', action='store_true', help='Reset ETL state (clear watermark)')
+    parser.add_argument('--reset', action='store_true', help='Reset ETL state (clear watermarks)')
+    parser.add_argument('--rebuild-rollups', action='store_true', help='Recompute chat_daily from analytics_messages and exit')
     args = parser.parse_args()
+    if args.rebuild_rollups:
+        print(rebuild_daily_rollups())
+        return
     run_etl(dry_run=args.dry_run, batch_size=args.batch_size, incremental=args.incremental, since=args.since, reset=args.reset)
 
+def _parse_since(since: str):
+    if not since:
+        return None
+    try:
+        return datetime.fromisoformat(since)
+    except Exception:
+        print('warning: could not parse --since, ignoring')
+        return None
+
+# change tracking: every source table is read through its updated_at column (deletes through
+# change_log.changed_at). each entity keeps its own watermark in etl_state, written by complete_run.
+TRACKED = {
+    'messages': models.Message.updated_at,
+    'chats': models.Chat.updated_at,
+    'chat_members': models.ChatMember.updated_at,
+    'users': models.User.updated_at,
+    'change_log': models.ChangeLog.changed_at,
+}
+# rows committed late (long transactions) can carry an updated_at older than the last watermark,
+# so every incremental window starts a bit before it; all loads are idempotent upserts
+LOOKBACK_SECONDS = int(os.getenv('ETL_LOOKBACK_SECONDS', '120'))
+
+def _to_dt(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+def _source_high_watermark(src):
+    # upper bound of the window: now, or the start of the oldest open write transaction on postgres
+    high = _to_dt(src.execute(select(func.now())).scalar())
+    if src.dialect.name == 'postgresql':
+        try:
+            oldest = src.exec_driver_sql("select min(xact_start) from pg_stat_activity where backend_xid is not null and pid <> pg_backend_pid()").scalar()
+            if oldest is not None and oldest < high:
+                high = oldest
+        except Exception:
+            pass
+    return high
+
+def _read_watermarks(conn, tables):
+    rows = conn.execute(select(tables['etl_state'].c.key, tables['etl_state'].c.value).where(tables['etl_state'].c.key.like('watermark:%'))).fetchall()
+    return {key.split(':', 1)[1]: _to_dt(value) for key, value in rows if value}
+
+def _window(column, window):
+    lo, hi = window
+    clauses = [column <= _to_dt(hi)]
+    if lo is not None:
+        clauses.append(column > _to_dt(lo))
+    return and_(*clauses)
+
 def prepare_etl(dry_run: bool = False, batch_size: int = 500, incremental: bool = False, since: str = None, reset: bool = False):
+    # the only pass over the source for a run: the result is stored in etl_runs as the run manifest
     target_engine = create_engine(ANALYTICS_DB)
     tables = ensure_target_schema(target_engine)
     src_engine = create_engine(SRC_DB)
-    SrcSession = sessionmaker(autocommit=False, autoflush=False, bind=src_engine)
-    src_db = SrcSession()
-    try:
+    empty = {'run_id': None, 'total_messages': 0, 'chats': 0, 'users': 0, 'min_dt': None, 'max_dt': None, 'new_max_id': None}
+    with target_engine.begin() as conn:
+        if reset:
+            conn.execute(tables['etl_state'].delete())
+        watermarks = _read_watermarks(conn, tables) if incremental else {}
+        needs_rollup_rebuild = conn.execute(select(tables['messages'].c.id).limit(1)).first() is not None and \
+            conn.execute(select(tables['chat_daily_users'].c.chat_id).limit(1)).first() is None
+    if needs_rollup_rebuild and not dry_run:
+        # analytics_messages predates chat_daily_users: seed it so deltas start from exact counts
+        rebuild_daily_rollups(target_engine=target_engine)
+
+    since_dt = _parse_since(since)
+    # an incremental run without any stored watermark is a full load
+    full_scope = not since_dt and not (incremental and watermarks)
+    M = models.Message
+    chat_ids = user_ids = None
+    deleted = {'messages': [], 'chats': [], 'users': []}
+    with src_engine.connect() as src:
+        high = _source_high_watermark(src)
+        windows = {}
+        for entity in TRACKED:
+            lo = watermarks.get(entity)
+            windows[entity] = [(lo - timedelta(seconds=LOOKBACK_SECONDS)).isoformat() if lo else None, high.isoformat()]
+
+        if full_scope:
+            # everything is affected: a single aggregate is enough, downstream stages work on whole tables
+            row = src.execute(select(func.count(M.id), func.min(M.id), func.max(M.id), func.min(M.created_at), func.max(M.created_at))).one()
+            total, min_id, max_id, min_dt, max_dt = row
+        else:
+            total, min_id, max_id, min_dt, max_dt = 0, None, None, None, None
+            chats, users = set(), set()
+            q = select(M.id, M.chat_id, M.user_id, M.created_at)
+            if since_dt:
+                q = q.where(M.created_at >= since_dt)
+            if incremental and watermarks:
+                q = q.where(_window(M.updated_at, windows['messages']))
+            for mid, chat_id, user_id, created_at in src.execution_options(stream_results=True, yield_per=batch_size or 1000).execute(q):
+                total += 1
+                min_id = mid if min_id is None or mid < min_id else min_id
+                max_id = mid if max_id is None or mid > max_id else max_id
+                created_at = _to_dt(created_at)
+                if created_at is not None:
+                    min_dt = created_at if min_dt is None or created_at < min_dt else min_dt
+                    max_dt = created_at if max_dt is None or created_at > max_dt else max_dt
+                chats.add(chat_id)
+                users.add(user_id)
+
+            if incremental and watermarks:
+                chats.update(r[0] for r in src.execute(select(models.Chat.id).where(_window(models.Chat.updated_at, windows['chats']))))
+                for chat_id, user_id in src.execute(select(models.ChatMember.chat_id, models.ChatMember.user_id).where(_window(models.ChatMember.updated_at, windows['chat_members']))):
+                    chats.add(chat_id)
+                users.update(r[0] for r in src.execute(select(models.User.id).where(_window(models.User.updated_at, windows['users']))))
+                CL = models.ChangeLog
+                for entity, entity_id, chat_id, user_id in src.execute(select(CL.entity, CL.entity_id, CL.chat_id, CL.user_id).where(_window(CL.changed_at, windows['change_log']))):
+                    if entity in deleted:
+                        deleted[entity].append(entity_id)
+                    if chat_id is not None and entity != 'chats':
+                        chats.add(chat_id)
+                    if user_id is not None and entity != 'users':
+                        users.add(user_id)
+                chats.difference_update(deleted['chats'])
+                users.difference_update(deleted['users'])
+            chat_ids, user_ids = sorted(chats), sorted(users)
+
+    if deleted['messages']:
+        # deleted rows are gone from the source; their dates are still in the analytics copy
+        with target_engine.connect() as conn:
+            am = tables['messages']
+            lo_dt, hi_dt = conn.execute(select(func.min(am.c.created_at), func.max(am.c.created_at)).where(am.c.id.in_(deleted['messages']))).one()
+            for d in (_to_dt(lo_dt), _to_dt(hi_dt)):
+                if d is not None:
+                    # the analytics copy is naive UTC, the source may hand back aware datetimes
+                    if d.tzinfo is None and min_dt is not None and min_dt.tzinfo is not None:
+                        d = d.replace(tzinfo=timezone.utc)
+                    min_dt = d if min_dt is None or d < min_dt else min_dt
+                    max_dt = d if max_dt is None or d > max_dt else max_dt
+
+    has_changes = total or chat_ids or user_ids or any(deleted.values())
+    if not has_changes:
+        return empty
+
+    manifest = {
+        'run_id': uuid.uuid4().hex,
+        'incremental': bool(incremental and watermarks),
+        'since': since_dt.isoformat() if since_dt else None,
+        'total_messages': int(total),
+        'min_id': int(min_id) if min_id is not None else None,
+        'max_id': int(max_id) if max_id is not None else None,
+        # None means "all" (full run)
+        'chat_ids': chat_ids,
+        'user_ids': user_ids,
+        'deleted': deleted,
+        'windows': windows,
+        'min_dt': min_dt.isoformat() if min_dt else None,
+        'max_dt': max_dt.isoformat() if max_dt else None,
+    }
+    if not dry_run:
         with target_engine.begin() as conn:
-            if reset:
-                conn.execute(tables['etl_state'].delete())
-
-            last_max_id = 0
-            if incremental:
-                res = conn.execute(select(tables['etl_state'].c.value).where(tables['etl_state'].c.key == 'messages_max_id')).fetchone()
-                last_max_id = int(res[0]) if res and res[0] else 0
-
-            msg_query = src_db.query(models.Message).order_by(models.Message.id)
-            if since:
-                try:
-                    since_dt = datetime.fromisoformat(since)
-                    msg_query = msg_query.filter(models.Message.created_at >= since_dt)
-                except Exception:
-                    print('warning: could not parse --since, ignoring')
-            if incremental and last_max_id:
-                msg_query = msg_query.filter(models.Message.id > last_max_id)
-
-            messages = msg_query.all()
-            message_ids = [m.id for m in messages]
-            if not message_ids:
-                return {'total_messages': 0, 'message_ids': [], 'affected_chat_ids': [], 'affected_user_ids': [], 'min_dt': None, 'max_dt': None, 'new_max_id': None}
-
-            new_max_id = max(message_ids)
-            affected_chat_ids = list({m.chat_id for m in messages})
-            affected_user_ids = list({m.user_id for m in messages})
-
-            if not incremental and not since:
-                try:
-                    all_chats = src_db.query(models.Chat).all()
-                    affected_chat_ids = [c.id for c in all_chats]
-                    all_users = src_db.query(models.User).all()
-                    affected_user_ids = [u.id for u in all_users]
-                except Exception:
-                    pass
-            min_dt = min((m.created_at for m in messages)) if messages else None
-            max_dt = max((m.created_at for m in messages)) if messages else None
-
-            return {
-                'total_messages': len(message_ids),
-                'message_ids': message_ids,
-                'affected_chat_ids': affected_chat_ids,
-                'affected_user_ids': affected_user_ids,
-                'min_dt': min_dt.isoformat() if min_dt else None,
-                'max_dt': max_dt.isoformat() if max_dt else None,
-                'new_max_id': int(new_max_id),
-            }
+            conn.execute(tables['runs'].insert(), [{'run_id': manifest['run_id'], 'status': 'extracted', 'created_at': datetime.utcnow(), 'manifest': json.dumps(manifest)}])
+
+    return {
+        'run_id': manifest['run_id'] if not dry_run else None,
+        'total_messages': manifest['total_messages'],
+        'chats': len(chat_ids) if chat_ids is not None else None,
+        'users': len(user_ids) if user_ids is not None else None,
+        'deleted': sum(len(v) for v in deleted.values()),
+        'min_dt': manifest['min_dt'],
+        'max_dt': manifest['max_dt'],
+        'new_max_id': manifest['max_id'],
+    }
+
+
+def load_manifest(run_id: str, target_engine=None):
+    target_engine = target_engine or create_engine(ANALYTICS_DB)
+    tables = ensure_target_schema(target_engine)
+    with target_engine.connect() as conn:
+        row = conn.execute(select(tables['runs'].c.manifest).where(tables['runs'].c.run_id == run_id)).fetchone()
+    if not row:
+        raise ValueError(f'unknown ETL run {run_id}')
+    return json.loads(row[0])
+
+
+def _chunks(ids, size):
+    # None means "no filter": yield it once so callers run a single unfiltered query
+    if ids is None:
+        yield None
+        return
+    size = size or 500
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+
+def _dialect_insert(conn):
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _upsert_rows(conn, table, rows, batch_size: int = 500):
+    if not rows:
+        return 0
+    written = 0
+    insert = _dialect_insert(conn)
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i+batch_size]
+        if insert is not None:
+            # executemany form: compiled once and cached, instead of one multi-VALUES statement per batch
+            stmt = insert(table)
+            update_dict = {name: getattr(stmt.excluded, name) for name in batch[0] if name != 'id'}
+            conn.execute(stmt.on_conflict_do_update(index_elements=['id'], set_=update_dict), batch)
+        else:
+            conn.execute(table.delete().where(table.c.id.in_([r['id'] for r in batch])))
+            conn.execute(table.insert(), batch)
+        written += len(batch)
+    return written
+
+
+def _merge_add(conn, table, keys, rows, column, batch_size: int = 500):
+    # additive upsert: column = column + excluded.column
+    insert = _dialect_insert(conn)
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i+batch_size]
+        if insert is not None:
+            stmt = insert(table)
+            conn.execute(stmt.on_conflict_do_update(index_elements=keys, set_={column: table.c[column] + stmt.excluded[column]}), batch)
+            continue
+        for r in batch:
+            res = conn.execute(table.update().where(and_(*[table.c[k] == r[k] for k in keys])).values({column: table.c[column] + r[column]}))
+            if not res.rowcount:
+                conn.execute(table.insert(), [r])
+
+
+def _rollup_key(chat_id, user_id, created_at):
+    created_at = _to_dt(created_at)
+    if created_at is None:
+        return None
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return (datetime.combine(created_at.date(), datetime.min.time()), chat_id, user_id)
+
+
+def _apply_rollup_delta(conn, tables, delta, batch_size: int = 500):
+    # delta: {(date, chat_id, user_id): +/- messages}. only the touched (date, chat) rows are read or written,
+    # and their keys are returned so callers can count each daily row once however many batches touch it
+    delta = {k: n for k, n in delta.items() if n}
+    if not delta:
+        return set()
+    du, cd = tables['chat_daily_users'], tables['chat_daily']
+    _merge_add(conn, du, ['date', 'chat_id', 'user_id'], [{'date': d, 'chat_id': c, 'user_id': u, 'messages': n} for (d, c, u), n in delta.items()], 'messages', batch_size)
+    per_day = Counter()
+    for (d, c, u), n in delta.items():
+        per_day[(d, c)] += n
+    _merge_add(conn, cd, ['date', 'chat_id'], [{'date': d, 'chat_id': c, 'messages': n, 'active_users': 0} for (d, c), n in per_day.items()], 'messages', batch_size)
+
+    shrunk = [k for k, n in delta.items() if n < 0]
+    for i in range(0, len(shrunk), batch_size):
+        conn.execute(du.delete().where(tuple_(du.c.date, du.c.chat_id, du.c.user_id).in_(shrunk[i:i+batch_size]), du.c.messages <= 0))
+    touched = list(per_day.keys())
+    active = select(func.count()).select_from(du).where(du.c.date == cd.c.date, du.c.chat_id == cd.c.chat_id).scalar_subquery()
+    for i in range(0, len(touched), batch_size):
+        keys = tuple_(cd.c.date, cd.c.chat_id).in_(touched[i:i+batch_size])
+        conn.execute(cd.update().where(keys).values(active_users=active))
+        conn.execute(cd.delete().where(keys, cd.c.messages <= 0))
+    return set(touched)
+
+
+def _apply_message_changes(conn, tables, batch, deleted_ids=(), batch_size: int = 500):
+    # upserts a columnar message batch and folds the difference into the daily rollups in the same
+    # transaction: a retried batch finds its rows already there and adds nothing twice
+    am = tables['messages']
+    before = {}
+    for chunk in _chunks(batch['id'] + list(deleted_ids), batch_size):
+        for mid, chat_id, user_id, created_at in conn.execute(select(am.c.id, am.c.chat_id, am.c.user_id, am.c.created_at).where(am.c.id.in_(chunk))):
+            before[mid] = _rollup_key(chat_id, user_id, created_at)
+    delta = Counter()
+    for mid, chat_id, user_id, created_at in zip(batch['id'], batch['chat_id'], batch['user_id'], batch['created_at']):
+        old_key, new_key = before.get(mid), _rollup_key(chat_id, user_id, created_at)
+        if old_key != new_key:
+            if old_key:
+                delta[old_key] -= 1
+            if new_key:
+                delta[new_key] += 1
+    for mid in deleted_ids:
+        if before.get(mid):
+            delta[before[mid]] -= 1
+    for chunk in _chunks(list(deleted_ids), batch_size):
+        conn.execute(am.delete().where(am.c.id.in_(chunk)))
+    written = _load_message_batch(conn, am, batch, batch_size)
+    days = _apply_rollup_delta(conn, tables, delta, batch_size)
+    return written, days
+
+
+def rebuild_daily_rollups(batch_size: int = 5000, target_engine=None):
+    # one-off: recompute chat_daily / chat_daily_users from analytics_messages (upgrades, manual repair)
+    target_engine = target_engine or create_engine(ANALYTICS_DB)
+    tables = ensure_target_schema(target_engine)
+    am = tables['messages']
+    with target_engine.begin() as conn:
+        conn.execute(tables['chat_daily_users'].delete())
+        conn.execute(tables['chat_daily'].delete())
+        last_id, days = 0, set()
+        while True:
+            rows = conn.execute(select(am.c.id, am.c.chat_id, am.c.user_id, am.c.created_at).where(am.c.id > last_id).order_by(am.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            delta = Counter(k for k in (_rollup_key(r[1], r[2], r[3]) for r in rows) if k)
+            days |= _apply_rollup_delta(conn, tables, delta)
+    return {'daily_rows_written': len(days)}
+
+
+# text features. the patterns use literal characters (no \u / \x{} escapes) and ASCII-only
+# classes so the same strings give the same counts in python re and in RE2 (pyarrow.compute)
+URL_PATTERN = r'https?://\S+|www\.\S+'
+# a mention is @name after a non-word character. counted over ' ' + content so one at the start has
+# that character too: no ^, which count_substring_regex re-anchors after every match (python does not)
+MENTION_PATTERN = r'[^A-Za-z0-9_]@[A-Za-z0-9_]+'
+EMOJI_PATTERN = '[\U0001F300-\U0001FAFF\u2600-\u27BF\U0001F1E6-\U0001F1FF]'
+# first script present wins, so a message with any CJK/arabic/cyrillic letter is bucketed by it
+LANG_SCRIPTS = (
+    ('cjk', '[\u3040-\u30FF\u4E00-\u9FFF\uAC00-\uD7AF]'),
+    ('arabic', '[\u0600-\u06FF]'),
+    ('cyrillic', '[\u0400-\u04FF]'),
+    ('latin', '[A-Za-z\u00C0-\u024F]'),
+)
+_COMPILED = {name: re.compile(p, re.ASCII) for name, p in (('url', URL_PATTERN), ('mention', MENTION_PATTERN), ('emoji', EMOJI_PATTERN), *LANG_SCRIPTS)}
+FEATURE_COLUMNS = ('content_length', 'word_count', 'url_count', 'mention_count', 'emoji_count', 'lang_bucket')
+
+
+def _count_where(arr, mask, pattern):
+    # regex only runs on the rows that can match (cheap substring prefilter), counts are scattered back
+    mask = pc.fill_null(mask, False)
+    counts = pc.count_substring_regex(pc.filter(arr, mask), pattern).cast(pa.int32())
+    return pc.fill_null(pc.replace_with_mask(pa.nulls(len(arr), pa.int32()), mask, counts), 0)
+
+
+def _text_features_arrow(contents):
+    # returns arrow arrays; they only become python objects if the load path needs rows
+    arr = pc.fill_null(pa.array(contents, type=pa.string()), '')
+    trimmed = pc.utf8_trim_whitespace(arr)
+    # str.split() semantics: splitting '' gives [''], which counts as no words
+    words = pc.if_else(pc.equal(pc.utf8_length(trimmed), 0), 0, pc.list_value_length(pc.utf8_split_whitespace(trimmed))).cast(pa.int32())
+    non_ascii = pc.invert(pc.string_is_ascii(arr))
+    bucket = pa.scalar('other')
+    for name, pattern in reversed(LANG_SCRIPTS):
+        # everything but latin needs a non-ascii character, skip the regex for ascii rows
+        hit = pc.match_substring_regex(arr, pattern) if name == 'latin' else pc.and_(non_ascii, pc.match_substring_regex(arr, pattern))
+        bucket = pc.if_else(hit, name, bucket)
+    return {
+        'content_length': pc.utf8_length(arr).cast(pa.int32()),
+        'word_count': words,
+        'url_count': _count_where(arr, pc.or_(pc.match_substring(arr, '://'), pc.match_substring(arr, 'www.')), URL_PATTERN),
+        'mention_count': _count_where(pc.binary_join_element_wise(' ', arr, ''), pc.match_substring(arr, '@'), MENTION_PATTERN),
+        'emoji_count': _count_where(arr, non_ascii, EMOJI_PATTERN),
+        'lang_bucket': bucket if len(arr) else pa.array([], pa.string()),
+    }
+
+
+def _text_features_python(contents):
+    out = {k: [] for k in FEATURE_COLUMNS}
+    for content in contents:
+        content = content or ''
+        out['content_length'].append(len(content))
+        out['word_count'].append(len(content.split()))
+        out['url_count'].append(len(_COMPILED['url'].findall(content)) if ('://' in content or 'www.' in content) else 0)
+        out['mention_count'].append(len(_COMPILED['mention'].findall(' ' + content)) if '@' in content else 0)
+        out['emoji_count'].append(len(_COMPILED['emoji'].findall(content)) if not content.isascii() else 0)
+        out['lang_bucket'].append(next((name for name, _ in LANG_SCRIPTS if _COMPILED[name].search(content)), 'other'))
+    return out
+
+
+def _message_batch(rows):
+    # columnar batch: {column: list or arrow array}, one entry per analytics_messages column.
+    # id/chat_id/user_id/created_at stay python lists, the rollup delta reads them directly
+    ids, chat_ids, user_ids, contents, created_ats = (list(col) for col in zip(*rows)) if rows else ([], [], [], [], [])
+    features = _text_features_arrow(contents) if pa is not None else _text_features_python(contents)
+    return {'id': ids, 'chat_id': chat_ids, 'user_id': user_ids, 'content': contents, 'created_at': created_ats, **features}
+
+
+def _batch_rows(batch):
+    names = list(batch)
+    columns = [col.to_pylist() if hasattr(col, 'to_pylist') else col for col in batch.values()]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+if pa is not None:
+    # naive UTC, same as what the DateTime columns store
+    _ARROW_TYPES = {'id': pa.int64(), 'chat_id': pa.int64(), 'user_id': pa.int64(), 'content': pa.string(), 'created_at': pa.timestamp('us')}
+
+
+def _copy_upsert(conn, table, batch):
+    # postgres + pyarrow: the whole columnar batch goes through one COPY into a temp table and a
+    # single INSERT .. SELECT .. ON CONFLICT, no per-row python objects on the way
+    import pyarrow.csv as pacsv
+    names = list(batch)
+    data = pa.table({name: batch[name] if isinstance(batch[name], pa.Array) else pa.array(batch[name], type=_ARROW_TYPES.get(name)) for name in names})
+    buf = io.BytesIO()
+    pacsv.write_csv(data, buf, write_options=pacsv.WriteOptions(include_header=False))
+    buf.seek(0)
+    cols = ', '.join(names)
+    stage = f'_stage_{table.name}'
+    conn.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table.name} INCLUDING DEFAULTS)')
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv)', buf)
     finally:
-        src_db.close()
+        cursor.close()
+    updates = ', '.join(f'{n} = EXCLUDED.{n}' for n in names if n != 'id')
+    conn.exec_driver_sql(f'INSERT INTO {table.name} ({cols}) SELECT {cols} FROM {stage} ON CONFLICT (id) DO UPDATE SET {updates}')
+    conn.exec_driver_sql(f'TRUNCATE {stage}')
+    return data.num_rows
+
+
+def _load_message_batch(conn, table, batch, batch_size: int = 500):
+    if not batch['id']:
+        return 0
+    if pa is not None and conn.dialect.name == 'postgresql':
+        return _copy_upsert(conn, table, batch)
+    return _upsert_rows(conn, table, _batch_rows(batch), batch_size)
+
+
+_MESSAGE_COLUMNS = (models.Message.id, models.Message.chat_id, models.Message.user_id, models.Message.content, models.Message.created_at)
 
 
 def process_message_batch(message_ids: list, batch_size: int = 500):
     if not message_ids:
-        return {'messages': 0}
+        return {'messages_written': 0}
     target_engine = create_engine(ANALYTICS_DB)
     tables = ensure_target_schema(target_engine)
     src_engine = create_engine(SRC_DB)
-    SrcSession = sessionmaker(autocommit=False, autoflush=False, bind=src_engine)
-    src_db = SrcSession()
-    try:
-        # fetch messages by ids
-        msgs = src_db.query(models.Message).filter(models.Message.id.in_(message_ids)).all()
+    with src_engine.connect() as src:
+        rows = src.execute(select(*_MESSAGE_COLUMNS).where(models.Message.id.in_(message_ids))).fetchall()
+    with target_engine.begin() as conn:
+        written, days = _apply_message_changes(conn, tables, _message_batch(rows), batch_size=batch_size)
+    return {'messages_written': written, 'daily_rows_written': len(days)}
 
-        msg_rows = []
-        for m in msgs:
-            content_length = len(m.content) if m.content else 0
-            word_count = len(m.content.split()) if m.content else 0
-            msg_rows.append({'id': m.id, 'chat_id': m.chat_id, 'user_id': m.user_id, 'content': m.content, 'content_length': content_length, 'word_count': word_count, 'created_at': m.created_at})
 
-        total_written = 0
+def process_messages(run_id: str, batch_size: int = 500):
+    # walks the manifest id range with a keyset cursor instead of shipping id lists around
+    target_engine = create_engine(ANALYTICS_DB)
+    tables = ensure_target_schema(target_engine)
+    manifest = load_manifest(run_id, target_engine)
+    since_dt = _parse_since(manifest.get('since'))
+    src_engine = create_engine(SRC_DB)
+    batch_size = batch_size or 500
+    # daily_rows_written: distinct (date, chat_id) rows touched, a day spread over several batches counts once
+    total_written, total_days = 0, set()
+    deleted_ids = manifest.get('deleted', {}).get('messages') or []
+    if deleted_ids:
         with target_engine.begin() as conn:
-            target_is_postgres = target_engine.dialect.name == 'postgresql'
-            if target_is_postgres:
-                from sqlalchemy.dialects.postgresql import insert as pg_insert
-                for i in range(0, len(msg_rows), batch_size):
-                    batch = msg_rows[i:i+batch_size]
-                    stmt = pg_insert(tables['messages']).values(batch)
-                    update_dict = {c.name: getattr(stmt.excluded, c.name) for c in tables['messages'].columns if c.name != 'id'}
-                    conn.execute(stmt.on_conflict_do_update(index_elements=['id'], set_=update_dict))
-                    total_written += len(batch)
-            else:
-                for i in range(0, len(msg_rows), batch_size):
-                    batch = msg_rows[i:i+batch_size]
-                    ids = [r['id'] for r in batch]
-                    conn.execute(tables['messages'].delete().where(tables['messages'].c.id.in_(ids)))
-                    conn.execute(tables['messages'].insert(), batch)
-                    total_written += len(batch)
-
-        return {'messages': total_written}
-    finally:
-        src_db.close()
-
-
-def finalize_metadata(affected_chat_ids: list, affected_user_ids: list, new_max_id: int):
+            _, total_days = _apply_message_changes(conn, tables, _message_batch([]), deleted_ids, batch_size)
+    if manifest.get('min_id') is None:
+        return {'messages_written': 0, 'daily_rows_written': len(total_days)}
+    last_id = manifest['min_id'] - 1
+    with src_engine.connect() as src:
+        while True:
+            q = select(*_MESSAGE_COLUMNS).where(models.Message.id > last_id, models.Message.id <= manifest['max_id'])
+            if since_dt:
+                q = q.where(models.Message.created_at >= since_dt)
+            if manifest.get('incremental'):
+                q = q.where(_window(models.Message.updated_at, manifest['windows']['messages']))
+            rows = src.execute(q.order_by(models.Message.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            with target_engine.begin() as conn:
+                written, days = _apply_message_changes(conn, tables, _message_batch(rows), batch_size=batch_size)
+            total_written += written
+            total_days |= days
+    return {'messages_written': total_written, 'daily_rows_written': len(total_days)}
+
+
+def finalize_chats(run_id: str, batch_size: int = 500):
     target_engine = create_engine(ANALYTICS_DB)
     tables = ensure_target_schema(target_engine)
+    manifest = load_manifest(run_id, target_engine)
     src_engine = create_engine(SRC_DB)
-    SrcSession = sessionmaker(autocommit=False, autoflush=False, bind=src_engine)
-    src_db = SrcSession()
-    try:
-        chat_rows = []
-        for chat_id in affected_chat_ids:
-            member_count = src_db.query(func.count(models.ChatMember.id)).filter(models.ChatMember.chat_id == chat_id).scalar() or 0
-            message_count = src_db.query(func.count(models.Message.id)).filter(models.Message.chat_id == chat_id).scalar() or 0
-            first_message = src_db.query(func.min(models.Message.created_at)).filter(models.Message.chat_id == chat_id).scalar()
-            last_message = src_db.query(func.max(models.Message.created_at)).filter(models.Message.chat_id == chat_id).scalar()
-            since_30d = datetime.utcnow() - timedelta(days=30)
-            active_30d = src_db.query(func.count(distinct(models.Message.user_id))).filter(models.Message.chat_id == chat_id, models.Message.created_at >= since_30d).scalar() or 0
-            distinct_users = src_db.query(func.count(distinct(models.Message.user_id))).filter(models.Message.chat_id == chat_id).scalar() or 0
-            avg_msgs = (message_count / distinct_users) if distinct_users else 0.0
-            chat_obj = src_db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-            chat_rows.append({'id': chat_id, 'name': chat_obj.name if chat_obj else None, 'is_private': chat_obj.is_private if chat_obj else None, 'created_at': chat_obj.created_at if chat_obj else None, 'member_count': int(member_count), 'message_count': int(message_count), 'first_message_at': first_message, 'last_message_at': last_message, 'active_users_30d': int(active_30d), 'avg_messages_per_user': float(avg_msgs)})
-
-        user_rows = []
-        for user_id in affected_user_ids:
-            message_count = src_db.query(func.count(models.Message.id)).filter(models.Message.user_id == user_id).scalar() or 0
-            chat_count = src_db.query(func.count(distinct(models.Message.chat_id))).filter(models.Message.user_id == user_id).scalar() or 0
-            last_active = src_db.query(func.max(models.Message.created_at)).filter(models.Message.user_id == user_id).scalar()
-            user_obj = src_db.query(models.User).filter(models.User.id == user_id).first()
-            user_rows.append({'id': user_id, 'username': user_obj.username if user_obj else None, 'email': user_obj.email if user_obj else None, 'created_at': user_obj.created_at if user_obj else None, 'last_active_at': last_active, 'message_count': int(message_count), 'chat_count': int(chat_count)})
-
+    since_30d = datetime.utcnow() - timedelta(days=30)
+    M, CM, C = models.Message, models.ChatMember, models.Chat
+    total = 0
+    deleted_ids = manifest.get('deleted', {}).get('chats') or []
+    if deleted_ids:
         with target_engine.begin() as conn:
-            target_is_postgres = target_engine.dialect.name == 'postgresql'
-            if target_is_postgres:
-                from sqlalchemy.dialects.postgresql import insert as pg_insert
-                if chat_rows:
-                    stmt = pg_insert(tables['chats']).values(chat_rows)
-                    update_dict = {c.name: getattr(stmt.excluded, c.name) for c in tables['chats'].columns if c.name != 'id'}
-                    conn.execute(stmt.on_conflict_do_update(index_elements=['id'], set_=update_dict))
-                if user_rows:
-                    stmt = pg_insert(tables['users']).values(user_rows)
-                    update_dict = {c.name: getattr(stmt.excluded, c.name) for c in tables['users'].columns if c.name != 'id'}
-                    conn.execute(stmt.on_conflict_do_update(index_elements=['id'], set_=update_dict))
-                # set watermark
-                conn.execute(tables['etl_state'].delete().where(tables['etl_state'].c.key == 'messages_max_id'))
-                conn.execute(tables['etl_state'].insert(), [{'key': 'messages_max_id', 'value': str(new_max_id)}])
-            else:
-                if chat_rows:
-                    ids = [r['id'] for r in chat_rows]
-                    conn.execute(tables['chats'].delete().where(tables['chats'].c.id.in_(ids)))
-                    conn.execute(tables['chats'].insert(), chat_rows)
-                if user_rows:
-                    ids = [r['id'] for r in user_rows]
-                    conn.execute(tables['users'].delete().where(tables['users'].c.id.in_(ids)))
-                    conn.execute(tables['users'].insert(), user_rows)
-                conn.execute(tables['etl_state'].delete().where(tables['etl_state'].c.key == 'messages_max_id'))
-                conn.execute(tables['etl_state'].insert(), [{'key': 'messages_max_id', 'value': str(new_max_id)}])
-
-        return {
-            'chats': len(chat_rows),
-            'users': len(user_rows),
-        }
-    finally:
-        src_db.close()
-
-
-def finalize_daily_rollups(affected_chat_ids: list, min_dt_iso: str, max_dt_iso: str, batch_size: int = 500):
-    if not affected_chat_ids or not min_dt_iso or not max_dt_iso:
-        return {'daily_rows': 0}
-    min_date = datetime.fromisoformat(min_dt_iso).date()
-    max_date = datetime.fromisoformat(max_dt_iso).date()
+            conn.execute(tables['chats'].delete().where(tables['chats'].c.id.in_(deleted_ids)))
+    with src_engine.connect() as src:
+        for chunk in _chunks(manifest.get('chat_ids'), batch_size):
+            msg_q = select(M.chat_id, func.count(M.id), func.min(M.created_at), func.max(M.created_at), func.count(distinct(M.user_id)),
+                           func.count(distinct(case((M.created_at >= since_30d, M.user_id))))).group_by(M.chat_id)
+            member_q = select(CM.chat_id, func.count(CM.id)).group_by(CM.chat_id)
+            chat_q = select(C.id, C.name, C.is_private, C.created_at)
+            if chunk is not None:
+                msg_q = msg_q.where(M.chat_id.in_(chunk))
+                member_q = member_q.where(CM.chat_id.in_(chunk))
+                chat_q = chat_q.where(C.id.in_(chunk))
+            msg_stats = {r[0]: r[1:] for r in src.execute(msg_q)}
+            member_counts = dict(src.execute(member_q).fetchall())
+            chat_info = {r[0]: r[1:] for r in src.execute(chat_q)}
+
+            chat_rows = []
+            for chat_id in (chunk if chunk is not None else chat_info.keys()):
+                message_count, first_message, last_message, distinct_users, active_30d = msg_stats.get(chat_id, (0, None, None, 0, 0))
+                name, is_private, created_at = chat_info.get(chat_id, (None, None, None))
+                avg_msgs = (message_count / distinct_users) if distinct_users else 0.0
+                chat_rows.append({'id': chat_id, 'name': name, 'is_private': is_private, 'created_at': created_at, 'member_count': int(member_counts.get(chat_id, 0)), 'message_count': int(message_count or 0), 'first_message_at': first_message, 'last_message_at': last_message, 'active_users_30d': int(active_30d or 0), 'avg_messages_per_user': float(avg_msgs)})
+            with target_engine.begin() as conn:
+                total += _upsert_rows(conn, tables['chats'], chat_rows, batch_size)
+    return {'chats_written': total}
+
+
+def finalize_users(run_id: str, batch_size: int = 500):
     target_engine = create_engine(ANALYTICS_DB)
     tables = ensure_target_schema(target_engine)
+    manifest = load_manifest(run_id, target_engine)
     src_engine = create_engine(SRC_DB)
-    SrcSession = sessionmaker(autocommit=False, autoflush=False, bind=src_engine)
-    src_db = SrcSession()
-    try:
-        daily_q = src_db.query(func.date(models.Message.created_at).label('d'), models.Message.chat_id,
-                                func.count().label('messages'), func.count(distinct(models.Message.user_id)).label('active_users'))
-        daily_q = daily_q.filter(models.Message.chat_id.in_(affected_chat_ids), models.Message.created_at >= datetime.combine(min_date, datetime.min.time()), models.Message.created_at <= datetime.combine(max_date, datetime.max.time()))
-        daily_q = daily_q.group_by(func.date(models.Message.created_at), models.Message.chat_id)
-        daily_rows = []
-        for row in daily_q.all():
-            daily_rows.append({'date': row[0], 'chat_id': row[1], 'messages': int(row[2] or 0), 'active_users': int(row[3] or 0)})
-
-        total_daily = 0
+    M, U = models.Message, models.User
+    total = 0
+    deleted_ids = manifest.get('deleted', {}).get('users') or []
+    if deleted_ids:
         with target_engine.begin() as conn:
-            target_is_postgres = target_engine.dialect.name == 'postgresql'
-            if target_is_postgres and daily_rows:
-                from sqlalchemy.dialects.postgresql import insert as pg_insert
-                for i in range(0, len(daily_rows), batch_size):
-                    batch = daily_rows[i:i+batch_size]
-                    stmt = pg_insert(tables['chat_daily']).values(batch)
-                    update_dict = {c.name: getattr(stmt.excluded, c.name) for c in tables['chat_daily'].columns}
-                    conn.execute(stmt.on_conflict_do_update(index_elements=['date', 'chat_id'], set_=update_dict))
-                    total_daily += len(batch)
-            else:
-                if daily_rows:
-                    for r in daily_rows:
-                        conn.execute(tables['chat_daily'].delete().where(and_(tables['chat_daily'].c.date == r['date'], tables['chat_daily'].c.chat_id == r['chat_id'])))
-                    conn.execute(tables['chat_daily'].insert(), daily_rows)
-                    total_daily = len(daily_rows)
-
-        return {'daily_rows': total_daily}
-    finally:
-        src_db.close()
+            conn.execute(tables['users'].delete().where(tables['users'].c.id.in_(deleted_ids)))
+    with src_engine.connect() as src:
+        for chunk in _chunks(manifest.get('user_ids'), batch_size):
+            msg_q = select(M.user_id, func.count(M.id), func.count(distinct(M.chat_id)), func.max(M.created_at)).group_by(M.user_id)
+            user_q = select(U.id, U.username, U.email, U.created_at)
+            if chunk is not None:
+                msg_q = msg_q.where(M.user_id.in_(chunk))
+                user_q = user_q.where(U.id.in_(chunk))
+            msg_stats = {r[0]: r[1:] for r in src.execute(msg_q)}
+            user_info = {r[0]: r[1:] for r in src.execute(user_q)}
+
+            user_rows = []
+            for user_id in (chunk if chunk is not None else user_info.keys()):
+                message_count, chat_count, last_active = msg_stats.get(user_id, (0, 0, None))
+                username, email, created_at = user_info.get(user_id, (None, None, None))
+                user_rows.append({'id': user_id, 'username': username, 'email': email, 'created_at': created_at, 'last_active_at': last_active, 'message_count': int(message_count or 0), 'chat_count': int(chat_count or 0)})
+            with target_engine.begin() as conn:
+                total += _upsert_rows(conn, tables['users'], user_rows, batch_size)
+    return {'users_written': total}
+
+
+def complete_run(run_id: str):
+    # all per-entity watermarks move together, and only once every stage of the run has finished
+    target_engine = create_engine(ANALYTICS_DB)
+    tables = ensure_target_schema(target_engine)
+    manifest = load_manifest(run_id, target_engine)
+    state = tables['etl_state']
+    marks = [{'key': f'watermark:{entity}', 'value': window[1]} for entity, window in manifest['windows'].items()]
+    with target_engine.begin() as conn:
+        conn.execute(state.delete().where(state.c.key.in_([m['key'] for m in marks] + ['messages_max_id'])))
+        conn.execute(state.insert(), marks)
+        conn.execute(tables['runs'].update().where(tables['runs'].c.run_id == run_id).values(status='done', completed_at=datetime.utcnow()))
+    return {'run_id': run_id, 'watermarks': {m['key']: m['value'] for m in marks}}
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import pathlib
+import argparse
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from importlib import import_module
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, select, Integer, String, Text, Boolean, DateTime, Float
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+EXPORT_DIR = os.getenv('PARQUET_EXPORT_DIR', './parquet')
+STATE_KEY = 'parquet:watermark'
+# fact tables are split in one directory per day (hive style, date=YYYY-MM-DD); the metrics tables are small snapshots
+PARTITIONED = {'analytics_messages': 'created_at', 'chat_daily': 'date'}
+SNAPSHOTS = ('chat_metrics', 'user_metrics')
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.date32())]), flavor='hive')
+
+
+def _etl():
+    # imported lazily: etl refuses to load without SRC_DATABASE_URL and scan() needs no database at all
+    return import_module(f'{__package__}.etl' if __package__ else 'etl')
+
+
+def _arrow_type(sa_type):
+    for sa_cls, arrow_type in ((Boolean, pa.bool_()), (Integer, pa.int64()), (Float, pa.float64()), (DateTime, pa.timestamp('us')), (Text, pa.string()), (String, pa.string())):
+        if isinstance(sa_type, sa_cls):
+            return arrow_type
+    return pa.string()
+
+
+def _write(conn, table, query, path, batch_size, exclude=()):
+    # streams the query into one parquet file; written next to the target and renamed so readers never see half a file
+    columns = [c for c in table.columns if c.name not in exclude]
+    schema = pa.schema([(c.name, _arrow_type(c.type)) for c in columns])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    rows = 0
+    with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query.with_only_columns(*columns))
+        for part in result.partitions():
+            cols = list(zip(*part))
+            writer.write_table(pa.table([pa.array(col, type=f.type) for col, f in zip(cols, schema)], schema=schema))
+            rows += len(part)
+    os.replace(tmp, path)
+    return rows
+
+
+def _drop_partition(root, name, day):
+    partition = root / name / f'date={day.isoformat()}'
+    if partition.exists():
+        for f in partition.iterdir():
+            f.unlink()
+        partition.rmdir()
+
+
+def _dirty_days(conn, tables, since):
+    # days touched by every ETL run completed after the watermark, from the run manifests (None = everything)
+    runs = tables['runs']
+    q = select(runs.c.completed_at, runs.c.manifest).where(runs.c.status == 'done').order_by(runs.c.completed_at)
+    if since is not None:
+        q = q.where(runs.c.completed_at > since)
+    days, last = set(), since
+    for completed_at, manifest in conn.execute(q):
+        manifest = json.loads(manifest or '{}')
+        last = completed_at
+        lo, hi = manifest.get('min_dt'), manifest.get('max_dt')
+        if lo and hi:
+            # manifest bounds may be aware (postgres source); partitions are by UTC day like the rollups
+            lo, hi = (_etl()._rollup_key(None, None, v)[0].date() for v in (lo, hi))
+            days.update(lo + timedelta(days=i) for i in range((hi - lo).days + 1))
+    return days, last
+
+
+def export_parquet(out_dir: str = None, full: bool = False, batch_size: int = 50000, target_engine=None):
+    etl = _etl()
+    target_engine = target_engine or create_engine(etl.ANALYTICS_DB)
+    tables = etl.ensure_target_schema(target_engine)
+    by_name = {t.name: t for t in tables.values()}
+    root = pathlib.Path(out_dir or EXPORT_DIR)
+    state = tables['etl_state']
+    with target_engine.connect() as conn:
+        mark = None if full else conn.execute(select(state.c.value).where(state.c.key == STATE_KEY)).scalar()
+        days, last = _dirty_days(conn, tables, datetime.fromisoformat(mark) if mark else None)
+        if mark and last == datetime.fromisoformat(mark):
+            return {'days': 0, 'messages': 0, 'watermark': mark}
+        cd = tables['chat_daily']
+        present = {etl._to_dt(d).date() for (d,) in conn.execute(select(cd.c.date).distinct())}
+        if mark is None:
+            # first (or full) export: every day there is, and nothing left over from an older layout
+            days = present | {date.fromisoformat(p.name[5:]) for name in PARTITIONED for p in (root / name).glob('date=*')}
+        written = 0
+        for day in sorted(days):
+            start = datetime.combine(day, datetime.min.time())
+            end = start + timedelta(days=1)
+            for name, column in PARTITIONED.items():
+                if day not in present:
+                    _drop_partition(root, name, day)
+                    continue
+                table = by_name[name]
+                query = select(table).where(table.c[column] >= start, table.c[column] < end).order_by(*table.primary_key.columns)
+                n = _write(conn, table, query, root / name / f'date={day.isoformat()}' / 'part-0.parquet', batch_size, exclude=('date',))
+                written += n if name == 'analytics_messages' else 0
+        for name in SNAPSHOTS:
+            table = by_name[name]
+            _write(conn, table, select(table).order_by(table.c.id), root / name / 'part-0.parquet', batch_size)
+    if last is not None:
+        with target_engine.begin() as conn:
+            conn.execute(state.delete().where(state.c.key == STATE_KEY))
+            conn.execute(state.insert().values(key=STATE_KEY, value=last.isoformat()))
+    return {'days': len(days), 'messages': written, 'watermark': last.isoformat() if last else None}
+
+
+def _expression(filters):
+    # [(column, op, value), ...] ANDed together, same shape as pyarrow.parquet filters
+    ops = {'=': '__eq__', '==': '__eq__', '!=': '__ne__', '<': '__lt__', '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+    expr = None
+    for column, op, value in filters or ():
+        if column == 'date' and isinstance(value, str):
+            value = date.fromisoformat(value)
+        field = ds.field(column)
+        cond = field.isin(list(value)) if op == 'in' else getattr(field, ops[op])(value)
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def scan(table: str, columns: list = None, filters: list = None, root: str = None):
+    # filters on `date` prune whole partitions, the rest are pushed down to the parquet row group
+    # statistics, so only matching row groups and the requested columns are read
+    path = pathlib.Path(root or EXPORT_DIR) / table
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING if table in PARTITIONED else None)
+    return dataset.to_table(columns=columns, filter=_expression(filters))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the analytics tables to parquet')
+    parser.add_argument('--out', type=str, default=None, help=f'Output directory (default {EXPORT_DIR})')
+    parser.add_argument('--full', action='store_true', help='Rewrite every partition instead of the days changed since the last export')
+    parser.add_argument('--batch-size', type=int, default=50000, help='Rows per fetch / parquet write')
+    args = parser.parse_args()
+    print(export_parquet(out_dir=args.out, full=args.full, batch_size=args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
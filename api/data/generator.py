@@ -1,10 +1,13 @@
+import io
 import os
 import random
 import argparse
 import sys
 import pathlib
 import time
-from datetime import datetime, timedelta
+import multiprocessing
+from array import array
+from datetime import datetime, timedelta, timezone
 try:
     from zoneinfo import ZoneInfo
 except Exception:
@@ -12,10 +15,11 @@ except Exception:
 sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 from faker import Faker
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, func
 from app import models
 from app.database import SessionLocal, engine
 from app.security import hash_password
+from distributions import Weighted, Workload, message_pool
 
 fake = Faker()
 
@@ -26,6 +30,11 @@ TZ = ZoneInfo('America/Costa_Rica')
 START_DATE = datetime(2025, 1, 1, tzinfo=TZ)
 
 PROGRESS_STEP = DEFAULT_PROGRESS_STEP
+FAST_WORKERS = os.cpu_count() or 1
+FAST_CHUNK_SIZE = 100_000
+SEED = None
+WORKLOAD = Workload()
+SENTENCE_POOL = 50_000
 NUM_FORMAT = 'responsive'
 NUM_THRESHOLD = 100_000
 
@@ -91,34 +100,44 @@ def create_chats(db: Session, count: int):
     return db.query(models.Chat).count()
 
 
+def _activity(user_ids):
+    # per-user activity weight, drawn in user id order so a seed always gives the same power users
+    rng = random.Random(f"{SEED}:activity") if SEED is not None else random
+    return WORKLOAD.user_weights(rng, len(user_ids))
+
+
 def create_chat_members(db: Session, target_count: int):
-    chat_ids = [c[0] for c in db.query(models.Chat.id).all()]
-    user_ids = [u[0] for u in db.query(models.User.id).all()]
+    chat_ids = [c[0] for c in db.query(models.Chat.id).order_by(models.Chat.id).all()]
+    user_ids = [u[0] for u in db.query(models.User.id).order_by(models.User.id).all()]
     if not chat_ids or not user_ids:
         return 0
+    # members are drawn chat by chat (distinct within the chat), so no set of every generated pair is kept;
+    # only the pairs already in the db, which a new draw must skip (uq_chat_members_chat_user)
+    taken = {}
+    for chat_id, user_id in db.query(models.ChatMember.chat_id, models.ChatMember.user_id):
+        taken.setdefault(chat_id, set()).add(user_id)
+    users = Weighted(user_ids, _activity(user_ids))
+    sizes = WORKLOAD.chat_sizes(random, len(chat_ids), target_count, len(user_ids))
     created = 0
     objs = []
-    seen = set()
-    while created < target_count:
-        chat_id = random.choice(chat_ids)
-        user_id = random.choice(user_ids)
-        key = (chat_id, user_id)
-        if key in seen:
-            continue
-        seen.add(key)
-        role = 'member'
-        # small chance of owner
-        if random.random() < 0.01:
-            role = 'owner'
-        joined_at = random_datetime(START_DATE, datetime.now(TZ))
-        objs.append(models.ChatMember(chat_id=chat_id, user_id=user_id, role=role, joined_at=joined_at))
-        created += 1
-        if PROGRESS_STEP and created % PROGRESS_STEP == 0:
-            print(f"{fmt_num(created)} chat-members created")
-        if len(objs) >= BATCH_SIZE:
-            db.bulk_save_objects(objs)
-            db.commit()
-            objs = []
+    for chat_id, size in zip(chat_ids, sizes):
+        members = taken.get(chat_id, ())
+        # drawing as many more as are taken leaves at least `size` new ones, or every user left
+        drawn = users.distinct(random, size + len(members))
+        for user_id in [u for u in drawn if u not in members][:size]:
+            role = 'member'
+            # small chance of owner
+            if random.random() < 0.01:
+                role = 'owner'
+            joined_at = random_datetime(START_DATE, datetime.now(TZ))
+            objs.append(models.ChatMember(chat_id=chat_id, user_id=user_id, role=role, joined_at=joined_at))
+            created += 1
+            if PROGRESS_STEP and created % PROGRESS_STEP == 0:
+                print(f"{fmt_num(created)} chat-members created")
+            if len(objs) >= BATCH_SIZE:
+                db.bulk_save_objects(objs)
+                db.commit()
+                objs = []
     if objs:
         db.bulk_save_objects(objs)
         db.commit()
@@ -128,17 +147,18 @@ def create_chat_members(db: Session, target_count: int):
 
 
 def create_messages(db: Session, target_count: int):
-    chat_ids = [c[0] for c in db.query(models.Chat.id).all()]
-    member_rows = db.query(models.ChatMember.chat_id, models.ChatMember.user_id).all()
-    if not chat_ids or not member_rows:
+    member_rows = db.query(models.ChatMember.chat_id, models.ChatMember.user_id).order_by(models.ChatMember.id).all()
+    if not member_rows:
         return 0
-    pair_list = [(r[0], r[1]) for r in member_rows]
+    user_ids = [u[0] for u in db.query(models.User.id).order_by(models.User.id).all()]
+    weight = dict(zip(user_ids, _activity(user_ids)))
+    chats, members = message_pool(member_rows, lambda u: weight.get(u, 1.0))
+    clock = WORKLOAD.clock(START_DATE, datetime.now(TZ))
     created = 0
     objs = []
-    while created < target_count:
-        chat_id, user_id = random.choice(pair_list)
+    for chat_id, user_id, ts in WORKLOAD.threads(random, chats, members, clock, target_count):
         content = fake.paragraph(nb_sentences=2)
-        created_at = random_datetime(START_DATE, datetime.now(TZ))
+        created_at = datetime.fromtimestamp(ts, TZ)
         objs.append(models.Message(chat_id=chat_id, user_id=user_id, content=content, created_at=created_at))
         created += 1
         if PROGRESS_STEP and created % PROGRESS_STEP == 0:
@@ -155,6 +175,205 @@ def create_messages(db: Session, target_count: int):
     return db.query(models.Message).count()
 
 
+# fast mode: a pool of producers builds COPY text for fixed-size chunks and the parent streams each
+# chunk into postgres. every chunk has its own rng seeded from (seed, kind, chunk index), so the same
+# --seed and --chunk-size give the same rows whatever the number of workers
+
+_WORKER = {}
+
+
+def _init_worker(state):
+    _WORKER.update(state)
+    # sentence pool from the run seed: every worker builds the same one, messages pair two of them
+    rng = random.Random(f"{state['seed']}:sentences")
+    _WORKER['sentences'] = [_sentence(rng, state['words'], 4, 14) for _ in range(SENTENCE_POOL)]
+    _WORKER['days'] = {}
+
+
+def _chunk_rng(kind: str, index: int) -> random.Random:
+    return random.Random(f"{_WORKER['seed']}:{kind}:{index}")
+
+
+def _copy_text(value) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_ts(rng: random.Random) -> str:
+    return _format_ts(_WORKER['start_ts'] + rng.random() * _WORKER['span'])
+
+
+def _format_ts(ts: float) -> str:
+    # whole seconds in UTC; the date part is cached per day, formatting a datetime per row costs more than the rest
+    day, sec = divmod(int(ts), 86400)
+    prefix = _WORKER['days'].get(day)
+    if prefix is None:
+        prefix = _WORKER['days'][day] = datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d ')
+    h, rem = divmod(sec, 3600)
+    return f"{prefix}{h:02d}:{rem // 60:02d}:{rem % 60:02d}+00"
+
+
+def _sentence(rng: random.Random, words, low: int, high: int) -> str:
+    text = ' '.join(rng.choices(words, k=rng.randint(low, high)))
+    return text[:1].upper() + text[1:] + '.'
+
+
+def _produce_users(task):
+    index, first, count = task
+    rng = _chunk_rng('users', index)
+    names, pw, offset = _WORKER['names'], _WORKER['password_hash'], _WORKER['first_user']
+    lines = []
+    for n in range(offset + first, offset + first + count):
+        username = f"faker_{n}"
+        lines.append(f"{username}\t{_copy_text(rng.choice(names))}\t{username}@example.com\t{pw}\t{_copy_ts(rng)}\n")
+    return count, ''.join(lines).encode()
+
+
+def _produce_chats(task):
+    index, _, count = task
+    rng = _chunk_rng('chats', index)
+    words = _WORKER['words']
+    lines = [f"{_copy_text(_sentence(rng, words, 2, 4)[:128])}\t{'t' if rng.random() < 0.1 else 'f'}\t{_copy_ts(rng)}\n" for _ in range(count)]
+    return count, ''.join(lines).encode()
+
+
+def _produce_members(task):
+    # one task is a slice of chats; users are sampled per chat, so pairs are distinct without a seen set
+    index, first, count = task
+    rng = _chunk_rng('members', index)
+    if 'users' not in _WORKER:
+        _WORKER['users'] = Weighted(_WORKER['user_ids'], _WORKER['user_weights'])
+    chat_ids, users, per_chat = _WORKER['chat_ids'], _WORKER['users'], _WORKER['per_chat']
+    lines, rows = [], 0
+    for i in range(first, first + count):
+        k = min(per_chat[i], len(users))
+        for user_id in users.distinct(rng, k):
+            role = 'owner' if rng.random() < 0.01 else 'member'
+            lines.append(f"{chat_ids[i]}\t{user_id}\t{role}\t{_copy_ts(rng)}\n")
+        rows += k
+    return rows, ''.join(lines).encode()
+
+
+def _produce_messages(task):
+    index, _, count = task
+    rng = _chunk_rng('messages', index)
+    if 'pool' not in _WORKER:
+        weight = dict(zip(_WORKER['user_ids'], _WORKER['user_weights']))
+        _WORKER['pool'] = message_pool(zip(_WORKER['pair_chats'], _WORKER['pair_users']), lambda u: weight.get(u, 1.0))
+        _WORKER['clock'] = _WORKER['workload'].clock(START_DATE, _WORKER['until'])
+    (chats, members), sentences = _WORKER['pool'], _WORKER['sentences']
+    pool = len(sentences)
+    lines = []
+    for chat_id, user_id, ts in _WORKER['workload'].threads(rng, chats, members, _WORKER['clock'], count):
+        # pool sentences come from the faker word list, nothing in them needs COPY escaping
+        content = f"{sentences[int(rng.random() * pool)]} {sentences[int(rng.random() * pool)]}"
+        lines.append(f"{chat_id}\t{user_id}\t{content}\t{_format_ts(ts)}\n")
+    return count, ''.join(lines).encode()
+
+
+def _tasks(total: int, size: int):
+    # (chunk index, first item, item count)
+    return [(i, first, min(size, total - first)) for i, first in enumerate(range(0, total, size))]
+
+
+def copy_fast(kind: str, table: str, columns, producer, tasks, state: dict):
+    if not tasks:
+        return 0
+    if engine.dialect.name != 'postgresql':
+        raise SystemExit('--fast streams rows with COPY and needs a PostgreSQL DATABASE_URL')
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    raw = engine.raw_connection()
+    done, started = 0, time.time()
+    try:
+        with multiprocessing.Pool(FAST_WORKERS, initializer=_init_worker, initargs=(state,)) as pool:
+            # imap keeps chunk order, so ids come out the same on every run with the same seed
+            for rows, data in pool.imap(producer, tasks):
+                cursor = raw.cursor()
+                cursor.copy_expert(sql, io.BytesIO(data))
+                cursor.close()
+                raw.commit()
+                done += rows
+                elapsed = max(time.time() - started, 1e-9)
+                print(f"{fmt_num(done)} {kind} copied ({fmt_exact(int(done / elapsed))}/s)")
+    finally:
+        raw.close()
+    return done
+
+
+def _fast_state(seed, until: datetime) -> dict:
+    # small pools drawn once from the seeded Faker; workers only pick from them
+    return {
+        'seed': seed,
+        'until': until,
+        'workload': WORKLOAD,
+        'start_ts': START_DATE.timestamp(),
+        'span': max((until - START_DATE).total_seconds(), 0),
+        'words': fake.get_words_list(),
+        'names': [fake.name() for _ in range(2000)],
+    }
+
+
+def fast_users(db: Session, min_users: int, state: dict):
+    existing = db.query(models.User).count()
+    if existing >= min_users:
+        return existing
+    # usernames continue after the highest id so reruns never collide
+    first = (db.query(func.max(models.User.id)).scalar() or 0) + 1
+    # one hash for everyone, as in ensure_users
+    state = dict(state, password_hash=hash_password("change-me"), first_user=first)
+    copy_fast('users', 'users', ('username', 'display_name', 'email', 'password_hash', 'created_at'), _produce_users, _tasks(min_users - existing, FAST_CHUNK_SIZE), state)
+    return db.query(models.User).count()
+
+
+def fast_chats(db: Session, count: int, state: dict):
+    copy_fast('chats', 'chats', ('name', 'is_private', 'created_at'), _produce_chats, _tasks(count, FAST_CHUNK_SIZE), state)
+    return db.query(models.Chat).count()
+
+
+# --members and --messages are totals to reach in fast mode, like --min-users: rerunning a command adds nothing
+
+def fast_chat_members(db: Session, target_count: int, state: dict):
+    existing = db.query(models.ChatMember).count()
+    if existing >= target_count:
+        return existing
+    # only chats without members get new ones, so no generated pair can already exist (uq_chat_members_chat_user)
+    has_members = db.query(models.ChatMember.id).filter(models.ChatMember.chat_id == models.Chat.id).exists()
+    chat_ids = array('l', (c[0] for c in db.query(models.Chat.id).filter(~has_members).order_by(models.Chat.id)))
+    user_ids = array('l', (u[0] for u in db.query(models.User.id).order_by(models.User.id)))
+    if not chat_ids or not user_ids:
+        if existing and not chat_ids:
+            print("every chat already has members: --fast only fills chats without any, create more with --chats")
+        return existing
+    per_chat = array('l', WORKLOAD.chat_sizes(random.Random(f"{state['seed']}:sizes"), len(chat_ids), target_count - existing, len(user_ids)))
+    state = dict(state, chat_ids=chat_ids, user_ids=user_ids, user_weights=array('d', _activity(user_ids)), per_chat=per_chat)
+    # a chunk is a run of chats holding about FAST_CHUNK_SIZE members (skewed chats vary a lot in size)
+    tasks, first, rows = [], 0, 0
+    for i, size in enumerate(per_chat):
+        rows += size
+        if rows >= FAST_CHUNK_SIZE or i == len(per_chat) - 1:
+            tasks.append((len(tasks), first, i + 1 - first))
+            first, rows = i + 1, 0
+    copy_fast('chat-members', 'chat_members', ('chat_id', 'user_id', 'role', 'joined_at'), _produce_members, tasks, state)
+    return db.query(models.ChatMember).count()
+
+
+def fast_messages(db: Session, target_count: int, state: dict):
+    existing = db.query(models.Message).count()
+    if existing >= target_count:
+        return existing
+    pair_chats, pair_users = array('l'), array('l')
+    for chat_id, user_id in db.query(models.ChatMember.chat_id, models.ChatMember.user_id).order_by(models.ChatMember.id).yield_per(100_000):
+        pair_chats.append(chat_id)
+        pair_users.append(user_id)
+    if not pair_chats:
+        return existing
+    user_ids = array('l', (u[0] for u in db.query(models.User.id).order_by(models.User.id)))
+    state = dict(state, pair_chats=pair_chats, pair_users=pair_users, user_ids=user_ids, user_weights=array('d', _activity(user_ids)))
+    copy_fast('messages', 'messages', ('chat_id', 'user_id', 'content', 'created_at'), _produce_messages, _tasks(target_count - existing, FAST_CHUNK_SIZE), state)
+    return db.query(models.Message).count()
+
+
 def fmt_exact(n: int) -> str:
     return f"{n:,}"
 
@@ -192,7 +411,7 @@ def random_datetime(start: datetime, end: datetime) -> datetime:
 
 
 def main():
-    global BATCH_SIZE, PROGRESS_STEP
+    global BATCH_SIZE, PROGRESS_STEP, FAST_WORKERS, FAST_CHUNK_SIZE, SEED, WORKLOAD
     parser = argparse.ArgumentParser(description='Populate DB with fake chats/members/messages')
     parser.add_argument('--chats', type=int, default=0, help='number of chats to create')
     parser.add_argument('--members', type=int, default=0, help='number of chat members to create')
@@ -202,12 +421,32 @@ def main():
     parser.add_argument('--seed', type=int, default=None, help='random seed for reproducible data')
     parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='batch size for bulk inserts')
     parser.add_argument('--progress-step', type=int, default=DEFAULT_PROGRESS_STEP, help='print progress every N items')
+    parser.add_argument('--workload', choices=('uniform', 'skewed'), default='uniform',
+                        help='uniform: even spread (original behaviour); skewed: hot chats, power users, daily cycles and bursts')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='skewed: chat popularity exponent (higher = hotter top chats)')
+    parser.add_argument('--user-sigma', type=float, default=1.5, help='skewed: lognormal spread of per-user activity (higher = heavier power users)')
+    parser.add_argument('--burst-p', type=float, default=0.15, help='skewed: share of threads that are bursts of quick replies')
+    parser.add_argument('--fast', action='store_true', help='generate rows in parallel and load them with COPY (PostgreSQL only); --members and --messages become totals to reach')
+    parser.add_argument('--workers', type=int, default=FAST_WORKERS, help='producer processes for --fast')
+    parser.add_argument('--until', type=str, default=None, help='--fast: latest created_at as an ISO date (default: today), part of the seed like --chunk-size')
+    parser.add_argument('--chunk-size', type=int, default=FAST_CHUNK_SIZE, help='rows per COPY chunk for --fast (part of the seed: keep it to reproduce a dataset)')
     args = parser.parse_args()
     if args.seed is not None:
         random.seed(args.seed)
         fake.seed_instance(args.seed)
     BATCH_SIZE = args.batch_size
     PROGRESS_STEP = args.progress_step
+    FAST_WORKERS = max(1, args.workers)
+    FAST_CHUNK_SIZE = max(1, args.chunk_size)
+    if args.fast and args.seed is None:
+        args.seed = random.randrange(2**32)
+        fake.seed_instance(args.seed)
+    SEED = args.seed
+    WORKLOAD = Workload(args.workload, zipf_s=args.zipf_s, user_sigma=args.user_sigma, burst_p=args.burst_p)
+    if args.fast:
+        until = datetime.fromisoformat(args.until) if args.until else datetime.now(TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+        until = until if until.tzinfo else until.replace(tzinfo=TZ)
+        print(f'--fast: rerun with --seed {args.seed} --chunk-size {FAST_CHUNK_SIZE} --until {until.date().isoformat()} --workload {args.workload} for the same data')
 
     print('Starting faker...')
     db = SessionLocal()
@@ -219,15 +458,26 @@ def main():
         members_before = db.query(models.ChatMember).count()
         messages_before = db.query(models.Message).count()
 
-        if args.min_users and args.min_users > 0:
-            ensure_users(db, args.min_users)
+        if args.fast:
+            state = _fast_state(args.seed, until)
+            if args.min_users and args.min_users > 0:
+                fast_users(db, args.min_users, state)
+            if args.chats > 0:
+                fast_chats(db, args.chats, state)
+            if args.members > 0:
+                fast_chat_members(db, args.members, state)
+            if args.messages > 0:
+                fast_messages(db, args.messages, state)
+        else:
+            if args.min_users and args.min_users > 0:
+                ensure_users(db, args.min_users)
 
-        if args.chats > 0:
-            create_chats(db, args.chats)
-        if args.members > 0:
-            create_chat_members(db, args.members)
-        if args.messages > 0:
-            create_messages(db, args.messages)
+            if args.chats > 0:
+                create_chats(db, args.chats)
+            if args.members > 0:
+                create_chat_members(db, args.members)
+            if args.messages > 0:
+                create_messages(db, args.messages)
 
         # after counts
         users_after = db.query(models.User).count()
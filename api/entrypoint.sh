@@ -0,0 +1,18 @@
+#!/bin/sh
+set -e
+# schema first: replicas starting together wait on the migration lock (migrations/env.py)
+alembic upgrade head
+# monthly messages partitions ahead of time (and retention, with MESSAGES_RETENTION_MONTHS); the api then
+# repeats it every MESSAGES_PARTITIONS_EVERY seconds
+python -m app.partitions
+# WEB_CONCURRENCY workers; with more than one their metrics go through files so /metrics counts all of them
+WORKERS="${WEB_CONCURRENCY:-1}"
+if [ "$WORKERS" -gt 1 ]; then
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}"
+fi
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  # files left by the previous run would be added to this one's counters
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers "$WORKERS" --log-level warning --no-access-log
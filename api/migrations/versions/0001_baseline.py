@@ -0,0 +1,76 @@
+"""baseline: users, chats, chat_members, messages
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # databases created by the old create_all at startup already have these tables; only fresh ones get them here
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('username', sa.String(64), nullable=False),
+            sa.Column('display_name', sa.String(128)),
+            sa.Column('email', sa.String(256), nullable=False),
+            sa.Column('password_hash', sa.String(), nullable=False),
+            sa.Column('is_active', sa.Boolean()),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_users_id', 'users', ['id'])
+        op.create_index('ix_users_username', 'users', ['username'], unique=True)
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    if 'chats' not in existing:
+        op.create_table(
+            'chats',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(128), nullable=False),
+            sa.Column('is_private', sa.Boolean()),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_chats_id', 'chats', ['id'])
+        op.create_index('ix_chats_name', 'chats', ['name'])
+    if 'chat_members' not in existing:
+        op.create_table(
+            'chat_members',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('chat_id', sa.Integer(), sa.ForeignKey('chats.id'), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('role', sa.String(20), nullable=False),
+            sa.Column('joined_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_chat_members_id', 'chat_members', ['id'])
+        op.create_index('ix_chat_members_chat_id', 'chat_members', ['chat_id'])
+        op.create_index('ix_chat_members_user_id', 'chat_members', ['user_id'])
+    if 'messages' not in existing:
+        op.create_table(
+            'messages',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('chat_id', sa.Integer(), sa.ForeignKey('chats.id'), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_messages_id', 'messages', ['id'])
+        op.create_index('ix_messages_chat_id', 'messages', ['chat_id'])
+        op.create_index('ix_messages_user_id', 'messages', ['user_id'])
+        op.create_index('ix_messages_created_at', 'messages', ['created_at'])
+
+
+def downgrade() -> None:
+    for table in ('messages', 'chat_members', 'chats', 'users'):
+        op.drop_table(table)
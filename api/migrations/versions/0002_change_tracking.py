@@ -0,0 +1,65 @@
+"""change tracking: updated_at on the source tables and the change_log of deletes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('users', 'chats', 'chat_members', 'messages')
+
+
+def _index(name, table, columns, **kw):
+    # CONCURRENTLY on postgres: no write lock on the table, but it cannot run inside a transaction.
+    # a build that failed halfway leaves an invalid index behind, which is dropped and rebuilt
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.create_index(name, table, columns, if_not_exists=True, **kw)
+        return
+    with op.get_context().autocommit_block():
+        invalid = bind.execute(sa.text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+        op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kw)
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        if 'updated_at' not in {c['name'] for c in inspector.get_columns(table)}:
+            # now() is not volatile, so postgres stores the default once instead of rewriting the table
+            op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()))
+    for table in TABLES:
+        _index(f'ix_{table}_updated_at', table, ['updated_at'])
+    if 'change_log' not in inspector.get_table_names():
+        op.create_table(
+            'change_log',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('entity', sa.String(32), nullable=False),
+            sa.Column('entity_id', sa.Integer(), nullable=False),
+            sa.Column('chat_id', sa.Integer()),
+            sa.Column('user_id', sa.Integer()),
+            sa.Column('op', sa.String(8), nullable=False),
+            sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_change_log_id', 'change_log', ['id'])
+        op.create_index('ix_change_log_changed_at', 'change_log', ['changed_at'])
+
+
+def downgrade() -> None:
+    op.drop_table('change_log')
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,79 @@
+"""search: full-text index on messages.content, trigram index on chats.name
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# same expression as app.search.TSVECTOR
+TS_CONFIG = os.getenv('SEARCH_TS_CONFIG', 'simple')
+TSVECTOR = f"to_tsvector('{TS_CONFIG}'::regconfig, coalesce(content, ''))"
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+)
+
+
+def _concurrently(name, create):
+    # see 0002: outside the transaction, and an invalid leftover from a failed build is rebuilt
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        invalid = bind.execute(sa.text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        op.execute(create)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for stmt in SQLITE_FTS:
+            op.execute(stmt)
+        return
+    if bind.dialect.name != 'postgresql':
+        return
+    # an earlier version kept a generated search_vector column; the expression index replaces it
+    # without rewriting the table
+    _concurrently('ix_messages_content_tsv', f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_content_tsv ON messages USING gin (({TSVECTOR}))")
+    op.execute("ALTER TABLE messages DROP COLUMN IF EXISTS search_vector")
+    # without pg_trgm (not installed, or no CREATE privilege) chat search uses the in-process index
+    # (app.search.ChatNameIndex)
+    try:
+        with bind.begin_nested():
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except sa.exc.DBAPIError:
+        return
+    _concurrently('ix_chats_name_trgm', "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chats_name_trgm ON chats USING gin (name gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for name in ('messages_fts_ai', 'messages_fts_ad', 'messages_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_chats_name_trgm")
+        op.execute("DROP INDEX IF EXISTS ix_messages_content_tsv")
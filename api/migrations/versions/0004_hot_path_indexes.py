@@ -0,0 +1,97 @@
+"""hot path indexes: chat timelines, user date ranges, unique membership
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# one row per (chat, user): the owner row if there is one, else the oldest. the others are logged
+# as deletes so the ETL drops them from analytics too
+DUPLICATES = (
+    "SELECT id, chat_id, user_id FROM ("
+    "SELECT id, chat_id, user_id, row_number() OVER (PARTITION BY chat_id, user_id "
+    "ORDER BY CASE WHEN role = 'owner' THEN 0 ELSE 1 END, id) AS n FROM chat_members"
+    ") ranked WHERE n > 1"
+)
+# single-column indexes that are now a prefix of a composite one; they only cost writes
+REDUNDANT = (('ix_messages_chat_id', 'messages'), ('ix_messages_user_id', 'messages'), ('ix_chat_members_chat_id', 'chat_members'))
+
+
+def _dedup_members():
+    op.execute(f"INSERT INTO change_log (entity, entity_id, chat_id, user_id, op) SELECT 'chat_members', id, chat_id, user_id, 'delete' FROM ({DUPLICATES}) d")
+    op.execute(f"DELETE FROM chat_members WHERE id IN (SELECT id FROM ({DUPLICATES}) d)")
+
+
+def _drop_invalid(bind, name):
+    invalid = bind.execute(sa.text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _upgrade_postgres(bind):
+    # every build is CONCURRENTLY: reads and writes keep going, each step waits for the transactions
+    # already running instead of blocking new ones
+    with op.get_context().autocommit_block():
+        for name, create in (
+            ('ix_messages_chat_created', "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_chat_created ON messages (chat_id, created_at DESC, id DESC)"),
+            ('ix_messages_user_created', "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_created ON messages (user_id, created_at) INCLUDE (chat_id)"),
+        ):
+            _drop_invalid(bind, name)
+            op.execute(create)
+        present = bind.execute(sa.text("SELECT 1 FROM pg_constraint WHERE conname = 'uq_chat_members_chat_user'")).first()
+        # a duplicate written between the cleanup and the end of the build fails it; clean up again and retry
+        for attempt in range(3):
+            if present:
+                break
+            _dedup_members()
+            _drop_invalid(bind, 'uq_chat_members_chat_user')
+            try:
+                op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_chat_members_chat_user ON chat_members (chat_id, user_id)")
+            except sa.exc.IntegrityError:
+                if attempt == 2:
+                    raise
+                continue
+            # promoting a built index to a constraint is a catalog change, no scan
+            op.execute("ALTER TABLE chat_members ADD CONSTRAINT uq_chat_members_chat_user UNIQUE USING INDEX uq_chat_members_chat_user")
+            break
+        for name, _ in REDUNDANT:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        _upgrade_postgres(bind)
+        return
+    op.create_index('ix_messages_chat_created', 'messages', ['chat_id', sa.text('created_at DESC'), sa.text('id DESC')], if_not_exists=True)
+    op.create_index('ix_messages_user_created', 'messages', ['user_id', 'created_at', 'chat_id'], if_not_exists=True)
+    _dedup_members()
+    op.create_index('uq_chat_members_chat_user', 'chat_members', ['chat_id', 'user_id'], unique=True, if_not_exists=True)
+    for name, table in REDUNDANT:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    op.create_index('ix_messages_chat_id', 'messages', ['chat_id'], if_not_exists=True)
+    op.create_index('ix_messages_user_id', 'messages', ['user_id'], if_not_exists=True)
+    op.create_index('ix_chat_members_chat_id', 'chat_members', ['chat_id'], if_not_exists=True)
+    if bind.dialect.name == 'postgresql':
+        op.execute("ALTER TABLE chat_members DROP CONSTRAINT IF EXISTS uq_chat_members_chat_user")
+    else:
+        op.drop_index('uq_chat_members_chat_user', table_name='chat_members', if_exists=True)
+    op.drop_index('ix_messages_user_created', table_name='messages', if_exists=True)
+    op.drop_index('ix_messages_chat_created', table_name='messages', if_exists=True)
@@ -0,0 +1,105 @@
+"""partition messages by month of created_at (postgres)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the existing table becomes the first partition as is (no copy): checks validated while writes go on
+# let ATTACH skip its scan, and indexes matching the parent's are adopted instead of rebuilt.
+# the only exclusive lock is the short rename/attach transaction, bounded by lock_timeout
+LEGACY = 'messages_legacy'
+PREMAKE_MONTHS = 3
+# (name, definition) for the parent; the legacy partition has the same ones under its own names
+INDEXES = (
+    ('ix_messages_id', '(id)'),
+    ('ix_messages_created_at', '(created_at)'),
+    ('ix_messages_updated_at', '(updated_at)'),
+    ('ix_messages_chat_created', '(chat_id, created_at DESC, id DESC)'),
+    ('ix_messages_user_created', '(user_id, created_at) INCLUDE (chat_id)'),
+)
+
+
+def _month(day: date, n: int = 0) -> date:
+    years, index = divmod(day.month - 1 + n, 12)
+    return date(day.year + years, index + 1, 1)
+
+
+def _upgrade_postgres(bind):
+    kind = bind.execute(sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')")).scalar()
+    if kind == 'p':
+        return
+    tsv_index = bind.execute(sa.text("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_messages_content_tsv'")).scalar()
+    # legacy holds everything before the month after next week; the week is slack so no row is written
+    # past the bound while the checks below validate
+    now = datetime.now(timezone.utc)
+    cutoff = _month((now + timedelta(days=7)).date(), 1)
+    bound = f"'{cutoff.isoformat()} 00:00:00+00'"
+    with op.get_context().autocommit_block():
+        # a rerun after a failure finds these already there
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_id_created_key ON messages (id, created_at)")
+        for name, check in (('messages_created_at_present', 'created_at IS NOT NULL'), ('messages_legacy_range', f'created_at < {bound}')):
+            op.execute(f"ALTER TABLE messages DROP CONSTRAINT IF EXISTS {name}")
+            op.execute(f"ALTER TABLE messages ADD CONSTRAINT {name} CHECK ({check}) NOT VALID")
+            op.execute(f"ALTER TABLE messages VALIDATE CONSTRAINT {name}")
+
+    op.execute("SET LOCAL lock_timeout = '10s'")
+    # the validated check makes SET NOT NULL a catalog change
+    op.execute("ALTER TABLE messages ALTER COLUMN created_at SET NOT NULL")
+    op.execute(f"ALTER TABLE messages RENAME TO {LEGACY}")
+    for name, _ in INDEXES:
+        op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {LEGACY}{name[len('ix_messages'):]}")
+    if tsv_index:
+        op.execute(f"ALTER INDEX ix_messages_content_tsv RENAME TO {LEGACY}_content_tsv")
+    # the partitioned table's key has to include created_at; the prebuilt (id, created_at) index becomes
+    # the legacy key so ATTACH adopts it instead of building one under the lock
+    op.execute(f"ALTER TABLE {LEGACY} DROP CONSTRAINT messages_pkey")
+    op.execute(f"ALTER TABLE {LEGACY} ADD CONSTRAINT {LEGACY}_pkey PRIMARY KEY USING INDEX messages_id_created_key")
+    op.execute(
+        "CREATE TABLE messages ("
+        "id integer NOT NULL DEFAULT nextval('messages_id_seq'::regclass), "
+        "chat_id integer NOT NULL REFERENCES chats (id), "
+        "user_id integer NOT NULL REFERENCES users (id), "
+        "content text NOT NULL, "
+        "created_at timestamptz NOT NULL DEFAULT now(), "
+        "updated_at timestamptz DEFAULT now(), "
+        "CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    # the sequence must not go away with the legacy table
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    for name, definition in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON messages {definition}")
+    if tsv_index:
+        op.execute("CREATE INDEX ix_messages_content_tsv ON messages USING " + tsv_index.split(" USING ", 1)[1])
+    op.execute(f"ALTER TABLE messages ATTACH PARTITION {LEGACY} FOR VALUES FROM (MINVALUE) TO ({bound})")
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+    for n in range(PREMAKE_MONTHS + 1):
+        lo, hi = _month(cutoff, n), _month(cutoff, n + 1)
+        op.execute(f"CREATE TABLE messages_{lo:%Y_%m} PARTITION OF messages FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')")
+    op.execute(f"ALTER TABLE {LEGACY} DROP CONSTRAINT messages_legacy_range")
+    op.execute(f"ALTER TABLE {LEGACY} DROP CONSTRAINT messages_created_at_present")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        _upgrade_postgres(bind)
+
+
+def downgrade() -> None:
+    # folding the partitions back into one table means copying every row; restore from a backup instead
+    if op.get_bind().dialect.name == 'postgresql':
+        raise NotImplementedError('messages partitioning cannot be reverted in place')
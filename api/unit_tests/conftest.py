@@ -1 +1,15 @@
-from app.models import User, Chat, ChatMember, Message  
\ No newline at end of file
+import pytest
+from app.models import User, Chat, ChatMember, Message
+from app import cache, ratelimit
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    # every test starts from an empty database, cached pages from the previous one would leak into it
+    cache.store.clear()
+    yield
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    # buckets are per key and keys (user ids, chat ids, the test client's address) repeat from test to test
+    ratelimit.reset_all()
+    yield
@@ -0,0 +1,129 @@
+import json
+import time
+import logging
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app import main
+from app.main import app, get_db
+from app.database import Base
+from app.profiling import slow_requests
+from app.sampler import profiler, Sampler
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db(monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    monkeypatch.setattr(main, "ADMIN_USERNAMES", {"root"})
+    yield
+    profiler.stop()
+    slow_requests.set_threshold(0)
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+def login(client, username):
+    client.post("/auth/register", json={"username": username, "display_name": username, "email": f"{username}@example.com", "password": "testpass123"})
+    token = client.post("/auth/token", data={"username": username, "password": "testpass123"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def test_admin_endpoints_need_an_admin(client):
+    assert client.get("/admin/profiler").status_code == 401
+    assert client.get("/admin/profiler", headers=login(client, "ana")).status_code == 403
+    assert client.post("/admin/slow-requests", params={"threshold_ms": 10}, headers=login(client, "ana")).status_code == 403
+    assert client.get("/admin/profiler", headers=login(client, "root")).json()["running"] is False
+
+def test_profiler_session(client):
+    headers = login(client, "root")
+    started = client.post("/admin/profiler/start", params={"interval_ms": 1, "seconds": 5}, headers=headers)
+    assert started.status_code == 200 and started.json()["running"] is True
+    assert client.post("/admin/profiler/start", headers=headers).status_code == 409
+    time.sleep(0.05)
+    stopped = client.post("/admin/profiler/stop", headers=headers).json()
+    assert stopped["running"] is False and stopped["samples"] > 0
+    folded = client.get("/admin/profiler/folded", headers=headers)
+    assert folded.headers["content-type"].startswith("text/plain")
+    # "thread;root;...;leaf count"
+    stack, count = folded.text.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+
+def test_sampler_sees_busy_threads_not_idle_ones():
+    done = threading.Event()
+    def busy_loop():
+        while not done.is_set():
+            sum(range(1000))
+    worker = threading.Thread(target=busy_loop, name="busy")
+    worker.start()
+    sampler = Sampler()
+    try:
+        for _ in range(5):
+            sampler.sample()
+    finally:
+        done.set()
+        worker.join()
+    folded = sampler.folded()
+    assert "busy;" in folded and "busy_loop (test_admin.py" in folded
+    # threads parked in a wait are left out
+    leaves = [line.rsplit(" ", 1)[0].rsplit(";", 1)[-1] for line in folded.splitlines()]
+    assert not [leaf for leaf in leaves if leaf.startswith(("Condition.wait", "Event.wait"))]
+
+def test_slow_request_is_logged_with_sql(client, caplog):
+    headers = login(client, "root")
+    assert client.post("/admin/slow-requests", params={"threshold_ms": 1}, headers=headers).json() == {"threshold_ms": 1}
+    with caplog.at_level(logging.WARNING, logger="tears-api"):
+        client.get("/auth/me", headers=headers)
+    events = [json.loads(r.getMessage()) for r in caplog.records if '"slow_request"' in r.getMessage()]
+    assert events
+    event = events[-1]
+    assert event["handler"] == "/auth/me" and event["status_code"] == 200
+    assert event["queries"] >= 1 and event["statements"][0]["count"] >= 1
+    assert event["duration_ms"] >= 1
+
+def test_slow_request_capture_off(client, caplog):
+    headers = login(client, "root")
+    client.post("/admin/slow-requests", params={"threshold_ms": 0}, headers=headers)
+    with caplog.at_level(logging.WARNING, logger="tears-api"):
+        client.get("/auth/me", headers=headers)
+    assert not [r for r in caplog.records if '"slow_request"' in r.getMessage()]
+
+def test_slow_sync_handler_without_sql_is_sampled(client, caplog):
+    # CPU-bound and no statements (like the password check in /auth/token): its threadpool thread is still sampled
+    def crunch():
+        deadline = time.monotonic() + 0.2
+        while time.monotonic() < deadline:
+            sum(range(1000))
+        return {"ok": True}
+    app.add_api_route("/test/crunch", crunch, methods=["GET"])
+    route = app.router.routes[-1]
+    headers = login(client, "root")
+    client.post("/admin/slow-requests", params={"threshold_ms": 20}, headers=headers)
+    try:
+        with caplog.at_level(logging.WARNING, logger="tears-api"):
+            assert client.get("/test/crunch").status_code == 200
+    finally:
+        app.router.routes.remove(route)
+    event = [json.loads(r.getMessage()) for r in caplog.records if '"slow_request"' in r.getMessage()][-1]
+    assert event["handler"] == "/test/crunch" and event["queries"] == 0
+    assert event["samples"] >= 1
+    assert any("crunch (test_admin.py" in s["stack"] for s in event["stacks"])
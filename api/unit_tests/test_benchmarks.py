@@ -0,0 +1,10 @@
+from benchmarks.run import run, compare
+
+def test_suite_runs_and_compares():
+    results = run(sizes=[200], repeat=2, only={"list_chats", "list_messages_chat", "endpoint_chat_messages"})
+    assert set(results) == {"list_chats@200", "list_messages_chat@200", "endpoint_chat_messages@200"}
+    assert all(r["median_ms"] > 0 for r in results.values())
+    slower = {key: dict(r, median_ms=r["median_ms"] * 2) for key, r in results.items()}
+    rows = compare(slower, results)
+    assert len(rows) == 3
+    assert all(abs(ratio - 2) < 1e-6 for _, _, _, ratio in rows)
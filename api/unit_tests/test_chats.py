@@ -179,4 +179,22 @@ def test_search_chats(client, auth_token):
     assert response.status_code == 200
     data = response.json()
     assert len(data["items"]) >= 1
-    assert "Unique" in data["items"][0]["name"]
\ No newline at end of file
+    assert "Unique" in data["items"][0]["name"]
+def test_add_member_unknown_user(client, auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    chat_id = client.post("/chats", headers=headers, json={"name": "Team", "is_private": True}).json()["id"]
+    db = TestingSessionLocal()
+    db.add(User(id=50, username="bob", email="bob@example.com", password_hash="x"))
+    db.commit()
+    db.close()
+    # sqlite only checks foreign keys when asked to, postgres always does
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+    try:
+        assert client.post(f"/chats/{chat_id}/members", headers=headers, json={"user_id": 999}).status_code == 404
+        first = client.post(f"/chats/{chat_id}/members", headers=headers, json={"user_id": 50}).json()
+        # adding again returns the same membership
+        assert client.post(f"/chats/{chat_id}/members", headers=headers, json={"username": "bob"}).json() == first
+    finally:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
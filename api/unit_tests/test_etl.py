@@ -0,0 +1,205 @@
+import os
+import json
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select, inspect
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import User, Chat, ChatMember, Message
+
+# the etl reads its source url at import and refuses to load without one; tests point it at their own files
+os.environ.setdefault("SRC_DATABASE_URL", "sqlite://")
+from data import etl
+
+DAY1, DAY2 = datetime(2025, 3, 1, 10), datetime(2025, 3, 2, 9)
+
+def hours_ago(n):
+    return datetime.utcnow() - timedelta(hours=n)
+
+@pytest.fixture(scope="function")
+def dbs(tmp_path, monkeypatch):
+    # every stage opens its own engine from the urls, so both sides are files
+    src_url, target_url = f"sqlite:///{tmp_path / 'src.db'}", f"sqlite:///{tmp_path / 'analytics.db'}"
+    monkeypatch.setattr(etl, "SRC_DB", src_url)
+    monkeypatch.setattr(etl, "ANALYTICS_DB", target_url)
+    monkeypatch.setattr(etl, "LOOKBACK_SECONDS", 0)
+    src = create_engine(src_url)
+    Base.metadata.create_all(bind=src)
+    SrcSession = sessionmaker(bind=src)
+    db = SrcSession()
+    # last touched 3h ago, so a watermark between then and now leaves them out
+    old = hours_ago(3)
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x", updated_at=old) for i in (1, 2, 3)])
+    db.add_all([Chat(id=1, name="Lobby", updated_at=old), Chat(id=2, name="Team", updated_at=old)])
+    db.add_all([ChatMember(chat_id=c, user_id=u, updated_at=old) for c, u in ((1, 1), (1, 2), (2, 3))])
+    db.add_all([
+        Message(id=1, chat_id=1, user_id=1, content="hi @u2", created_at=DAY1, updated_at=old),
+        Message(id=2, chat_id=1, user_id=2, content="hello", created_at=DAY1, updated_at=old),
+        Message(id=3, chat_id=1, user_id=1, content="next day", created_at=DAY2, updated_at=old),
+        Message(id=4, chat_id=2, user_id=3, content="team", created_at=DAY2, updated_at=old),
+        Message(id=5, chat_id=2, user_id=3, content="team again", created_at=DAY2 + timedelta(hours=1), updated_at=old),
+    ])
+    db.commit()
+    db.close()
+    target = create_engine(target_url)
+    yield SrcSession, target, etl.ensure_target_schema(target)
+    src.dispose()
+    target.dispose()
+
+def rows(target, table, *columns):
+    with target.connect() as conn:
+        return sorted(tuple(r) for r in conn.execute(select(*(table.c[c] for c in columns))))
+
+def watermarks(target, tables):
+    state = tables["etl_state"]
+    return dict(rows(target, state, "key", "value"))
+
+SAMPLES = [
+    "hi @bob and @alice@x",
+    "@start of a line",
+    "mail me at ana@example.com, cc @ana_b",
+    "@@double (@paren) @a@b",
+    "see https://example.com/x and www.example.org",
+    "привет @иван @ivan",
+    "こんにちは 🎉🎉",
+    "sin acentos pero con ñ",
+    "   spaced    out   words  ",
+    "",
+    None,
+]
+
+
+@pytest.mark.skipif(etl.pa is None, reason="pyarrow not installed")
+def test_text_features_same_with_and_without_arrow():
+    arrow = {k: v.to_pylist() for k, v in etl._text_features_arrow(SAMPLES).items()}
+    assert arrow == etl._text_features_python(SAMPLES)
+    assert arrow["mention_count"][:4] == [2, 1, 1, 3]
+
+
+def test_extract_writes_a_manifest(dbs):
+    _, target, tables = dbs
+    prep = etl.prepare_etl()
+    assert (prep["total_messages"], prep["new_max_id"]) == (5, 5)
+    (status, manifest), = rows(target, tables["runs"], "status", "manifest")
+    manifest = json.loads(manifest)
+    assert status == "extracted"
+    assert (manifest["min_id"], manifest["max_id"], manifest["chat_ids"], manifest["user_ids"]) == (1, 5, None, None)
+    assert set(manifest["windows"]) == set(etl.TRACKED)
+    # watermarks only move once every stage is done
+    assert watermarks(target, tables) == {}
+
+def test_complete_run_moves_every_watermark(dbs):
+    _, target, tables = dbs
+    prep = etl.prepare_etl()
+    manifest = etl.load_manifest(prep["run_id"], target)
+    done = etl.complete_run(prep["run_id"])
+    expected = {f"watermark:{entity}": window[1] for entity, window in manifest["windows"].items()}
+    assert done["watermarks"] == expected
+    assert watermarks(target, tables) == expected
+    assert rows(target, tables["runs"], "status") == [("done",)]
+    # nothing changed since: the next incremental extract has no run
+    assert etl.prepare_etl(incremental=True)["run_id"] is None
+
+def rewind(target, tables, hours):
+    # as if the last run had finished `hours` ago
+    state = tables["etl_state"]
+    with target.begin() as conn:
+        conn.execute(state.update().where(state.c.key.like("watermark:%")).values(value=hours_ago(hours).isoformat()))
+
+def last_manifest(target, tables):
+    runs = tables["runs"]
+    with target.connect() as conn:
+        return json.loads(conn.execute(select(runs.c.manifest).order_by(runs.c.created_at.desc()).limit(1)).scalar())
+
+def test_incremental_window_only_reads_changed_rows(dbs):
+    SrcSession, target, tables = dbs
+    etl.run_etl()
+    rewind(target, tables, 2)
+    db = SrcSession()
+    db.get(Message, 2).content = "edited @u1"
+    db.add(Message(id=6, chat_id=2, user_id=1, content="new", created_at=DAY2))
+    db.commit()
+    db.close()
+    summary = etl.run_etl(incremental=True)
+    manifest = last_manifest(target, tables)
+    assert (manifest["total_messages"], manifest["chat_ids"], manifest["user_ids"]) == (2, [1, 2], [1, 2])
+    assert summary["messages"] == 2
+    am = tables["messages"]
+    assert rows(target, am, "id", "content", "mention_count")[1] == (2, "edited @u1", 1)
+    assert rows(target, tables["chats"], "id", "message_count") == [(1, 3), (2, 3)]
+    assert rows(target, tables["users"], "id", "message_count", "chat_count") == [(1, 3, 2), (2, 1, 1), (3, 2, 1)]
+
+def test_deletes_reach_the_analytics_copy(dbs):
+    SrcSession, target, tables = dbs
+    etl.run_etl()
+    rewind(target, tables, 2)
+    db = SrcSession()
+    # ORM deletes leave change_log rows
+    db.delete(db.get(Message, 1))
+    for mid in (4, 5):
+        db.delete(db.get(Message, mid))
+    db.delete(db.query(ChatMember).filter_by(chat_id=2).one())
+    db.delete(db.get(Chat, 2))
+    db.commit()
+    db.close()
+    etl.run_etl(incremental=True)
+    deleted = last_manifest(target, tables)["deleted"]
+    assert (sorted(deleted["messages"]), deleted["chats"], deleted["users"]) == ([1, 4, 5], [2], [])
+    assert rows(target, tables["messages"], "id") == [(2,), (3,)]
+    assert rows(target, tables["chats"], "id", "message_count") == [(1, 2)]
+    assert rows(target, tables["users"], "id", "message_count") == [(1, 1), (2, 1), (3, 0)]
+    assert rows(target, tables["chat_daily"], "date", "chat_id", "messages") == [(DAY1.replace(hour=0), 1, 1), (DAY2.replace(hour=0), 1, 1)]
+
+def test_daily_rows_counted_once(dbs):
+    # one message per batch: 5 batches touch 3 (date, chat) rows
+    assert etl.run_etl(batch_size=1)["daily_rows"] == 3
+
+def rollups(target, tables):
+    return rows(target, tables["chat_daily"], "date", "chat_id", "messages", "active_users"), \
+        rows(target, tables["chat_daily_users"], "date", "chat_id", "user_id", "messages")
+
+def test_incremental_rollups_match_a_rebuild(dbs):
+    SrcSession, target, tables = dbs
+    etl.run_etl()
+    rewind(target, tables, 2)
+    db = SrcSession()
+    # moved to another chat and day, a day's only message in a chat deleted, new users in old days
+    moved = db.get(Message, 3)
+    moved.chat_id, moved.created_at = 2, DAY1
+    db.delete(db.get(Message, 2))
+    db.add_all([Message(id=6, chat_id=1, user_id=3, content="late", created_at=DAY2), Message(id=7, chat_id=2, user_id=2, content="x", created_at=DAY2)])
+    db.commit()
+    db.close()
+    etl.run_etl(incremental=True, batch_size=2)
+    incremental = rollups(target, tables)
+    etl.rebuild_daily_rollups(target_engine=target)
+    assert incremental == rollups(target, tables)
+    daily, users = incremental
+    d1, d2 = DAY1.replace(hour=0), DAY2.replace(hour=0)
+    assert daily == [(d1, 1, 1, 1), (d1, 2, 1, 1), (d2, 1, 1, 1), (d2, 2, 3, 2)]
+    assert (d2, 2, 3, 2) in users
+
+def test_rollup_delta_adds_and_removes(dbs):
+    _, target, tables = dbs
+    d1 = DAY1.replace(hour=0)
+    with target.begin() as conn:
+        etl._apply_rollup_delta(conn, tables, {(d1, 1, 1): 2, (d1, 1, 2): 1})
+    assert rollups(target, tables) == ([(d1, 1, 3, 2)], [(d1, 1, 1, 2), (d1, 1, 2, 1)])
+    with target.begin() as conn:
+        etl._apply_rollup_delta(conn, tables, {(d1, 1, 1): -2})
+    assert rollups(target, tables) == ([(d1, 1, 1, 1)], [(d1, 1, 2, 1)])
+    with target.begin() as conn:
+        assert etl._apply_rollup_delta(conn, tables, {(d1, 1, 2): -1}) == {(d1, 1)}
+    # an emptied day leaves no rows behind
+    assert rollups(target, tables) == ([], [])
+
+def test_schema_upgrade_indexes_created_at(tmp_path):
+    # an analytics db from before the index: the next ensure_target_schema adds it
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE analytics_messages (id INTEGER PRIMARY KEY, chat_id INTEGER, user_id INTEGER, content TEXT, created_at DATETIME)")
+    etl.ensure_target_schema(engine)
+    assert [i["column_names"] for i in inspect(engine).get_indexes("analytics_messages")] == [["created_at"]]
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN SELECT * FROM analytics_messages WHERE created_at >= '2025-03-01' AND created_at < '2025-03-02'").fetchall()
+    assert "ix_analytics_messages_created_at" in str(plan)
@@ -0,0 +1,90 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app, get_db
+from app.database import Base
+from app.export import export_limiter
+from app.models import User, Chat, ChatMember, Message
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    export_limiter.reset()
+    yield
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+@pytest.fixture
+def auth_headers(client):
+    client.post("/auth/register", json={"username": "ana", "display_name": "Ana", "email": "ana@example.com", "password": "testpass123"})
+    token = client.post("/auth/token", data={"username": "ana", "password": "testpass123"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def history(auth_headers):
+    db = TestingSessionLocal()
+    db.add(User(id=2, username="bob", email="bob@example.com", password_hash="x"))
+    db.add_all([Chat(id=1, name="Lobby"), Chat(id=2, name="Secret", is_private=True)])
+    db.add(ChatMember(chat_id=2, user_id=2, role="owner"))
+    start = datetime(2026, 1, 1)
+    # ids out of time order, the export follows created_at
+    db.add_all([Message(id=10 - i, chat_id=1, user_id=1 + i % 2, content=f"m{i}", created_at=start + timedelta(minutes=i)) for i in range(5)])
+    db.commit()
+    db.close()
+    return auth_headers
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_export_chat_ndjson_and_resume(client, history):
+    response = client.get("/messages/export", params={"chat_id": 1}, headers=history)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = lines(response)
+    assert [r["content"] for r in rows] == ["m0", "m1", "m2", "m3", "m4"]
+    assert rows[1]["username"] == "bob"
+    resumed = client.get("/messages/export", params={"chat_id": 1, "after_id": rows[2]["id"]}, headers=history)
+    assert [r["content"] for r in lines(resumed)] == ["m3", "m4"]
+
+def test_export_own_messages_csv(client, history):
+    response = client.get("/messages/export", params={"user_id": 1, "format": "csv"}, headers=history)
+    assert response.status_code == 200
+    header, *rows = response.text.strip().splitlines()
+    assert header == "id,chat_id,user_id,username,display_name,content,created_at"
+    assert [r.split(",")[5] for r in rows] == ["m0", "m2", "m4"]
+
+def test_export_access(client, history):
+    assert client.get("/messages/export", params={"chat_id": 1}).status_code == 401
+    assert client.get("/messages/export", params={"user_id": 2}, headers=history).status_code == 403
+    assert client.get("/messages/export", params={"chat_id": 2}, headers=history).status_code == 403
+    assert client.get("/messages/export", headers=history).status_code == 400
+
+def test_export_rate_limited(client, history):
+    statuses = [client.get("/messages/export", params={"chat_id": 1}, headers=history).status_code for _ in range(4)]
+    assert statuses[-1] == 429
+    response = client.get("/messages/export", params={"chat_id": 1}, headers=history)
+    assert int(response.headers["retry-after"]) >= 1
@@ -0,0 +1,89 @@
+import os
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models import User, Chat, ChatMember, Message
+
+pytest.importorskip("pyarrow")
+os.environ.setdefault("SRC_DATABASE_URL", "sqlite://")
+from data import etl
+from data.export_parquet import export_parquet, scan
+
+DAY1, DAY2 = datetime(2025, 3, 1, 10), datetime(2025, 3, 2, 9)
+
+@pytest.fixture(scope="function")
+def exported(tmp_path, monkeypatch):
+    # source and analytics as files (every ETL stage opens its own engine), one full ETL run and export
+    src_url, target_url = f"sqlite:///{tmp_path / 'src.db'}", f"sqlite:///{tmp_path / 'analytics.db'}"
+    monkeypatch.setattr(etl, "SRC_DB", src_url)
+    monkeypatch.setattr(etl, "ANALYTICS_DB", target_url)
+    monkeypatch.setattr(etl, "LOOKBACK_SECONDS", 0)
+    src = create_engine(src_url)
+    Base.metadata.create_all(bind=src)
+    SrcSession = sessionmaker(bind=src)
+    db = SrcSession()
+    old = datetime.utcnow() - timedelta(hours=3)
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x", updated_at=old) for i in (1, 2)])
+    db.add_all([Chat(id=1, name="Lobby", updated_at=old), ChatMember(chat_id=1, user_id=1, updated_at=old)])
+    db.add_all([Message(id=i, chat_id=1, user_id=1 + i % 2, content=f"m{i}", created_at=day, updated_at=old) for i, day in ((1, DAY1), (2, DAY1), (3, DAY2), (4, DAY2))])
+    db.commit()
+    db.close()
+    target = create_engine(target_url)
+    etl.run_etl()
+    out = tmp_path / "parquet"
+    first = export_parquet(out_dir=str(out), target_engine=target)
+    yield SrcSession, target, out, first
+    src.dispose()
+    target.dispose()
+
+def next_run(target, SrcSession, change):
+    # a later incremental run: the previous one finished two hours ago
+    state = etl.ensure_target_schema(target)["etl_state"]
+    with target.begin() as conn:
+        conn.execute(state.update().where(state.c.key.like("watermark:%")).values(value=(datetime.utcnow() - timedelta(hours=2)).isoformat()))
+    db = SrcSession()
+    change(db)
+    db.commit()
+    db.close()
+    etl.run_etl(incremental=True)
+
+def partition(out, name, day):
+    return out / name / f"date={day.date().isoformat()}" / "part-0.parquet"
+
+def test_full_export_and_scan(exported):
+    _, _, out, first = exported
+    assert (first["days"], first["messages"]) == (2, 4)
+    assert sorted(p.parent.name for p in out.glob("analytics_messages/*/part-0.parquet")) == ["date=2025-03-01", "date=2025-03-02"]
+    day2 = scan("analytics_messages", columns=["id", "content"], filters=[("date", "=", "2025-03-02")], root=str(out))
+    assert day2.column("id").to_pylist() == [3, 4]
+    assert scan("analytics_messages", columns=["id"], filters=[("user_id", "=", 2)], root=str(out)).column("id").to_pylist() == [1, 3]
+    assert scan("chat_daily", columns=["chat_id", "messages"], root=str(out)).to_pylist() == [{"chat_id": 1, "messages": 2}] * 2
+    assert scan("chat_metrics", columns=["id", "message_count"], root=str(out)).to_pylist() == [{"id": 1, "message_count": 4}]
+
+def test_only_dirty_days_are_rewritten(exported):
+    SrcSession, target, out, _ = exported
+    untouched = partition(out, "analytics_messages", DAY1).stat().st_ino
+    # nothing ran since: nothing to write
+    assert export_parquet(out_dir=str(out), target_engine=target)["days"] == 0
+
+    def edit(db):
+        db.get(Message, 4).content = "edited"
+    next_run(target, SrcSession, edit)
+    result = export_parquet(out_dir=str(out), target_engine=target)
+    assert (result["days"], result["messages"]) == (1, 2)
+    assert partition(out, "analytics_messages", DAY1).stat().st_ino == untouched
+    assert scan("analytics_messages", columns=["content"], filters=[("id", "=", 4)], root=str(out)).column("content").to_pylist() == ["edited"]
+
+def test_emptied_day_is_dropped(exported):
+    SrcSession, target, out, _ = exported
+
+    def delete_day1(db):
+        for mid in (1, 2):
+            db.delete(db.get(Message, mid))
+    next_run(target, SrcSession, delete_day1)
+    export_parquet(out_dir=str(out), target_engine=target)
+    assert not partition(out, "analytics_messages", DAY1).parent.exists()
+    assert not partition(out, "chat_daily", DAY1).parent.exists()
+    assert scan("analytics_messages", columns=["id"], root=str(out)).column("id").to_pylist() == [3, 4]
@@ -0,0 +1,155 @@
+import sys
+import pathlib
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app.models import User, Chat, ChatMember, Message
+
+# the generator is a script next to its helpers (`from distributions import ...`)
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "data"))
+import generator
+from distributions import Workload
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+UNTIL = datetime(2025, 3, 1, tzinfo=generator.TZ)
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def copies(monkeypatch):
+    # what fast mode would COPY: the producer output for every task, in order (no postgres here)
+    copied = []
+
+    def copy_fast(kind, table, columns, producer, tasks, state):
+        rows = produce(producer, tasks, state)
+        copied.append((kind, rows))
+        return len(rows)
+    monkeypatch.setattr(generator, "copy_fast", copy_fast)
+    return copied
+
+def produce(producer, tasks, state):
+    generator._WORKER.clear()
+    generator._init_worker(state)
+    return [line.split("\t") for task in tasks for line in producer(task)[1].decode().splitlines()]
+
+def fast_state(seed=7):
+    generator.fake.seed_instance(seed)
+    return generator._fast_state(seed, UNTIL)
+
+def test_fast_members_skip_existing_pairs(db, copies):
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x") for i in range(1, 11)])
+    db.add_all([Chat(id=i, name=f"c{i}") for i in range(1, 5)])
+    db.add_all([ChatMember(chat_id=1, user_id=u) for u in (1, 2, 3)])
+    db.commit()
+    generator.fast_chat_members(db, 11, fast_state())
+    (kind, rows), = copies
+    pairs = [(int(c), int(u)) for c, u, _, _ in rows]
+    # the 8 missing members, all in chats that had none, no pair twice
+    assert len(pairs) == len(set(pairs)) == 8
+    assert {c for c, _ in pairs} == {2, 3, 4}
+    # already there: nothing to copy
+    copies.clear()
+    db.add_all([ChatMember(chat_id=c, user_id=u) for c, u in pairs])
+    db.commit()
+    generator.fast_chat_members(db, 11, fast_state())
+    assert copies == []
+
+def test_members_rerun_skips_existing_pairs(db, monkeypatch):
+    monkeypatch.setattr(generator, "PROGRESS_STEP", 0)
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x") for i in range(1, 7)])
+    db.add_all([Chat(id=i, name=f"c{i}") for i in range(1, 4)])
+    db.commit()
+    generator.random.seed(7)
+    assert generator.create_chat_members(db, 9) == 9
+    # the same draw again: colliding pairs are skipped instead of hitting uq_chat_members_chat_user
+    generator.random.seed(7)
+    assert generator.create_chat_members(db, 9) == 18
+    pairs = [(m.chat_id, m.user_id) for m in db.query(ChatMember)]
+    assert len(pairs) == len(set(pairs))
+    # every chat full: nothing left to add
+    generator.create_chat_members(db, 100)
+    assert db.query(ChatMember).count() == 18
+
+def test_fast_messages_top_up_to_the_target(db, copies, monkeypatch):
+    monkeypatch.setattr(generator, "SENTENCE_POOL", 500)
+    db.add_all([User(id=1, username="u1", email="u1@example.com", password_hash="x"), Chat(id=1, name="c1"), ChatMember(chat_id=1, user_id=1)])
+    db.add_all([Message(chat_id=1, user_id=1, content="x") for _ in range(5)])
+    db.commit()
+    generator.fast_messages(db, 12, fast_state())
+    assert [(kind, len(rows)) for kind, rows in copies] == [("messages", 7)]
+    copies.clear()
+    generator.fast_messages(db, 5, fast_state())
+    assert copies == []
+
+def chunks(producer, tasks, state):
+    # a fresh worker per call, like another pool; chunk by chunk as COPY would receive them
+    generator._WORKER.clear()
+    generator._init_worker(state)
+    return [producer(task) for task in tasks]
+
+def member_state(state, chats=30, users=50, total=400):
+    user_ids = list(range(1, users + 1))
+    return dict(state, chat_ids=list(range(1, chats + 1)), user_ids=user_ids, user_weights=generator._activity(user_ids),
+                per_chat=generator.WORKLOAD.chat_sizes(generator.random.Random(f"{state['seed']}:sizes"), chats, total, users))
+
+def message_state(state):
+    pairs = [(c, u) for c in range(1, 11) for u in range(1, 11) if (c + u) % 3]
+    user_ids = list(range(1, 11))
+    return dict(state, pair_chats=[c for c, _ in pairs], pair_users=[u for _, u in pairs], user_ids=user_ids, user_weights=generator._activity(user_ids))
+
+# (kind, producer, its worker state, tasks, rows they make); members tasks are runs of chats
+PRODUCERS = (
+    ("users", generator._produce_users, lambda s: dict(s, password_hash="x", first_user=1), generator._tasks(250, 100), 250),
+    ("chats", generator._produce_chats, lambda s: s, generator._tasks(250, 100), 250),
+    ("members", generator._produce_members, member_state, [(0, 0, 10), (1, 10, 10), (2, 20, 10)], 400),
+    ("messages", generator._produce_messages, message_state, generator._tasks(1000, 300), 1000),
+)
+
+@pytest.mark.parametrize("kind, producer, with_state, tasks, total", PRODUCERS, ids=[p[0] for p in PRODUCERS])
+def test_fast_producers_are_deterministic(kind, producer, with_state, tasks, total, monkeypatch):
+    monkeypatch.setattr(generator, "SEED", 7)
+    monkeypatch.setattr(generator, "SENTENCE_POOL", 500)
+    first = chunks(producer, tasks, with_state(fast_state(7)))
+    # same seed, chunks produced in another order (another worker count): the same bytes per chunk
+    assert chunks(producer, tasks[::-1], with_state(fast_state(7)))[::-1] == first
+    assert sum(rows for rows, _ in first) == sum(len(data.splitlines()) for _, data in first) == total
+    monkeypatch.setattr(generator, "SEED", 8)
+    assert chunks(producer, tasks, with_state(fast_state(8))) != first
+
+def test_skewed_workload_is_deterministic_and_skewed(monkeypatch):
+    skewed = Workload("skewed")
+    rng = lambda: generator.random.Random(7)
+    sizes = skewed.chat_sizes(rng(), 200, 10000, 500)
+    assert sizes == skewed.chat_sizes(rng(), 200, 10000, 500)
+    assert sum(sizes) == 10000 and max(sizes) <= 500
+    # a few hot chats where uniform spreads evenly
+    assert max(sizes) > 5 * max(Workload().chat_sizes(rng(), 200, 10000, 500))
+    assert skewed.user_weights(rng(), 100) == skewed.user_weights(rng(), 100)
+
+    # the fast producers draw from the skewed shapes and stay reproducible chunk by chunk
+    monkeypatch.setattr(generator, "WORKLOAD", skewed)
+    monkeypatch.setattr(generator, "SEED", 7)
+    monkeypatch.setattr(generator, "SENTENCE_POOL", 500)
+    state = message_state(fast_state(7))
+    tasks = generator._tasks(2000, 500)
+    first = chunks(generator._produce_messages, tasks, state)
+    assert chunks(generator._produce_messages, tasks[::-1], message_state(fast_state(7)))[::-1] == first
+    stamps = [line.split("\t")[3] for _, data in first for line in data.decode().splitlines()]
+    assert len(stamps) == 2000
+    assert generator.START_DATE <= min(datetime.fromisoformat(s) for s in stamps) and max(datetime.fromisoformat(s) for s in stamps) < UNTIL
@@ -0,0 +1,62 @@
+import json
+import queue
+import logging
+import subprocess
+import sys
+from app import logs
+from app.logs import Event, JsonLineFormatter, DroppingQueueHandler, log_event, parse_sample_rates, timestamp
+from app.metrics import log_records_dropped_total
+
+def record(msg, created=1767225600.5):
+    r = logging.LogRecord("tears-api", logging.INFO, __file__, 1, msg, None, None)
+    r.created = created
+    return r
+
+def test_event_line_uses_the_record_time():
+    line = JsonLineFormatter().format(record(Event(event="websocket_message", chat_id="3", sent_at=None)))
+    assert json.loads(line) == {"timestamp": "2026-01-01 00:00:00", "event": "websocket_message", "chat_id": "3", "sent_at": None}
+    # plain string messages go out as they are
+    assert JsonLineFormatter().format(record('{"event": "replica_down"}')) == '{"event": "replica_down"}'
+
+def test_timestamp_is_cached_per_second():
+    assert timestamp(1767225600.1) == timestamp(1767225600.9) == "2026-01-01 00:00:00"
+    assert timestamp(1767225601.0) == "2026-01-01 00:00:01"
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("websocket_message=0.1, http_request=2,,bad") == {"websocket_message": 0.1, "http_request": 1.0}
+    assert parse_sample_rates("") == {}
+
+def test_sampling(monkeypatch, caplog):
+    logger = logging.getLogger("tears-websocket")
+    monkeypatch.setattr(logs, "SAMPLE_RATES", {"websocket_message": 0.0, "websocket_connected": 0.5})
+    monkeypatch.setattr(logs.random, "random", lambda: 0.25)
+    with caplog.at_level(logging.INFO, logger="tears-websocket"):
+        log_event(logger, logging.INFO, "websocket_message", chat_id="1")
+        log_event(logger, logging.INFO, "websocket_connected", chat_id="1")
+        log_event(logger, logging.INFO, "websocket_disconnected", chat_id="1")
+    events = [json.loads(r.getMessage()) for r in caplog.records]
+    assert [e["event"] for e in events] == ["websocket_connected", "websocket_disconnected"]
+    assert events[0]["sample_rate"] == 0.5 and "sample_rate" not in events[1]
+
+def test_full_queue_drops_and_counts():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    before = log_records_dropped_total._value.get()
+    for i in range(3):
+        handler.handle(record(Event(event="websocket_message", n=i)))
+    assert handler.dropped == 2
+    assert log_records_dropped_total._value.get() - before == 2
+    # the queued record is untouched, the writer encodes it
+    assert handler.queue.get_nowait().msg == {"event": "websocket_message", "n": 0}
+
+def test_pipeline_writes_from_the_writer_thread():
+    # a fresh interpreter: pytest has already configured the root logger here
+    script = (
+        "import logging, threading\n"
+        "from app.logs import setup_logging, log_event\n"
+        "setup_logging()\n"
+        "log_event(logging.getLogger('tears-api'), logging.INFO, 'http_request', path='/chats', status_code=200)\n"
+        "logging.getLogger('tears-api').info('plain')\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stderr.splitlines()
+    assert json.loads(out[0])["path"] == "/chats" and json.loads(out[0])["event"] == "http_request"
+    assert out[1] == "plain"
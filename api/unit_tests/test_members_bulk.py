@@ -0,0 +1,92 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app, get_db
+from app.database import Base
+from app.models import User, Chat, ChatMember, ChangeLog
+from app.profiling import track_queries
+from app.security import create_access_token
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+@pytest.fixture
+def team(client):
+    # user 1 owns private chat 1; users 2..201 are the team, user 2 already in the chat
+    db = TestingSessionLocal()
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x") for i in range(1, 202)])
+    db.add(Chat(id=1, name="Team", is_private=True))
+    db.add_all([ChatMember(chat_id=1, user_id=1, role="owner"), ChatMember(chat_id=1, user_id=2, role="member")])
+    db.commit()
+    db.close()
+    return {"Authorization": f"Bearer {create_access_token(subject=1)}"}
+
+def member_ids():
+    db = TestingSessionLocal()
+    ids = sorted(m.user_id for m in db.query(ChatMember).filter_by(chat_id=1))
+    db.close()
+    return ids
+
+def test_add_members_by_id_and_username(client, team):
+    payload = {"user_ids": list(range(2, 102)) + [999], "usernames": [f"u{i}" for i in range(100, 202)] + ["nobody"]}
+    with track_queries() as t:
+        response = client.post("/chats/1/members/bulk", json=payload, headers=team)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["added"] == list(range(3, 202))
+    assert body["already_members"] == [2]
+    assert body["not_found"] == [999, "nobody"]
+    assert member_ids() == list(range(1, 202))
+    # token user, owner check and one resolve for 200 users (sqlite runs the insert per row, postgres per 1000)
+    assert len([s for s in t.last.shapes if not s.lstrip().upper().startswith("INSERT")]) == 3
+    # idempotent
+    again = client.post("/chats/1/members/bulk", json=payload, headers=team).json()
+    assert again["added"] == [] and len(again["already_members"]) == 200
+
+def test_only_owner_manages_members(client, team):
+    other = {"Authorization": f"Bearer {create_access_token(subject=2)}"}
+    assert client.post("/chats/1/members/bulk", json={"user_ids": [3]}, headers=other).status_code == 403
+    assert client.post("/chats/1/members/bulk/remove", json={"user_ids": [1]}, headers=other).status_code == 403
+    assert member_ids() == [1, 2]
+
+def test_remove_members_leaves_change_log(client, team):
+    client.post("/chats/1/members/bulk", json={"user_ids": list(range(3, 11))}, headers=team)
+    response = client.post("/chats/1/members/bulk/remove", json={"user_ids": [1, 3, 4, 150, 999], "usernames": ["u5"]}, headers=team)
+    assert response.status_code == 200
+    assert response.json() == {"removed": [3, 4, 5], "owners": [1], "not_members": [150], "not_found": [999]}
+    assert member_ids() == [1, 2, 6, 7, 8, 9, 10]
+    db = TestingSessionLocal()
+    logged = sorted((c.entity, c.chat_id, c.user_id, c.op) for c in db.query(ChangeLog))
+    db.close()
+    assert logged == [("chat_members", 1, i, "delete") for i in (3, 4, 5)]
+
+def test_member_count_refreshes_after_batch(client, team):
+    assert client.get("/chats/1", headers=team).json()["member_count"] == 2
+    client.post("/chats/1/members/bulk", json={"user_ids": list(range(3, 53))}, headers=team)
+    assert client.get("/chats/1", headers=team).json()["member_count"] == 52
@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+from app.main import app
+
+# multiprocess mode is fixed when prometheus_client is imported, so every "worker" is a fresh interpreter
+WORKER = (
+    "import sys\n"
+    "from app import metrics\n"
+    "for _ in range(int(sys.argv[1])):\n"
+    "    metrics.http_requests_total.labels(method='GET', handler='/chats', status='200').inc()\n"
+    "    metrics.record_websocket_message(int(sys.argv[2]))\n"
+    "metrics.increment_websocket_connections()\n"
+    "metrics.dump_hot_chats()\n"
+)
+SCRAPE = "from app import metrics\nprint(metrics.get_metrics().body.decode())\n"
+
+def run(code, env, *args):
+    return subprocess.run([sys.executable, "-c", code, *map(str, args)], env=env, capture_output=True, text=True, check=True).stdout
+
+def samples(text, name):
+    return {tuple(sorted(s.labels.items())): s.value for family in text_string_to_metric_families(text) for s in family.samples if s.name == name}
+
+def multiproc_env(tmp_path, **extra):
+    return {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), **extra}
+
+def test_metrics_add_up_across_workers(tmp_path):
+    env = multiproc_env(tmp_path)
+    run(WORKER, env, 3, 7)
+    run(WORKER, env, 4, 7)
+    text = run(SCRAPE, env)
+    assert samples(text, "http_requests_total") == {(("handler", "/chats"), ("method", "GET"), ("status", "200")): 7.0}
+    assert samples(text, "websocket_hot_chat_messages_total") == {(("chat_id", "7"),): 7.0}
+    # both workers have exited: their live gauges no longer count
+    assert samples(text, "websocket_connections_active") == {(): 0.0}
+
+def test_optional_worker_label(tmp_path):
+    env = multiproc_env(tmp_path, METRICS_WORKER_LABEL="1")
+    run(WORKER, env, 3, 7)
+    run(WORKER, env, 4, 7)
+    counts = samples(run(SCRAPE, env), "http_requests_total")
+    assert sorted(counts.values()) == [3.0, 4.0]
+    assert all(dict(labels)["worker"].isdigit() for labels in counts)
+
+def test_single_process_metrics_route():
+    # one /metrics route, served by the app (no second exporter shadowing it)
+    assert [r.path for r in app.routes].count("/metrics") == 1
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert "websocket_connections_active" in response.text
@@ -0,0 +1,38 @@
+import pathlib
+import sqlite3
+import pytest
+from alembic import command
+from alembic.config import Config
+
+API_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+@pytest.fixture
+def alembic_db(tmp_path, monkeypatch):
+    path = tmp_path / "tears.db"
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{path}")
+    config = Config(str(API_DIR / "alembic.ini"))
+    return config, path
+
+def test_upgrade_from_empty(alembic_db):
+    config, path = alembic_db
+    command.upgrade(config, "head")
+    conn = sqlite3.connect(path)
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master")}
+    assert {"users", "chats", "chat_members", "messages", "change_log", "messages_fts"} <= names
+    assert {"ix_messages_chat_created", "ix_messages_user_created", "uq_chat_members_chat_user"} <= names
+    # prefix of a composite index, dropped
+    assert "ix_messages_chat_id" not in names
+
+def test_duplicate_members_are_merged(alembic_db):
+    config, path = alembic_db
+    command.upgrade(config, "0003")
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'a', 'a@example.com', 'x')")
+    conn.execute("INSERT INTO chats (id, name) VALUES (1, 'chat')")
+    conn.executemany("INSERT INTO chat_members (chat_id, user_id, role) VALUES (?, ?, ?)", [(1, 1, "member"), (1, 1, "owner"), (1, 1, "member")])
+    conn.commit()
+    command.upgrade(config, "head")
+    assert conn.execute("SELECT role FROM chat_members").fetchall() == [("owner",)]
+    assert conn.execute("SELECT count(*) FROM change_log WHERE entity = 'chat_members'").fetchone() == (2,)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO chat_members (chat_id, user_id, role) VALUES (1, 1, 'member')")
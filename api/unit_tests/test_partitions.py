@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+from datetime import date, datetime, timezone
+import pytest
+from app import partitions
+from app.partitions import add_months, date_bounds, partition_name
+
+def test_add_months_crosses_years():
+    assert add_months(date(2026, 11, 1), 3) == date(2027, 2, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert partition_name(date(2027, 2, 1)) == "messages_2027_02"
+
+def test_date_bounds_end_date_covers_the_day():
+    lower, upper = date_bounds("2026-10-01", "2026-10-19")
+    assert lower == datetime(2026, 10, 1, tzinfo=timezone.utc)
+    assert upper == datetime(2026, 10, 20, tzinfo=timezone.utc)
+    # a full timestamp is an inclusive bound too
+    _, upper = date_bounds(None, "2026-10-19T12:00:00")
+    assert upper > datetime(2026, 10, 19, 12, tzinfo=timezone.utc)
+    assert date_bounds() == (None, None)
+
+def test_date_bounds_rejects_garbage():
+    with pytest.raises(ValueError):
+        date_bounds("yesterday")
+
+def test_keeper_only_runs_on_postgres():
+    from sqlalchemy import create_engine
+    sqlite = create_engine("sqlite://")
+    assert partitions.PartitionKeeper(sqlite, every=1).start() is False
+    assert partitions.maintain(sqlite) == {"partitioned": False}
+
+def test_keeper_repeats_maintenance_and_survives_errors(monkeypatch):
+    calls = []
+
+    def maintain(engine):
+        calls.append(engine)
+        if len(calls) == 1:
+            raise RuntimeError("database restarting")
+        return {"partitioned": True}
+    monkeypatch.setattr(partitions, "maintain", maintain)
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+    keeper = partitions.PartitionKeeper(engine, every=0.01)
+    assert keeper.start() is True
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    keeper.stop()
+    # the failed run did not end the loop
+    assert len(calls) >= 3
+    assert partitions.PartitionKeeper(engine, every=0).start() is False
@@ -0,0 +1,74 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app, get_db
+from app.database import Base
+from app.models import User, Chat, ChatMember, Message
+from app.profiling import track_queries, assert_query_budget, statement_shape
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+@pytest.fixture
+def seeded(client):
+    # enough rows that a per-row query would blow every budget below
+    db = TestingSessionLocal()
+    db.add_all([User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x") for i in range(1, 31)])
+    db.add_all([Chat(id=i, name=f"chat {i}") for i in range(1, 21)])
+    db.add_all([ChatMember(chat_id=i, user_id=i, role="owner") for i in range(1, 21)])
+    db.add_all([Message(chat_id=1 + i % 3, user_id=1 + i % 30, content=f"m{i}") for i in range(60)])
+    db.commit()
+    db.close()
+
+@pytest.mark.parametrize("path, budget", [
+    ("/users", 2),
+    ("/chats", 2),
+    ("/chats/1/messages", 3),
+    ("/messages?chat_id=1", 2),
+])
+def test_list_endpoint_budgets(client, seeded, path, budget):
+    with track_queries() as tracker:
+        assert client.get(path).status_code == 200
+    assert tracker.last.handler == path.split("?")[0].replace("/1/", "/{chat_id}/")
+    assert_query_budget(tracker.last, budget)
+
+def test_repeated_statements_are_flagged(client, seeded):
+    db = TestingSessionLocal()
+    with track_queries() as tracker:
+        for i in range(1, 13):
+            db.query(User).filter(User.id == i).first()
+        db.query(User).filter(User.id.in_([1, 2, 3])).all()
+        db.query(User).filter(User.id.in_([4, 5])).all()
+    db.close()
+    assert tracker.direct.count == 14
+    [(shape, times)] = tracker.direct.repeated(10)
+    assert times == 12 and "users.id = ?" in shape
+    assert statement_shape("SELECT 1 WHERE id IN (?, ?, ?)") == statement_shape("SELECT 1 WHERE id IN (?, ?)")
+    with pytest.raises(AssertionError):
+        assert_query_budget(tracker.direct, 5)
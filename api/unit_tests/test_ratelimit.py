@@ -0,0 +1,138 @@
+import json
+import logging
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app, get_db
+from app.database import Base
+from app.models import Chat
+from app import ratelimit
+from app.ratelimit import TokenBucket, message_user_limiter, message_chat_limiter, login_user_limiter
+from prometheus_client import REGISTRY
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+@pytest.fixture
+def chat(client, monkeypatch):
+    client.post("/auth/register", json={"username": "ana", "display_name": "Ana", "email": "ana@example.com", "password": "testpass123"})
+    token = client.post("/auth/token", data={"username": "ana", "password": "testpass123"}).json()["access_token"]
+    db = TestingSessionLocal()
+    db.add(Chat(id=1, name="Lobby", is_private=False))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(message_user_limiter, "burst", 3)
+    return {"Authorization": f"Bearer {token}"}, token
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def throttled(limit):
+    return REGISTRY.get_sample_value("rate_limited_requests_total", {"limit": limit}) or 0
+
+def test_token_bucket_refills(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take("k") for _ in range(3)] == [0, 0, 0]
+    assert bucket.take("k") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take("k") == 0
+    assert bucket.take("other") == 0
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    bucket = TokenBucket(rate=1, burst=2, max_keys=50)
+    for i in range(1000):
+        bucket.take(i)
+        clock.now += 0.1
+    # a key refills in 1s, so only the last ~10 still carry state
+    assert len(bucket.buckets) <= 11
+    clock.now += 1000
+    for i in range(2000):
+        bucket.take(i)
+    # nothing idle within one instant: the cap holds
+    assert len(bucket.buckets) == 50
+
+def test_rest_messages_throttled_per_user(client, chat):
+    headers, _ = chat
+    before = throttled("message_user")
+    statuses = [client.post("/chats/1/messages", json={"content": f"m{i}"}, headers=headers).status_code for i in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    response = client.post("/messages", json={"chat_id": 1, "content": "again"}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert throttled("message_user") - before == 2
+
+def test_chat_limit_applies_to_everyone(client, chat, monkeypatch):
+    headers, _ = chat
+    monkeypatch.setattr(message_chat_limiter, "burst", 1)
+    assert client.post("/chats/1/messages", json={"content": "first"}, headers=headers).status_code == 200
+    assert client.post("/chats/1/messages", json={"content": "second"}, headers=headers).status_code == 429
+
+def test_login_throttled_per_account(client, chat, monkeypatch):
+    monkeypatch.setattr(login_user_limiter, "burst", 2)
+    statuses = [client.post("/auth/token", data={"username": "Ana", "password": "wrong"}).status_code for _ in range(3)]
+    assert statuses == [401, 401, 429]
+    # another account from the same address is unaffected
+    assert client.post("/auth/token", data={"username": "bob", "password": "wrong"}).status_code == 401
+
+def test_limits_can_be_turned_off(client, chat, monkeypatch):
+    headers, _ = chat
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", False)
+    assert all(client.post("/chats/1/messages", json={"content": "x"}, headers=headers).status_code == 200 for _ in range(5))
+
+def test_websocket_sends_throttled(client, chat):
+    _, token = chat
+    with client.websocket_connect(f"/ws/chats/1?token={token}") as ws:
+        ws.receive_json()
+        replies = []
+        for i in range(4):
+            ws.send_text(json.dumps({"content": f"m{i}"}))
+            replies.append(ws.receive_json())
+        assert [r["type"] for r in replies] == ["message", "message", "message", "error"]
+        assert replies[-1]["retry_after"] >= 1
+        # the connection stays usable
+        ws.send_text("not json")
+        assert ws.receive_json()["type"] == "error"
+
+def test_redis_outage_falls_back_and_says_so(caplog):
+    # nothing listens there: the limit runs on this process' buckets, logged once per outage and limit
+    bucket = ratelimit.RedisTokenBucket("redis://127.0.0.1:1/0", rate=1, burst=2, name="outage")
+    with caplog.at_level(logging.WARNING, logger="tears-api"):
+        waits = [bucket.take("k") for _ in range(3)]
+        assert waits[:2] == [0, 0] and waits[2] > 0
+        bucket.script = lambda keys, args: b"0"
+        assert bucket.take("k") == 0
+    events = [json.loads(r.getMessage()) for r in caplog.records if '"rate_limit_redis' in r.getMessage()]
+    assert [(e["event"], e["limit"]) for e in events] == [("rate_limit_redis_unavailable", "outage"), ("rate_limit_redis_recovered", "outage")]
@@ -0,0 +1,98 @@
+import pytest
+from fastapi import Response
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app import database
+from app.main import app, get_db, READ_PRIMARY_COOKIE, recent_writers
+from app.database import Base, Replica
+from app.models import User, Chat, ChatMember
+from app.security import create_access_token
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db(response: Response):
+    try:
+        db = TestingSessionLocal()
+        db.info["response"] = response
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture
+def replica():
+    replica = Replica(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica.engine)
+    with sessionmaker(bind=replica.engine)() as db:
+        db.add(User(username="on_replica", email="replica@example.com", password_hash="x"))
+        db.commit()
+    yield replica
+    Base.metadata.drop_all(bind=replica.engine)
+
+@pytest.fixture
+def client(replica, monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    monkeypatch.setattr(database, "replicas", [replica])
+    yield TestClient(app)
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+    recent_writers.clear()
+
+def usernames(client):
+    return [u["username"] for u in client.get("/users").json()["items"]]
+
+def test_reads_go_to_replica(client):
+    assert usernames(client) == ["on_replica"]
+
+def test_reads_follow_writes_to_primary(client):
+    response = client.post("/auth/register", json={"username": "writer", "display_name": "Writer", "email": "writer@example.com", "password": "secret123"})
+    assert response.status_code == 200
+    assert READ_PRIMARY_COOKIE in response.cookies
+    # the client now carries the cookie: its reads see its own write
+    assert usernames(client) == ["writer"]
+    client.cookies.clear()
+    assert usernames(client) == ["on_replica"]
+
+def test_bearer_writes_pin_reads_without_cookies(client):
+    # an api client that drops cookies still reads back what it just wrote, by its user id
+    db = TestingSessionLocal()
+    db.add(User(id=1, username="integration", email="integration@example.com", password_hash="x"))
+    db.commit()
+    db.close()
+    auth = {"Authorization": f"Bearer {create_access_token(subject=1)}"}
+    assert client.post("/chats", json={"name": "Fresh"}, headers=auth).status_code == 200
+    client.cookies.clear()
+    assert [c["name"] for c in client.get("/chats", headers=auth).json()["items"]] == ["Fresh"]
+    # only that user: others still read the replica
+    assert client.get("/chats").json()["items"] == []
+    assert [u["username"] for u in client.get("/users", headers={"Authorization": f"Bearer {create_access_token(subject=2)}"}).json()["items"]] == ["on_replica"]
+
+@pytest.mark.parametrize("path, body, members", [
+    ("/messages/bulk", {"messages": [{"chat_id": 1, "content": "relayed"}]}, [1]),
+    ("/chats/1/members/bulk", {"user_ids": [2]}, [1]),
+    ("/chats/1/members/bulk/remove", {"user_ids": [2]}, [1, 2]),
+], ids=["messages", "add_members", "remove_members"])
+def test_bulk_writes_pin_reads_to_primary(client, path, body, members):
+    # these answer with orjson; the cookie set on commit has to make it into that response too
+    db = TestingSessionLocal()
+    db.add_all([User(id=1, username="owner", email="owner@example.com", password_hash="x"), User(id=2, username="bob", email="bob@example.com", password_hash="x")])
+    db.add_all([Chat(id=1, name="Lobby")] + [ChatMember(chat_id=1, user_id=u, role="owner" if u == 1 else "member") for u in members])
+    db.commit()
+    db.close()
+    response = client.post(path, json=body, headers={"Authorization": f"Bearer {create_access_token(subject=1)}"})
+    assert response.status_code == 200
+    assert READ_PRIMARY_COOKIE in response.cookies
+
+def test_down_replica_falls_back_to_primary(client, monkeypatch):
+    broken = Replica("sqlite:////nonexistent/dir/replica.db")
+    monkeypatch.setattr(database, "replicas", [broken])
+    assert usernames(client) == []
+    assert broken.down_until > 0
@@ -0,0 +1,141 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.main import app, get_db
+from app.database import Base
+from app import crud, cache
+from app.models import User, Chat, ChatMember, Message
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+@pytest.fixture(scope="function")
+def setup_test_db():
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    Base.metadata.drop_all(bind=engine)
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def client(setup_test_db):
+    return TestClient(app)
+
+@pytest.fixture
+def seeded(client):
+    client.post(
+        "/auth/register",
+        json={
+            "username": "searcher",
+            "display_name": "Searcher",
+            "email": "search@example.com",
+            "password": "testpass123"
+        }
+    )
+    token = client.post("/auth/token", data={"username": "searcher", "password": "testpass123"}).json()["access_token"]
+
+    db = TestingSessionLocal()
+    other = User(username="other", display_name="Other", email="other@example.com", password_hash="x")
+    db.add(other)
+    db.flush()
+    public = Chat(name="Public", is_private=False)
+    private = Chat(name="Private", is_private=True)
+    db.add_all([public, private])
+    db.flush()
+    db.add(ChatMember(chat_id=private.id, user_id=other.id))
+    db.add_all([
+        Message(chat_id=public.id, user_id=other.id, content="the release is ready"),
+        Message(chat_id=public.id, user_id=other.id, content="release notes for the release, release today"),
+        Message(chat_id=public.id, user_id=other.id, content="prerelease builds are broken"),
+        Message(chat_id=public.id, user_id=other.id, content="lunch anyone?"),
+        Message(chat_id=private.id, user_id=other.id, content="secret release plan"),
+    ])
+    db.commit()
+    ids = {"public": public.id, "private": private.id, "other": other.id}
+    db.close()
+    return {"token": token, **ids}
+
+def test_search_matches_words_and_ranks(client, seeded):
+    response = client.get("/messages/search", params={"q": "release"})
+    assert response.status_code == 200
+    items = response.json()["items"]
+    # whole words only: "prerelease" is not a match, the private chat is hidden
+    assert [i["content"] for i in items] == ["release notes for the release, release today", "the release is ready"]
+    assert items[0]["rank"] >= items[1]["rank"]
+    assert items[0]["username"] == "other"
+
+def test_search_private_chat_for_members(client, seeded):
+    db = TestingSessionLocal()
+    me = db.query(User).filter(User.username == "searcher").first()
+    db.add(ChatMember(chat_id=seeded["private"], user_id=me.id))
+    db.commit()
+    db.close()
+    headers = {"Authorization": f"Bearer {seeded['token']}"}
+    items = client.get("/messages/search", params={"q": "release plan"}, headers=headers).json()["items"]
+    assert [i["content"] for i in items] == ["secret release plan"]
+    assert client.get("/messages/search", params={"q": "release plan"}).json()["items"] == []
+
+def test_search_cursor_pages(client, seeded):
+    seen = []
+    cursor = None
+    for order in ("rank", "recent"):
+        seen = []
+        cursor = None
+        while True:
+            params = {"q": "release", "limit": 1, "order": order}
+            if cursor:
+                params["cursor"] = cursor
+            data = client.get("/messages/search", params=params).json()
+            seen += [i["id"] for i in data["items"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == 2
+    assert client.get("/messages/search", params={"q": "release", "cursor": "nope"}).status_code == 400
+
+def test_list_messages_q_uses_index(client, seeded):
+    db = TestingSessionLocal()
+    data = crud.list_messages(db, q_text="lunch")
+    db.close()
+    assert data["total_items"] == 1
+    assert [m.content for m in data["items"]] == ["lunch anyone?"]
+
+def test_chat_search_fuzzy_and_ranked(client, seeded):
+    db = TestingSessionLocal()
+    db.add_all([Chat(name="Release planning"), Chat(name="Team releases"), Chat(name="Gardening")])
+    db.commit()
+    db.close()
+    names = [c["name"] for c in client.get("/chats", params={"search": "release"}).json()["items"]]
+    # prefix first, then substring; fuzzy typo still finds them
+    assert names == ["Release planning", "Team releases"]
+    names = [c["name"] for c in client.get("/chats", params={"search": "relaese planing"}).json()["items"]]
+    assert names == ["Release planning"]
+
+def test_chat_search_follows_renames_and_deletes(client, seeded):
+    assert client.get("/chats", params={"search": "garden"}).json()["items"] == []
+    db = TestingSessionLocal()
+    chat = db.query(Chat).filter(Chat.name == "Public").first()
+    chat.name = "Garden club"
+    db.commit()
+    # written behind the api's back: anonymous /chats pages are cached until this (or the ttl)
+    cache.invalidate("chats")
+    assert [c["name"] for c in client.get("/chats", params={"search": "garden"}).json()["items"]] == ["Garden club"]
+    db.delete(db.query(Chat).filter(Chat.name == "Private").first())
+    db.commit()
+    db.close()
+    cache.invalidate("chats")
+    assert client.get("/chats", params={"search": "priv"}).json()["meta"]["total_items"] == 0
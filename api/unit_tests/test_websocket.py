@@ -110,3 +110,20 @@ def test_websocket_invalid_message_format(client, setup_chat):
 
         data = websocket.receive_json()
         assert data["type"] == "error"
+
+async def test_broadcast_survives_members_leaving_midway():
+    from app.websocket import ConnectionManager
+    manager = ConnectionManager()
+    received = []
+
+    class FakeSocket:
+        def __init__(self, user_id):
+            self.user_id = user_id
+        async def send_json(self, message):
+            received.append(self.user_id)
+            # another member drops while the broadcast is still going
+            manager.disconnect(1, 2)
+
+    manager.active_connections[1] = {1: FakeSocket(1), 2: FakeSocket(2), 3: FakeSocket(3)}
+    await manager.broadcast_to_chat({"type": "message"}, 1)
+    assert received[0] == 1 and 3 in received
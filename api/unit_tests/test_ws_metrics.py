@@ -0,0 +1,67 @@
+import asyncio
+import random
+from prometheus_client import generate_latest, REGISTRY
+from app.topk import SpaceSaving
+from app.websocket import ConnectionManager
+from app.metrics import hot_chats, websocket_send_queue_depth, WS_HOT_CHATS
+
+class FakeSocket:
+    def __init__(self, delay=0):
+        self.delay = delay
+    async def send_json(self, message):
+        await asyncio.sleep(self.delay)
+
+def sample_value(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+def test_space_saving_finds_heavy_hitters_in_bounded_memory():
+    rng = random.Random(7)
+    sketch = SpaceSaving(capacity=20)
+    # three hot keys in a long tail of 5000 that each show up about once
+    stream = [1] * 3000 + [2] * 2000 + [3] * 1000 + [rng.randint(100, 5100) for _ in range(5000)]
+    rng.shuffle(stream)
+    seen = {}
+    for key in stream:
+        sketch.offer(key)
+        for k, count, error in sketch.top(20):
+            # a tracked key's estimate never goes down
+            assert count >= seen.get(k, 0)
+            seen[k] = count
+    assert len(sketch.counters) == 20
+    top = sketch.top(3)
+    assert [k for k, _, _ in top] == [1, 2, 3]
+    for key, count, error in top:
+        assert count - error <= stream.count(key) <= count
+
+async def test_scrape_stays_bounded_as_chats_grow():
+    manager = ConnectionManager()
+    hot_chats.clear()
+
+    async def message_chats(chat_ids):
+        for chat_id in chat_ids:
+            manager.active_connections[chat_id] = {1: FakeSocket()}
+            await manager.broadcast_to_chat({"type": "message"}, chat_id)
+            del manager.active_connections[chat_id]
+
+    await message_chats(range(1, 301))
+    before = generate_latest(REGISTRY).decode()
+    await message_chats(range(301, 3001))
+    after = generate_latest(REGISTRY).decode()
+    hot = [line for line in after.splitlines() if line.startswith("websocket_hot_chat_messages_total{")]
+    assert 0 < len(hot) <= WS_HOT_CHATS
+    assert len(after.splitlines()) == len(before.splitlines())
+    assert 'websocket_messages_total{chat_id=' not in after
+
+async def test_broadcast_metrics():
+    manager = ConnectionManager()
+    room_size_count = sample_value("websocket_room_size_count")
+    deep_sends = sample_value("websocket_send_queue_depth_bucket", {"le": "1.0"})
+    manager.active_connections[7] = {1: FakeSocket(delay=0.01), 2: FakeSocket(), 3: FakeSocket()}
+    # two messages at once: the second waits behind the first on the slow member
+    await asyncio.gather(
+        manager.broadcast_to_chat({"type": "message"}, 7),
+        manager.send_personal_message({"type": "message"}, 7, 1),
+    )
+    assert sample_value("websocket_room_size_count") - room_size_count == 1
+    assert sample_value("websocket_send_queue_depth_bucket", {"le": "2.0"}) - sample_value("websocket_send_queue_depth_bucket", {"le": "1.0"}) >= 1
+    assert manager.pending_sends == {}
@@ -1,3 +1,4 @@
+import os
 import sys
 import asyncio
 from typing import Optional, List, Any
@@ -18,43 +19,28 @@ async def prepare_etl(dry_run: bool = False, batch_size: int = 1000, incremental
     return await asyncio.to_thread(prepare, dry_run, batch_size, incremental, since, reset)
 
 @activity.defn
-async def extract_messages(dry_run: bool = False, batch_size: int = 1000, incremental: bool = False, since: Optional[str] = None, reset: bool = False) -> dict:
+async def extract_manifest(dry_run: bool = False, batch_size: int = 1000, incremental: bool = False, since: Optional[str] = None, reset: bool = False) -> dict:
+    # single pass over the source; the manifest it stores is keyed by the returned run_id
     from importlib import import_module
     etl_mod = import_module("api.data.etl")
     prepare = getattr(etl_mod, "prepare_etl")
     return await asyncio.to_thread(prepare, dry_run, batch_size, incremental, since, reset)
 
 @activity.defn
-async def transform_messages(message_ids: List[int], batch_size: int = 1000) -> dict:
+async def transform_messages(run_id: str, batch_size: int = 1000) -> dict:
+    # loads analytics_messages and applies the daily rollup deltas in the same transactions
     from importlib import import_module
     etl_mod = import_module("api.data.etl")
-    proc = getattr(etl_mod, "process_message_batch")
-
-    def run_all():
-        total = 0
-        for i in range(0, len(message_ids), batch_size):
-            batch = message_ids[i:i+batch_size]
-            res = proc(batch, batch_size)
-            total += int(res.get('messages_written', 0))
-        return {'messages_written': total}
-
-    return await asyncio.to_thread(run_all)
-
-@activity.defn
-async def extract_users(dry_run: bool = False, incremental: bool = False, since: Optional[str] = None, reset: bool = False) -> dict:
-    from importlib import import_module
-    etl_mod = import_module("api.data.etl")
-    prep = getattr(etl_mod, "prepare_etl")
-    res = await asyncio.to_thread(prep, dry_run, 0, incremental, since, reset)
-    return {'user_ids': res.get('affected_user_ids', []), 'new_max_id': res.get('new_max_id')}
+    proc = getattr(etl_mod, "process_messages")
+    return await asyncio.to_thread(proc, run_id, batch_size)
 
 
 @activity.defn
-async def transform_users(user_ids: List[int], new_max_id: int = None) -> dict:
+async def transform_users(run_id: str, batch_size: int = 1000) -> dict:
     from importlib import import_module
     etl_mod = import_module("api.data.etl")
-    fin = getattr(etl_mod, "finalize_metadata")
-    return await asyncio.to_thread(fin, [], user_ids, new_max_id)
+    fin = getattr(etl_mod, "finalize_users")
+    return await asyncio.to_thread(fin, run_id, batch_size)
 
 
 @activity.defn
@@ -63,29 +49,21 @@ async def load_users() -> dict:
     etl_mod = import_module("api.data.etl")
     ANALYTICS_DB = getattr(etl_mod, 'ANALYTICS_DB')
     ensure = getattr(etl_mod, 'ensure_target_schema')
-    from sqlalchemy import create_engine, select
+    from sqlalchemy import create_engine, select, func
     engine = create_engine(ANALYTICS_DB)
     tables = ensure(engine)
     with engine.connect() as conn:
-        res = conn.execute(select(tables['users'].c.id)).fetchall()
-        return {'analytics_users_count': len(res)}
-
-
-@activity.defn
-async def extract_chats(dry_run: bool = False, incremental: bool = False, since: Optional[str] = None, reset: bool = False) -> dict:
-    from importlib import import_module
-    etl_mod = import_module("api.data.etl")
-    prep = getattr(etl_mod, "prepare_etl")
-    res = await asyncio.to_thread(prep, dry_run, 0, incremental, since, reset)
-    return {'chat_ids': res.get('affected_chat_ids', []), 'new_max_id': res.get('new_max_id')}
+        res = conn.execute(select(func.count()).select_from(tables['users'])).scalar()
+        return {'analytics_users_count': int(res or 0)}
 
 
 @activity.defn
-async def transform_chats(chat_ids: List[int], new_max_id: int = None) -> dict:
+async def transform_chats(run_id: str, batch_size: int = 1000) -> dict:
+    # chat metrics include member counts, so this also covers chat_members
     from importlib import import_module
     etl_mod = import_module("api.data.etl")
-    fin = getattr(etl_mod, "finalize_metadata")
-    return await asyncio.to_thread(fin, chat_ids, [], new_max_id)
+    fin = getattr(etl_mod, "finalize_chats")
+    return await asyncio.to_thread(fin, run_id, batch_size)
 
 
 @activity.defn
@@ -94,39 +72,28 @@ async def load_chats() -> dict:
     etl_mod = import_module("api.data.etl")
     ANALYTICS_DB = getattr(etl_mod, 'ANALYTICS_DB')
     ensure = getattr(etl_mod, 'ensure_target_schema')
-    from sqlalchemy import create_engine, select
+    from sqlalchemy import create_engine, select, func
     engine = create_engine(ANALYTICS_DB)
     tables = ensure(engine)
     with engine.connect() as conn:
-        res = conn.execute(select(tables['chats'].c.id)).fetchall()
-        return {'analytics_chats_count': len(res)}
-
-
-@activity.defn
-async def extract_chat_members(dry_run: bool = False) -> dict:
-    from importlib import import_module
-    etl_mod = import_module("api.data.etl")
-    prep = getattr(etl_mod, "prepare_etl")
-    res = await asyncio.to_thread(prep, dry_run, 0, False, None, False)
-    return {'chat_ids': res.get('affected_chat_ids', [])}
+        res = conn.execute(select(func.count()).select_from(tables['chats'])).scalar()
+        return {'analytics_chats_count': int(res or 0)}
 
 
 @activity.defn
-async def transform_chat_members(chat_ids: List[int]) -> dict:
+async def complete_run(run_id: str) -> dict:
     from importlib import import_module
     etl_mod = import_module("api.data.etl")
-    fin = getattr(etl_mod, "finalize_metadata")
-    return await asyncio.to_thread(fin, chat_ids, [], None)
+    done = getattr(etl_mod, "complete_run")
+    return await asyncio.to_thread(done, run_id)
 
 
 @activity.defn
-async def load_chat_members() -> dict:
-    return {'status': 'ok'}
-
-
-@activity.defn
-async def load_messages(affected_chat_ids: List[int], min_dt_iso: str, max_dt_iso: str, batch_size: int = 1000) -> dict:
+async def export_parquet() -> dict:
+    # optional stage: only runs when the worker has somewhere to write the parquet files
+    if not os.getenv("PARQUET_EXPORT_DIR"):
+        return {'skipped': True}
     from importlib import import_module
-    etl_mod = import_module("api.data.etl")
-    fin = getattr(etl_mod, "finalize_daily_rollups")
-    return await asyncio.to_thread(fin, affected_chat_ids, min_dt_iso, max_dt_iso, batch_size)
\ No newline at end of file
+    export_mod = import_module("api.data.export_parquet")
+    export = getattr(export_mod, "export_parquet")
+    return await asyncio.to_thread(export)
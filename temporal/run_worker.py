@@ -18,18 +18,14 @@ from temporal.workflows import ETLWorkflow
 from temporal.activities import (
     run_etl,
     prepare_etl,
-    extract_messages,
+    extract_manifest,
     transform_messages,
-    load_messages,
-    extract_users,
     transform_users,
     load_users,
-    extract_chats,
     transform_chats,
     load_chats,
-    extract_chat_members,
-    transform_chat_members,
-    load_chat_members,
+    complete_run,
+    export_parquet,
 )
 
 async def main():
@@ -54,18 +50,14 @@ async def main():
             run_etl,
             # activities
             prepare_etl,
-            extract_messages,
+            extract_manifest,
             transform_messages,
-            load_messages,
-            extract_users,
             transform_users,
             load_users,
-            extract_chats,
             transform_chats,
             load_chats,
-            extract_chat_members,
-            transform_chat_members,
-            load_chat_members,
+            complete_run,
+            export_parquet,
         ],
     )
     await worker.run()